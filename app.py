@@ -3,19 +3,20 @@ import string
 import sys
 import traceback
 import logging
-import csv
 import json
 import webbrowser
 import os
 import clipboard
 from types import TracebackType
-from typing import List, Optional, Type
+from typing import Callable, List, Optional, Type
 from PyQt5 import QtCore, QtWidgets, uic
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import SessionTransaction, Session
-from harnesslabeler import config, models, updater
+from harnesslabeler import backends, config, enums, models, updater, backup, diffrestore, errors, importer, journal, loginevents, loginhistory, migrations, nativedump, replica, repository, users, validation
+from harnesslabeler import database
 from harnesslabeler.database import DBContext
-from harnesslabeler.customqwidgets import ResizableMessageBox
+from harnesslabeler.customqwidgets import ProgressDialog, ResizableMessageBox
+from harnesslabeler.workers import Worker
 
 
 logger = logging.getLogger("frontend")
@@ -41,17 +42,79 @@ sys.excepthook = handle_exception
 
 WIDTH, HEIGHT = 800, 1200
 
-# TODO: Add user administration.
+class UserTableModel(QtCore.QAbstractTableModel):
+    """Users found by a search, read one page at a time as the view scrolls down."""
+
+    COLUMNS = ("Id", "First Name", "Last Name", "Username", "Active", "Last Login Date")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = [] # type: List[users.UserRow]
+        self.fetch_page = None # type: Optional[Callable[[Optional[tuple]], List[users.UserRow]]]
+        self.has_more = False
+
+    def reset(self, fetch_page: Callable[[Optional[tuple]], List[users.UserRow]]) -> None:
+        """Show the results of a new search. fetch_page(after) returns the page after the sort_key given."""
+        self.beginResetModel()
+        self.rows = []
+        self.fetch_page = fetch_page
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore(QtCore.QModelIndex())
+
+    def user_id(self, row: int) -> int:
+        return self.rows[row].id
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index: QtCore.QModelIndex, role: int=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        user = self.rows[index.row()]
+        return (
+            str(user.id), user.first_name, user.last_name, user.username,
+            "Yes" if user.active else "No", user.last_login_date_str
+        )[index.column()]
+
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return not parent.isValid() and self.has_more
+
+    def fetchMore(self, parent: QtCore.QModelIndex) -> None:
+        if parent.isValid() or not self.has_more:
+            return
+        page = self.fetch_page(self.rows[-1].sort_key if self.rows else None)
+        self.has_more = len(page) == config.USER_PAGE_SIZE
+        if not page:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+
 class UserAdministrationDialog(QtWidgets.QDialog):
-    def __init__(self, current_user_id: int, session: Session, parent):
+    """Create, edit, delete and search users. Every load and save uses its own short session,
+    the user being edited is kept detached in between."""
+
+    def __init__(self, current_user_id: int, parent):
         super().__init__(parent)
         uic.loadUi('ui/useradministration.ui', self) # Load the .ui file
         self.resize(HEIGHT, WIDTH)
         self.selected_user = None # type: models.User
+        self.selected_user_logins = 0
         self.current_user_id = current_user_id
         self.create_new_user = False
         self.save_required = False
-        self.session = session
+        self.user_model = UserTableModel(self)
+        self.search_tableView.setModel(self.user_model)
 
         self.connect_signals()
         self.reload_search_table()
@@ -64,10 +127,13 @@ class UserAdministrationDialog(QtWidgets.QDialog):
         self.search_first_name_lineEdit.editingFinished.connect(lambda x=self.search_first_name_lineEdit: self.clean_text_input(x))
         self.search_last_name_lineEdit.editingFinished.connect(lambda x=self.search_last_name_lineEdit: self.clean_text_input(x))
         self.search_username_lineEdit.editingFinished.connect(lambda x=self.search_username_lineEdit: self.clean_text_input(x))
+        self.search_first_name_lineEdit.returnPressed.connect(self.reload_search_table)
+        self.search_last_name_lineEdit.returnPressed.connect(self.reload_search_table)
+        self.search_username_lineEdit.returnPressed.connect(self.reload_search_table)
         self.search_pushButton.clicked.connect(self.reload_search_table)
         self.search_show_all_checkBox.toggled.connect(self.reload_search_table)
         self.search_view_pushButton.clicked.connect(self.on_view_clicked)
-        self.search_tableWidget.itemDoubleClicked.connect(self.on_view_clicked)
+        self.search_tableView.doubleClicked.connect(self.on_view_clicked)
 
         self.first_name_lineEdit.editingFinished.connect(lambda x=self.first_name_lineEdit: self.clean_text_input(x))
         self.last_name_lineEdit.editingFinished.connect(lambda x=self.last_name_lineEdit: self.clean_text_input(x))
@@ -92,15 +158,17 @@ class UserAdministrationDialog(QtWidgets.QDialog):
     
     def get_selected_user_id(self) -> Optional[int]:
         logger.info("[UserAdministrationDialog] Getting selected user id.")
-        items = self.search_tableWidget.selectedItems()
-        if items:
-            logger.debug(f"[UserAdministrationDialog] Selected user id: {items[0].text()}")
-            return int(items[0].text())
+        rows = self.search_tableView.selectionModel().selectedRows()
+        if rows:
+            user_id = self.user_model.user_id(rows[0].row())
+            logger.debug(f"[UserAdministrationDialog] Selected user id: {user_id}")
+            return user_id
         return None
     
     def clear_user_data(self) -> None:
         logger.info("[UserAdministrationDialog] Clearing loaded user data.")
         self.last_login_value_label.setText("")
+        self.recent_logins_value_label.setText("")
         self.first_name_lineEdit.setText("")
         self.last_name_lineEdit.setText("")
         self.username_lineEdit.setText("")
@@ -124,6 +192,7 @@ class UserAdministrationDialog(QtWidgets.QDialog):
         self.save_pushButton.setEnabled(True)
 
         self.last_login_value_label.setText(self.selected_user.last_login_date_str)
+        self.recent_logins_value_label.setText(str(self.selected_user_logins))
         self.first_name_lineEdit.setText(self.selected_user.first_name)
         self.last_name_lineEdit.setText(self.selected_user.last_name)
         self.username_lineEdit.setText(self.selected_user.username)
@@ -138,7 +207,14 @@ class UserAdministrationDialog(QtWidgets.QDialog):
         if not user_id:
             return
         
-        self.selected_user = self.session.query(models.User).filter(models.User.id == user_id).first() # type: models.User
+        with DBContext() as session:
+            self.selected_user = repository.user_by_id(session, user_id) # type: models.User
+            self.selected_user_logins = loginhistory.login_count(session, user_id)
+            session.expunge_all()
+        if not self.selected_user:
+            QtWidgets.QMessageBox.warning(self, "Warning", f"Could not find user with id '{user_id}'.")
+            self.reload_search_table()
+            return
         logger.debug(f"[UserAdministrationDialog] Selected user '{self.selected_user}'")
         self.reload_user_data()
 
@@ -167,38 +243,29 @@ class UserAdministrationDialog(QtWidgets.QDialog):
         if result == QtWidgets.QMessageBox.StandardButton.No:
             return
         
-        current_user = self.session.query(models.User).filter(models.User.id == self.current_user_id).first() # type: models.User
-        if not current_user:
-            logger.error(f"Error deleting user '{self.selected_user}'. Could not find logged in user.")
-            QtWidgets.QMessageBox.warning(
-                self,
-                "Error",
-                f"Error deleting user '{self.selected_user}'. Could not find logged in user.",
-                QtWidgets.QMessageBox.StandardButton.Ok
-            )
+        user_id = self.selected_user.id
+        try:
+            with DBContext() as session:
+                summary = users.delete_users(session, [user_id], self.current_user_id)
+            if summary.kept_with_labels:
+                logger.warning(f"[UserAdministrationDialog] User '{self.selected_user}' has created and or modifed labels, not deleted.")
+                result = QtWidgets.QMessageBox.question(
+                    self,
+                    "Delete",
+                    f"User '{self.selected_user}' has created and or modifed labels and can not be deleted. Deactivate the user instead?",
+                    QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No
+                )
+                if result != QtWidgets.QMessageBox.StandardButton.Yes:
+                    return
+                with DBContext() as session:
+                    summary = users.deactivate_users(session, [user_id], self.current_user_id)
+        except Exception as error:
+            logger.exception(f"Error deleting user '{self.selected_user}'.")
+            QtWidgets.QMessageBox.warning(self, "Error", f"Error deleting user '{self.selected_user}'. Error: {error}")
             return
-        
-        labels = self.session.query(models.BreakoutLabel).filter(models.BreakoutLabel.created_by_user_id == self.selected_user.id).all() # type: List[models.BreakoutLabel]
-        labels.extend(self.session.query(models.BreakoutLabel).filter(models.BreakoutLabel.modified_by_user_id == self.selected_user.id).all()) # type: List[models.BreakoutLabel]
 
-        if labels:
-            logger.error(f"Error deleting user '{self.selected_user}'. This user has created and or modifed labels. Deactivate user to hide.")
-            QtWidgets.QMessageBox.warning(
-                self,
-                "Error",
-                f"Error deleting user '{self.selected_user}'. This user has created and or modifed labels. Deactivate user to hide.",
-                QtWidgets.QMessageBox.StandardButton.Ok
-            )
-            return
-        
-        logs = self.session.query(models.UserLoginLog).filter(models.UserLoginLog.user_id == self.selected_user.id).all() # type: List[models.UserLoginLog]
-        logger.info(f"[UserAdministrationDialog] Deleting user {len(logs)} login logs.")
-        for log in logs:
-            self.session.delete(log)
-        self.session.commit()
-        self.session.delete(self.selected_user)
         self.selected_user = None
-        self.session.commit()
+        QtWidgets.QMessageBox.information(self, "Delete", str(summary))
 
         self.save_pushButton.setEnabled(False)
         self.delete_pushButton.setEnabled(False)
@@ -211,11 +278,6 @@ class UserAdministrationDialog(QtWidgets.QDialog):
         self.save()
         self.save_pushButton.setEnabled(False)
     
-    def clear_search_table(self) -> None:
-        logger.debug("[UserAdministrationDialog] Clearing search table.")
-        self.search_tableWidget.clearContents()
-        self.search_tableWidget.setRowCount(0)
-    
     def save(self) -> None:
         if not self.selected_user and not self.create_new_user:
             return
@@ -246,12 +308,17 @@ class UserAdministrationDialog(QtWidgets.QDialog):
                 active=active
             )
             try:
-                self.session.add(user)
-                self.session.commit()
+                with DBContext() as session:
+                    try:
+                        session.add(user)
+                        session.commit()
+                        session.expunge(user)
+                    except Exception:
+                        session.rollback()
+                        raise
                 self.create_new_user = False
                 logger.info(f"[UserAdministrationDialog] Created new user '{user}'.")
             except Exception as error:
-                self.session.rollback()
                 logger.exception(f"Error creating new user '{user}'.")
                 QtWidgets.QMessageBox.warning(
                     self,
@@ -263,24 +330,33 @@ class UserAdministrationDialog(QtWidgets.QDialog):
             self.selected_user = user
         else:
             logger.info(f"[UserAdministrationDialog] Updating user '{self.selected_user}'.")
-            self.selected_user.active = active
-            
-            if first_name != "":
-                self.selected_user.first_name = first_name
-            
-            if last_name != "":
-                self.selected_user.last_name = last_name
-            
-            if username != "":
-                self.selected_user.username = username
-            
-            if password != "":
-                self.selected_user.password = password
-
             try:
-                self.session.commit()
+                with DBContext() as session:
+                    try:
+                        user = repository.user_by_id(session, self.selected_user.id) # type: models.User
+                        if not user:
+                            raise errors.Error(f"User '{self.selected_user}' was deleted by another station.")
+                        user.active = active
+                        
+                        if first_name != "":
+                            user.first_name = first_name
+                        
+                        if last_name != "":
+                            user.last_name = last_name
+                        
+                        if username != "":
+                            user.username = username
+                        
+                        if password != "":
+                            user.password = password
+
+                        session.commit()
+                        session.expunge(user)
+                    except Exception:
+                        session.rollback()
+                        raise
+                self.selected_user = user
             except Exception as error:
-                self.session.rollback()
                 logger.exception(f"Error updating user '{self.selected_user}'.")
                 QtWidgets.QMessageBox.warning(
                     self,
@@ -290,7 +366,7 @@ class UserAdministrationDialog(QtWidgets.QDialog):
                     )
                 return
 
-        self.session.refresh(self.selected_user)
+        users.refresh_directory()
         self.save_required = False
         self.create_new_user = False
         self.reload_user_data()
@@ -319,7 +395,6 @@ class UserAdministrationDialog(QtWidgets.QDialog):
 
     def reload_search_table(self) -> None:
         logger.info("[UserAdministrationDialog] Reloading search table.")
-        self.clear_search_table()
 
         if not self.selected_user:
             self.save_pushButton.setEnabled(False)
@@ -328,37 +403,19 @@ class UserAdministrationDialog(QtWidgets.QDialog):
             self.save_pushButton.setEnabled(True)
             self.delete_pushButton.setEnabled(True)
         
-        query = self.session.query(models.User)
         first_name = self.search_first_name_lineEdit.text()
         last_name = self.search_last_name_lineEdit.text()
         username = self.search_username_lineEdit.text()
         show_all = self.search_show_all_checkBox.isChecked()
+        logger.debug(f"[UserAdministrationDialog] Query Parameters: show_all: {show_all}, first_name: '{first_name}', last_name: '{last_name}', username: '{username}'.")
 
-        if not show_all:
-            query = query.filter(models.User.active == True)
+        def fetch_page(after: Optional[tuple]) -> List[users.UserRow]:
+            # The list only reads, so it may come from the read replica.
+            with DBContext(read_only=True) as session:
+                return users.search_users(session, first_name, last_name, username, active_only=not show_all, after=after)
 
-        if first_name != "":
-            query = query.filter(models.User.first_name == first_name)
-        
-        if last_name != "":
-            query = query.filter(models.User.last_name == last_name)
-        
-        if username != "":
-            query = query.filter(models.User.username == username)
-        
-        users = query.all() # type: List[models.User]
-        logger.debug(f"[UserAdministrationDialog] Query: {query}")
-        logger.debug(f"[UserAdministrationDialog] Query Parameters: show_all: {show_all}, first_name: '{first_name}', last_name: '{last_name}', username: '{username}'.")
-        
-        for user in users:
-            self.search_tableWidget.insertRow(self.search_tableWidget.rowCount())
-            self.search_tableWidget.setItem(self.search_tableWidget.rowCount() - 1, 0, QtWidgets.QTableWidgetItem(str(user.id)))
-            self.search_tableWidget.setItem(self.search_tableWidget.rowCount() - 1, 1, QtWidgets.QTableWidgetItem(str(user.first_name)))
-            self.search_tableWidget.setItem(self.search_tableWidget.rowCount() - 1, 2, QtWidgets.QTableWidgetItem(str(user.last_name)))
-            self.search_tableWidget.setItem(self.search_tableWidget.rowCount() - 1, 3, QtWidgets.QTableWidgetItem(str(user.username)))
-            self.search_tableWidget.setItem(self.search_tableWidget.rowCount() - 1, 4, QtWidgets.QTableWidgetItem(str(user.last_login_date_str)))
-        
-        self.search_tableWidget.resizeColumnsToContents()
+        self.user_model.reset(fetch_page)
+        self.search_tableView.resizeColumnsToContents()
         
 
 class LabelDialog(QtWidgets.QDialog):
@@ -403,8 +460,18 @@ class LabelDialog(QtWidgets.QDialog):
         breakout_label = self.breakout_label_radioButton.isChecked()
 
         if not self.label:
-            self.label = models.BreakoutLabel.create(
-                part_number, label_value,
+            try:
+                with DBContext() as session:
+                    sort_index = repository.next_sort_index(session, part_number)
+            except DBAPIError as error:
+                if not journal.is_connection_error(error):
+                    raise
+                # Offline labels get their sort_index when the journal is replayed.
+                sort_index = None
+            self.label = models.BreakoutLabel(
+                part_number=part_number,
+                value=label_value,
+                sort_index=sort_index,
                 rolling_label=rolling_label
             )
         else:
@@ -418,6 +485,28 @@ class LabelDialog(QtWidgets.QDialog):
         return self.label
 
 
+class DiagnosticsDialog(QtWidgets.QDialog):
+    """Shows connection pool statistics and the query profile. Does not block the main window."""
+    def __init__(self, parent):
+        super().__init__(parent)
+        uic.loadUi('ui/diagnosticsdialog.ui', self) # Load the .ui file
+        self.setWindowTitle(f"{config.PROGRAM_NAME} Diagnostics")
+        self.refresh_pushButton.clicked.connect(self.reload_report)
+        self.save_profile_pushButton.clicked.connect(self.on_save_profile_clicked)
+        self.save_profile_pushButton.setEnabled(database.query_profiler.enabled)
+        self.close_pushButton.clicked.connect(self.close)
+        self.reload_report()
+
+    def reload_report(self) -> None:
+        report = database.pool_statistics.report(database.engine.pool, database.read_engine.pool if database.read_engine else None)
+        report += "\n\n" + database.query_profiler.report()
+        self.report_plainTextEdit.setPlainText(report)
+
+    def on_save_profile_clicked(self) -> None:
+        file_path = database.query_profiler.dump()
+        QtWidgets.QMessageBox.information(self, "Query Profile", f"Query profile saved to '{file_path}'.")
+
+
 class LoginDialog(QtWidgets.QDialog):
     def __init__(self, parent):
         super().__init__(parent)
@@ -426,6 +515,7 @@ class LoginDialog(QtWidgets.QDialog):
         uic.loadUi('ui/logindialog.ui', self) # Load the .ui file
         self.setWindowTitle(f"{config.PROGRAM_NAME} Login")
         self.user = None # type: models.User
+        self.worker = None # type: Optional[Worker]
         self.connect_signals()
         self.resize(500, 150)
 
@@ -444,8 +534,43 @@ class LoginDialog(QtWidgets.QDialog):
         self.reject()
         self.close_and_return()
 
+    def reject(self) -> None:
+        # The worker thread must finish before the dialog goes away.
+        if self.worker:
+            return
+        super().reject()
+
+    def set_busy(self, busy: bool) -> None:
+        self.busy_progressBar.setVisible(busy)
+        self.username_lineEdit.setEnabled(not busy)
+        self.password_lineEdit.setEnabled(not busy)
+        self.login_pushButton.setEnabled(not busy)
+        self.exit_pushButton.setEnabled(not busy)
+        if busy:
+            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.BusyCursor)
+        else:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    @staticmethod
+    def check_credentials(username: str, password: str) -> Optional[models.User]:
+        """Return the user if password is correct, otherwise None. Runs on a worker thread.
+        A correct password hashed with an outdated cost is rehashed with 'Password Hash Rounds'."""
+        with DBContext() as session:
+            user = repository.user_by_username(session, username) # type: Optional[models.User]
+            if not user or not user.check_password(password):
+                return None
+            if user.active and user.needs_rehash:
+                logger.info(f"[LoginDialog] Rehashing password of user '{user}' from cost {models.User.hash_rounds(user.password_hash)} to {config.PASSWORD_HASH_ROUNDS}.")
+                user.password = password
+                session.commit()
+                session.refresh(user)
+            session.expunge_all()
+            return user
+
     def on_login_button_clicked(self) -> None:
         logger.debug("[LoginDialog] Login button clicked.")
+        if self.worker:
+            return
         username = self.username_lineEdit.text().strip()
         password = self.password_lineEdit.text().strip()
         config.LAST_USERNAME.value = username
@@ -457,24 +582,39 @@ class LoginDialog(QtWidgets.QDialog):
             return
 
         logger.debug(f"[LoginDialog] Checking user creds. Username: '{username}'")
-        with DBContext() as session:
-            self.user = session.query(models.User).filter(models.User.username==username).first() # type: Optional[models.User]
-            if not self.user or self.user and not self.user.check_password(password):
-                logger.warning("[LoginDialog] Username and/or Password invalid.")
-                QtWidgets.QMessageBox.warning(self, "Login", "Username and/or Password invalid.")
-                self.password_lineEdit.setFocus()
-                self.password_lineEdit.selectAll()
-                return
-            
-            if not self.user.active:
-                logger.warning(f"[LoginDialog] User '{self.user}' has been deactivated.")
-                QtWidgets.QMessageBox.warning(self, "Login", "This account has been deactivated. Please try another account.")
-                return
-            
-            session.expunge_all()
-            self.accept()
-            logger.debug("[LoginDialog] Login success.")
-            self.close_and_return()
+        # bcrypt takes a noticeable time on purpose, check it off the GUI thread.
+        worker = Worker(lambda progress: LoginDialog.check_credentials(username, password))
+        # The thread has exited by the time it reports finished, so the worker can be dropped right away.
+        worker.thread.finished.connect(self.on_credentials_checked)
+        self.worker = worker
+        self.set_busy(True)
+        worker.start()
+
+    def on_credentials_checked(self) -> None:
+        worker = self.worker
+        self.worker = None
+        self.set_busy(False)
+        if worker.error is not None:
+            QtWidgets.QMessageBox.critical(self, "Login", f"Could not check the username and password. Error: {worker.error}")
+            return
+
+        self.user = worker.result
+        if not self.user:
+            logger.warning("[LoginDialog] Username and/or Password invalid.")
+            QtWidgets.QMessageBox.warning(self, "Login", "Username and/or Password invalid.")
+            self.password_lineEdit.setFocus()
+            self.password_lineEdit.selectAll()
+            return
+        
+        if not self.user.active:
+            logger.warning(f"[LoginDialog] User '{self.user}' has been deactivated.")
+            QtWidgets.QMessageBox.warning(self, "Login", "This account has been deactivated. Please try another account.")
+            self.user = None
+            return
+        
+        self.accept()
+        logger.debug("[LoginDialog] Login success.")
+        self.close_and_return()
     
     def result(self) -> models.User:
         return self.user
@@ -486,14 +626,27 @@ class LoginDialog(QtWidgets.QDialog):
 
 
 class Ui(QtWidgets.QMainWindow):
+    replica_synced = QtCore.pyqtSignal()
+
     def __init__(self):
         super(Ui, self).__init__() # Call the inherited classes __init__ method
         uic.loadUi('ui/mainwindow.ui', self) # Load the .ui file
         self.resize(HEIGHT, WIDTH)
         self.login_dialog = None
         self.current_user = None
+        self.worker = None # type: Optional[Worker]
+        self.stopping_workers = set() # Keeps finished workers alive until their thread exits.
+        self.replica_status = ""
+        self.replica_reload_pending = False
 
         self.update_window_title()
+        self.replica_status_timer = QtCore.QTimer(self)
+        self.replica_status_timer.timeout.connect(self.update_replica_status)
+        self.replica_status_timer.timeout.connect(self.show_journal_conflicts)
+        self.replica_status_timer.start(5000)
+        # Emitted on the sync thread, the slot runs on the GUI thread.
+        self.replica_synced.connect(self.on_replica_synced)
+        replica.add_sync_listener(self.replica_synced.emit)
 
         self.connect_signals()
         self.show() # Show the GUI
@@ -504,9 +657,12 @@ class Ui(QtWidgets.QMainWindow):
         self.actionLogoff.triggered.connect(self.on_logoff)
         self.actionImport_Data.triggered.connect(self.import_data)
         self.actionImport_Database.triggered.connect(self.import_backup)
+        self.actionRestore_Changes.triggered.connect(self.restore_changes)
         self.actionBackup_Database.triggered.connect(self.backup_database)
+        self.actionIncremental_Backup.triggered.connect(self.backup_database_incremental)
         self.actionChange_Password.triggered.connect(self.open_change_password_dialog)
         self.actionUser_Administration.triggered.connect(self.open_user_administration_dialog)
+        self.actionDiagnostics.triggered.connect(self.open_diagnostics_dialog)
 
         self.search_pushButton.clicked.connect(self.on_search_button_clicked)
         self.show_all_radioButton.toggled.connect(self.reload_label_table)
@@ -525,9 +681,17 @@ class Ui(QtWidgets.QMainWindow):
     def about_to_quit(self) -> None:
         logger.setLevel(logging.INFO)
         logger.info("[SYSTEM] Program closing. Preforming clean up.")
+        if self.worker:
+            logger.warning("[SYSTEM] Cancelling background operation.")
+            self.worker.cancel()
+            self.worker.thread.wait()
         self.on_logoff(about_to_close=True)
         
         self.current_user = None
+        loginevents.stop_writer()
+        journal.stop_journal()
+        database.stop_liveness_check()
+        replica.stop_replica()
 
         logger.info("[SYSTEM] Done.")
         logger.info("=" * 80)
@@ -542,6 +706,68 @@ class Ui(QtWidgets.QMainWindow):
             self.setWindowTitle(f"{config.PROGRAM_NAME} - (v{config.PROGRAM_VERSION})")
             if config.DEBUG:
                 self.setWindowTitle(f"{config.PROGRAM_NAME} - (v{config.PROGRAM_VERSION}) DEBUG")
+        if self.replica_status:
+            self.setWindowTitle(f"{self.windowTitle()} {self.replica_status}")
+
+    def update_replica_status(self) -> None:
+        """Show in the window title when the local label replica is behind MySQL or label changes wait in the journal."""
+        status = replica.label_replica.status_text() if replica.label_replica else ""
+        journal_status = journal.label_journal.status_text() if journal.label_journal else ""
+        status = f"{status} {journal_status}".strip()
+        if status != self.replica_status:
+            self.replica_status = status
+            self.update_window_title()
+
+    def show_journal_conflicts(self) -> None:
+        """Tell the operator about journaled label changes that could not be replayed."""
+        if not journal.label_journal:
+            return
+        try:
+            conflicts = journal.label_journal.take_conflicts()
+        except Exception:
+            logger.exception("[JOURNAL] Could not read conflicts.")
+            return
+        if not conflicts:
+            return
+        msg = ResizableMessageBox()
+        msg.setWindowTitle("Offline Changes Not Saved")
+        msg.setIcon(QtWidgets.QMessageBox.Warning)
+        msg.setText(f"{len(conflicts)} label change(s) made while the database was unreachable could not be saved, because the labels were changed by another station. Please check these labels and make the changes again.")
+        msg.setDetailedText("\n".join(str(conflict) for conflict in conflicts))
+        msg.exec()
+        self.reload_label_table()
+
+    def save_to_journal(self, label: models.BreakoutLabel, base_date_modified: Optional[datetime]=None) -> None:
+        """Record a new label, or an edit of a label loaded with base_date_modified, in the offline journal."""
+        if base_date_modified is None:
+            journal.label_journal.record_create(label, self.current_user)
+        else:
+            journal.label_journal.record_update(label, base_date_modified, self.current_user)
+        QtWidgets.QMessageBox.information(
+            self,
+            "Saved On This Station",
+            "The database can not be reached right now. The change was saved on this station and will be written to the database once it can be reached."
+            )
+        self.update_replica_status()
+
+    def journal_pending(self) -> bool:
+        """True while earlier changes wait in the journal. New changes queue behind them to keep their order."""
+        return bool(journal.label_journal and journal.label_journal.pending_count())
+
+    def can_journal(self, error: Exception) -> bool:
+        return journal.label_journal is not None and journal.is_connection_error(error)
+
+    def refresh_replica(self) -> None:
+        """Wake the replica sync right after a write. The label table reloads once the sync has
+        finished, so the window never waits on MySQL."""
+        if replica.request_sync():
+            self.replica_reload_pending = True
+
+    def on_replica_synced(self) -> None:
+        self.update_replica_status()
+        if self.replica_reload_pending:
+            self.replica_reload_pending = False
+            self.reload_label_table()
     
     def on_login(self) -> None:
         if not self.current_user:
@@ -549,10 +775,8 @@ class Ui(QtWidgets.QMainWindow):
             return
         
         logger.info("Logging in user.")
-        with DBContext() as session:
-            session.add(self.current_user.on_login())
-            session.commit()
-            session.expunge_all()
+        loginevents.record(self.current_user, enums.LoginEventType.Login)
+        users.refresh_directory()
         self.actionLogin.setEnabled(False)
         self.actionLogoff.setEnabled(True)
         self.update_window_title()
@@ -563,6 +787,7 @@ class Ui(QtWidgets.QMainWindow):
             self.actionEdit_User.setEnabled(False)
             self.actionImport_Data.setEnabled(False)
             self.actionImport_Database.setEnabled(False)
+            self.actionRestore_Changes.setEnabled(False)
             self.actionCreate_User.setEnabled(False)
             self.actionEdit_User.setEnabled(False)
             self.actionUser_Administration.setEnabled(False)
@@ -571,11 +796,12 @@ class Ui(QtWidgets.QMainWindow):
             self.actionEdit_User.setEnabled(True)
             self.actionImport_Data.setEnabled(True)
             self.actionImport_Database.setEnabled(True)
+            self.actionRestore_Changes.setEnabled(True)
             self.actionCreate_User.setEnabled(True)
             self.actionEdit_User.setEnabled(True)
             self.actionUser_Administration.setEnabled(True)
         
-        if self.current_user.id == 1 and self.current_user.check_password("admin"):
+        if self.current_user.must_change_password:
             logger.warning("For security purposes the password for this user must be changed.")
             QtWidgets.QMessageBox.information(self, "Password Change", "For security purposes the password for this user must be changed.")
             self.actionChange_Password.trigger()
@@ -586,10 +812,7 @@ class Ui(QtWidgets.QMainWindow):
             return
         
         logger.info("Logging off user.")
-        with DBContext() as session:
-            session.add(self.current_user.on_logout())
-            session.commit()
-            session.expunge_all()
+        loginevents.record(self.current_user, enums.LoginEventType.Logout)
         self.actionLogin.setEnabled(True)
         self.actionLogoff.setEnabled(False)
         self.update_window_title()
@@ -598,12 +821,14 @@ class Ui(QtWidgets.QMainWindow):
     
     def open_user_administration_dialog(self) -> None:
         logger.info("Opening User Administration Dialog.")
-        with DBContext() as session:
-            dialog = UserAdministrationDialog(current_user_id=self.current_user.id, session=session, parent=self)
-            dialog.exec()
-        
-        return
+        dialog = UserAdministrationDialog(current_user_id=self.current_user.id, parent=self)
+        dialog.exec()
         
+    def open_diagnostics_dialog(self) -> None:
+        dialog = DiagnosticsDialog(self)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.show()
+
     def open_change_password_dialog(self) -> None:
         if not self.current_user:
             return
@@ -656,14 +881,16 @@ class Ui(QtWidgets.QMainWindow):
         
         
         with DBContext() as session:
-            user = session.query(models.User).filter(models.User.id == self.current_user.id).first() # type: models.User
+            user = repository.user_by_id(session, self.current_user.id) # type: models.User
             if not user:
                 msg = f"Could not find current user {self.current_user}. Unable to update password."
                 logger.error(msg)
                 QtWidgets.QMessageBox.warning(self, "Error", msg)
                 return
             user.password = password
+            user.must_change_password = False
             session.commit()
+            self.current_user.must_change_password = False
             QtWidgets.QMessageBox.information(self, "Success", "Password changed successfully.")
             return
     
@@ -711,12 +938,21 @@ class Ui(QtWidgets.QMainWindow):
             if not label:
                 return
             
+            if self.journal_pending():
+                self.save_to_journal(label)
+                return
+
             with DBContext() as session:
                 try:
                     session.add(label)
                     label.save(session, self.current_user)
                     session.commit()
                 except DBAPIError as error:
+                    if self.can_journal(error):
+                        logger.warning(f"Database unreachable, journaling new label '{label}'. Error: {error}")
+                        session.rollback()
+                        self.save_to_journal(label)
+                        return
                     logger.exception(f"Could not save new label '{label}'.")
                     msg = ResizableMessageBox()
                     msg.setWindowTitle("Exception")
@@ -726,6 +962,7 @@ class Ui(QtWidgets.QMainWindow):
                     msg.exec()
                     return
 
+            self.refresh_replica()
             self.reload_label_table()
 
     def on_edit_button_clicked(self) -> None:
@@ -744,7 +981,14 @@ class Ui(QtWidgets.QMainWindow):
             return
         
         with DBContext() as session:
-            label = session.query(models.BreakoutLabel).filter(models.BreakoutLabel.id == item_id).first() # type: models.BreakoutLabel
+            try:
+                label = repository.label_by_id(session, item_id) # type: models.BreakoutLabel
+            except DBAPIError as error:
+                if not self.can_journal(error):
+                    raise
+                logger.warning(f"Database unreachable, editing label id {item_id} from the local replica. Error: {error}")
+                self.edit_label_offline(item_id)
+                return
             if not label:
                 logger.exception(f"Could not find label id {item_id}.")
                 msg = ResizableMessageBox()
@@ -755,17 +999,34 @@ class Ui(QtWidgets.QMainWindow):
                 msg.exec()
                 return
         
+            base_date_modified = label.date_modified
             self.label_dialog = LabelDialog(self, part_number=label.part_number, label=label)
             result = self.label_dialog.exec()
             if result != 0:
                 label = self.label_dialog.result()
                 if not label:
                     return
+                # A rollback expires label and reloads the values from before the edit,
+                # so the journal is written from a copy of the edited values.
+                edited = models.BreakoutLabel(
+                    id=label.id, part_number=label.part_number, value=label.value,
+                    sort_index=label.sort_index, rolling_label=label.rolling_label
+                    )
                 
+                if self.journal_pending():
+                    session.rollback()
+                    self.save_to_journal(edited, base_date_modified)
+                    return
+
                 try:
                     label.save(session, self.current_user)
                     session.commit()
                 except DBAPIError as error:
+                    if self.can_journal(error):
+                        logger.warning(f"Database unreachable, journaling edit of label '{label}'. Error: {error}")
+                        session.rollback()
+                        self.save_to_journal(edited, base_date_modified)
+                        return
                     logger.exception(f"Could not update label '{label}'.")
                     msg = ResizableMessageBox()
                     msg.setWindowTitle("Exception")
@@ -775,8 +1036,20 @@ class Ui(QtWidgets.QMainWindow):
                     msg.exec()
                     return
 
+            self.refresh_replica()
             self.reload_label_table()
     
+    def edit_label_offline(self, item_id: int) -> None:
+        """Edit a label loaded from the local replica and record the change in the journal."""
+        row = replica.label_replica.get(item_id) if replica.label_replica else None
+        if not row:
+            QtWidgets.QMessageBox.warning(self, "Warning", "The database can not be reached and this label is not available on this station.")
+            return
+        label = models.BreakoutLabel(id=row.id, part_number=row.part_number, value=row.value, sort_index=row.sort_index, rolling_label=row.rolling_label)
+        self.label_dialog = LabelDialog(self, part_number=label.part_number, label=label)
+        if self.label_dialog.exec() != 0 and self.label_dialog.result():
+            self.save_to_journal(self.label_dialog.result(), row.date_modified)
+
     def on_delete_button_clicked(self) -> None:
         logger.info("Delete button clicked.")
         items = self.get_selected_labels()
@@ -805,7 +1078,7 @@ class Ui(QtWidgets.QMainWindow):
         logger.info(f"Deleting label id {item_id}.")
         
         with DBContext() as session:
-            label = session.query(models.BreakoutLabel).filter(models.BreakoutLabel.id == item_id).first() # type: models.BreakoutLabel
+            label = repository.label_by_id(session, item_id) # type: models.BreakoutLabel
             if not label:
                 logger.warning(f"Could not find label with id '{item_id}'. Selected row: [{[item.text() for item in items]}]")
                 QtWidgets.QMessageBox.warning(self, "Warning", f"Could not find label with id '{item_id}'.")
@@ -813,6 +1086,7 @@ class Ui(QtWidgets.QMainWindow):
             
             label.delete(session, self.current_user)
         
+        self.refresh_replica()
         self.reload_label_table()
 
     def reload_label_table(self):
@@ -825,55 +1099,96 @@ class Ui(QtWidgets.QMainWindow):
         
         logger.debug(f"[SEARCH] Search parameters: part_number: '{part_number}', show_all: {show_all}, show_rolling_only: {show_rolling_only}, show_breakout_only: {show_breakout_only}.")
 
-        with DBContext() as session:
-            query = session.query(models.BreakoutLabel)
-
-            if part_number != "":
-                logger.info(f"[SEARCH] Applying filter 'part_number': '{part_number}'.")
-                query = query.filter(models.BreakoutLabel.part_number == part_number)
-
-            if show_rolling_only:
-                logger.info(f"[SEARCH] Applying filter 'show_rolling_only'.")
-                query = query.filter(models.BreakoutLabel.rolling_label == True)
-            elif show_breakout_only:
-                logger.info(f"[SEARCH] Applying filter 'show_breakout_only'.")
-                query = query.filter(models.BreakoutLabel.rolling_label == False)
-            else:
-                logger.info(f"[SEARCH] Applying filter 'show_all'.")
-            
-            logger.debug(f"[QUERY] Query:\n{query}\n")
-            # logger.debug(f"[QUERY] Parameters: {query}")
+        if part_number != "":
+            logger.info(f"[SEARCH] Applying filter 'part_number': '{part_number}'.")
+        rolling_label = None # type: Optional[bool]
+        if show_rolling_only:
+            logger.info(f"[SEARCH] Applying filter 'show_rolling_only'.")
+            rolling_label = True
+        elif show_breakout_only:
+            logger.info(f"[SEARCH] Applying filter 'show_breakout_only'.")
+            rolling_label = False
+        else:
+            logger.info(f"[SEARCH] Applying filter 'show_all'.")
+
+        if replica.label_replica and replica.label_replica.last_sync:
+            labels = replica.label_replica.search(part_number, rolling_label)
+        else:
+            labels = self.search_labels(part_number, rolling_label)
+        logger.info(f"[SEARCH] Total labels found: {len(labels)}")
+
+        for label in labels:
+            label_id = QtWidgets.QTableWidgetItem(str(label.id))
+            type_name = QtWidgets.QTableWidgetItem(label.type_name)
+            part_number_value = QtWidgets.QTableWidgetItem(label.part_number)
+            label_value = QtWidgets.QTableWidgetItem(label.value)
+            date_modified_str = QtWidgets.QTableWidgetItem(label.date_modified_str)
+            full_name = QtWidgets.QTableWidgetItem(label.modified_by_full_name)
+
+            label_id.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+            type_name.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+            part_number_value.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+            label_value.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+            date_modified_str.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+            full_name.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
             
-            labels = query.order_by(models.BreakoutLabel.part_number, models.BreakoutLabel.sort_index).all() # type: List[models.BreakoutLabel]
-            logger.info(f"[SEARCH] Total labels found: {len(labels)}")
-
-            for label in labels:
-                label_id = QtWidgets.QTableWidgetItem(str(label.id))
-                type_name = QtWidgets.QTableWidgetItem(label.type_name)
-                part_number_value = QtWidgets.QTableWidgetItem(label.part_number)
-                label_value = QtWidgets.QTableWidgetItem(label.value)
-                date_modified_str = QtWidgets.QTableWidgetItem(label.date_modified_str)
-                full_name = QtWidgets.QTableWidgetItem(label.modified_by_user.full_name)
-
-                label_id.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                type_name.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                part_number_value.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                label_value.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                date_modified_str.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                full_name.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-                
-                self.tableWidget.insertRow(self.tableWidget.rowCount())
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 0, label_id)
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 1, type_name)
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 2, part_number_value)
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 3, label_value)
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 4, date_modified_str)
-                self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 5, full_name)
+            self.tableWidget.insertRow(self.tableWidget.rowCount())
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 0, label_id)
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 1, type_name)
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 2, part_number_value)
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 3, label_value)
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 4, date_modified_str)
+            self.tableWidget.setItem(self.tableWidget.rowCount() - 1, 5, full_name)
 
         self.tableWidget.resizeColumnsToContents()
         self.edit_pushButton.setEnabled(False)
         self.delete_pushButton.setEnabled(False)
     
+    def search_labels(self, part_number: str, rolling_label: Optional[bool]) -> List[replica.LabelRow]:
+        """Search labels in MySQL. Used until the local replica has synced once."""
+        with DBContext(read_only=True) as session:
+            return repository.search_labels(session, part_number, rolling_label)
+
+    def run_in_background(self, title: str, task, on_success, on_failure=None) -> None:
+        """Run task(progress) on a worker thread while a non-modal progress dialog shows rows done, rate and ETA.
+
+        Args:
+            title (str): Title of the progress dialog and any message boxes.
+            task (Callable[[Progress], object]): The operation to run. Must not touch widgets.
+            on_success (Callable[[object], None]): Called on the GUI thread with the task result.
+            on_failure (Callable[[Exception], None], optional): Called on the GUI thread with the error. Defaults to an error message.
+        """
+        if self.worker:
+            QtWidgets.QMessageBox.information(self, title, "Another data operation is still running. Please wait for it to finish.")
+            return
+
+        dialog = ProgressDialog(title, self)
+        worker = Worker(task)
+        worker.progressed.connect(dialog.update_progress)
+        worker.connect_cancel(dialog.cancel_requested)
+
+        def on_finished() -> None:
+            dialog.hide()
+            dialog.deleteLater()
+            self.worker = None
+            if worker.cancelled:
+                QtWidgets.QMessageBox.information(self, title, f"{title} was cancelled.\n\n{worker.error}")
+            elif worker.error is not None:
+                if on_failure:
+                    on_failure(worker.error)
+                else:
+                    QtWidgets.QMessageBox.critical(self, title, f"{title} failed. Error: {worker.error}")
+            else:
+                on_success(worker.result)
+
+        worker.finished.connect(on_finished)
+        worker.thread.finished.connect(lambda: self.stopping_workers.discard(worker))
+        self.stopping_workers.add(worker)
+        self.worker = worker
+        logger.info(f"Starting background operation '{title}'.")
+        dialog.show()
+        worker.start()
+
     def get_import_file_path(self) -> str:
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open File", f"{config.DUMPS_FOLDER}", "Supported Files (*.csv, *json)")
         return file_path
@@ -883,45 +1198,26 @@ class Ui(QtWidgets.QMainWindow):
         if file_path == "":
             return
         
-        if file_path.endswith("csv"):
-            self.import_csv(file_path)
-        elif file_path.endswith("json"):
-            self.import_json(file_path)
-        else:
-            logger.warning(f"Could not parse file: {file_path}. Extention: {file_path.split('.')[-1]} not supported.")
-            QtWidgets.QMessageBox.warning(self, "Error", f"Could not parse file: {file_path}. Extention: {file_path.split('.')[-1]} not supported.")
-            return
+        def on_success(result: importer.ImportResult) -> None:
+            msg = ResizableMessageBox()
+            msg.setWindowTitle("Import Data")
+            msg.setIcon(QtWidgets.QMessageBox.Icon.Information if not result.errors else QtWidgets.QMessageBox.Icon.Warning)
+            msg.setText(f"Imported {result.inserted} labels. Skipped {result.skipped} existing labels.")
+            if result.errors:
+                msg.setInformativeText(f"{len(result.errors)} row(s) could not be read and were not imported.")
+                msg.setDetailedText("\n".join(result.errors))
+            msg.exec()
+            self.refresh_replica()
+            self.reload_label_table()
+
+        def on_failure(error: Exception) -> None:
+            logger.warning(str(error))
+            QtWidgets.QMessageBox.warning(self, "Error", str(error))
+
+        user_id = self.current_user.id
+        # One transaction, so cancelling leaves nothing half imported. Use the command line for parallel imports.
+        self.run_in_background("Import Data", lambda progress: importer.import_file(file_path, user_id, progress, workers=1), on_success, on_failure)
 
-    def import_csv(self, file_path: str) -> None:
-        with open(file_path, 'r') as csv_file:
-            csv_reader = csv.DictReader(csv_file, delimiter=',')
-            for index, row in enumerate(csv_reader):
-                print(row)
-    
-    def import_json(self, file_path: str) -> None:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        
-        with DBContext() as session:
-            for item in data:
-                label = session.query(models.BreakoutLabel)\
-                        .filter(models.BreakoutLabel.part_number == item["part_number"],
-                                models.BreakoutLabel.value == item["value"],
-                                models.BreakoutLabel.sort_index == item["sort_index"],
-                                models.BreakoutLabel.rolling_label == item["rolling_label"]).first()
-                
-                if not label:
-                    label = models.BreakoutLabel(
-                        part_number=item['part_number'],
-                        value=item['value'],
-                        sort_index=item['sort_index'],
-                        rolling_label=True if item['rolling_label'] == "1" else False
-                    )
-                    session.add(label)
-                    label.created_by_user_id = self.current_user.id
-                    label.save(session, self.current_user)
-            session.commit()
-    
     def import_backup(self) -> None:
         """Imports data from database backup."""
         result = QtWidgets.QMessageBox.warning(
@@ -938,237 +1234,150 @@ class Ui(QtWidgets.QMainWindow):
             return
 
         logger.info(f"[DATABASE IMPORT] Importing data from file: '{file_path}'.")
-        
-        with open(file_path, 'r') as f:
-            data = json.load(f)
 
-        logger.debug(f"[DATABASE IMPORT] Data file START: \n{json.dumps(data, indent=4)}")
-        logger.debug("[DATABASE IMPORT] Data file END.")
+        if nativedump.is_native_backup(file_path):
+            return self.import_native_backup(file_path)
+        
+        try:
+            data = backup.load_backup(file_path)
+        except errors.BackupError as error:
+            logger.exception(f"[DATABASE IMPORT] Could not load backup '{file_path}'.")
+            QtWidgets.QMessageBox.critical(self, "Data Import Error", f"Could not load backup. Error: {error}")
+            return
 
         # Validate data.
         logger.info(f"[DATABASE IMPORT] Validating data.")
-        required_sections = {
-            "labels": [
-                "id",
-                "part_number",
-                "value",
-                "sort_index",
-                "rolling_label",
-                "date_created",
-                "date_modified",
-                "modified_by_user_id",
-                "created_by_user_id"
-            ],
-            "users": [
-                "id",
-                "active",
-                "last_login_date",
-                "first_name",
-                "last_name",
-                "username",
-                "password_hash"
-            ],
-            "user_logins": [
-                "id",
-                "event_date",
-                "event_type",
-                "user_id"
-            ]
-        }
-        required_keys = [key for key in required_sections]
-
-        invalid_values = []
-
-        for key in required_keys:
-            if key not in data:
-                invalid_values.append(key)
-        
-        if invalid_values:
-            keys = ", ".join(invalid_values)
-            logger.error(f"[DATABASE IMPORT] Validation error. Missing required key(s): {keys}. Please check if data structure is like: \n{json.dumps(required_sections, indent=4)}")
-
-            msg = QtWidgets.QMessageBox()
+        report = validation.validate_backup(data)
+        if not report.is_valid:
+            structure = {section: validation.required_fields(section) for section in validation.REQUIRED_SECTIONS}
+            msg = ResizableMessageBox()
             msg.setWindowTitle("Data Import Error")
             msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
-            msg.setText(f"Validation error. Missing required key(s): {keys}.")
-            msg.setInformativeText(f"Please check if data structure is like: \n{json.dumps(required_sections, indent=4)}")
+            msg.setText(f"Validation failed with {len(report.errors)} error(s). No data was imported.")
+            msg.setInformativeText(f"Please check if data structure is like: \n{json.dumps(structure, indent=4)}")
+            msg.setDetailedText(str(report))
             msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
             msg.exec()
             return
         
-        invalid_values = []
-
-        for key in data:
-            required_keys = required_sections[key]
-            items = data[key] # type: List[dict]
-            
-            for item in items:
-                item_keys = item.keys()
-                for required_key in required_keys:
-                    if required_key in item_keys:
-                        continue
-                    logger.error(f"[DATABASE IMPORT] Validation error. Item: {item}. Missing required key: {required_key}.")
-                    msg = QtWidgets.QMessageBox()
-                    msg.setWindowTitle("Data Import Error")
-                    msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
-                    msg.setText(f"Validation error. Item: {item}. Missing required key: {required_key}.")
-                    msg.setInformativeText(f"Please check if data structure is like: \n{json.dumps(required_sections, indent=4)}")
-                    msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
-                    msg.exec()
-                    return
-        
         logger.info("[DATABASE IMPORT] Validation complete.")
 
-        logger.info("[DATABASE IMPORT] Auto creating backup.")
-        self.export_database(
-            file_path=f"{config.DUMPS_FOLDER}/AUTO_Harness_Labeler_Database_Backup_{datetime.now().strftime(config.DATETIME_FORMAT_FILE_SAFE)}.json"
-            )
-        logger.info("[DATABASE IMPORT] Finished creating backup.")
+        def task(progress) -> dict:
+            logger.info("[DATABASE IMPORT] Auto creating backup.")
+            result = backup.export_auto(progress=progress)
+            logger.info(f"[DATABASE IMPORT] Finished creating backup. {result}")
 
-        with DBContext(dissable_foreign_key_checks=True) as session:
             logger.info("[DATABASE IMPORT] Preparing to import data.")
+            return backup.restore_data(data, progress)
 
-            # user_logins_savepoint = session.begin_nested() # type: SessionTransaction
-            
-            logger.info("[DATABASE IMPORT] Preparing 'user_logins'.")
-            try:
-                session.execute(f"TRUNCATE {models.UserLoginLog.__tablename__};")
-                for items in data["user_logins"]:
-                    id_ = items["id"]
-                    event_date = datetime.strptime(items["event_date"], config.DATETIME_FORMAT)
-                    event_type = items["event_type"]
-                    user_id = items["user_id"]
-
-                    user_login = models.UserLoginLog(
-                        id=id_,
-                        event_date=event_date,
-                        event_type=event_type,
-                        user_id=user_id
-                    )
-                    
-                    session.add(user_login)
-                    logger.info(f"[DATABASE IMPORT] Creating '{user_login}'.")
-                session.commit()
-            except Exception as error:
-                session.rollback()
-                logger.critical(f"[DATABASE IMPORT] Error importing user_logins. Rolling back database.")
-                logger.exception(f"[DATABASE IMPORT] Error importing user_logins. Last user_login: {item}")
-                msg = QtWidgets.QMessageBox()
-                msg.setWindowTitle("Data Import Error")
-                msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
-                msg.setText(f"Error importing user_logins. No data was imported. Last user_login: {item}")
-                msg.setInformativeText(f"Import will abort after closing this dialog. For more info check log file at '{config.LOG_FOLDER}'")
-                msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
-                msg.exec()
+        def on_success(counts: dict) -> None:
+            logger.info(f"[DATABASE IMPORT] Successfully imported all data. {counts}")
+            self.show_restart_required()
+
+        def on_failure(error: Exception) -> None:
+            msg = QtWidgets.QMessageBox()
+            msg.setWindowTitle("Data Import Error")
+            msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
+            msg.setText(str(error))
+            msg.setInformativeText(f"Import will abort after closing this dialog. For more info check log file at '{config.LOG_FOLDER}'")
+            msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
+            msg.exec()
+
+        self.run_in_background("Data Import", task, on_success, on_failure)
+
+    def show_restart_required(self) -> None:
+        msg = QtWidgets.QMessageBox()
+        msg.setWindowTitle("Data Import")
+        msg.setIcon(QtWidgets.QMessageBox.Icon.Information)
+        msg.setText("Successfully imported all data. For changes to take effect the program needs to be reopened.\n\nAfter closing this dialog the program will close.")
+        msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
+        msg.exec()
+        self.about_to_quit()
+        exit(0)
+
+    def restore_changes(self) -> None:
+        """Restores a backup by only applying the rows that differ from the database."""
+        file_path = self.get_import_file_path()
+        if file_path == "":
+            return
+
+        logger.info(f"[DIFF RESTORE] Comparing database with file: '{file_path}'.")
+        try:
+            data = backup.load_backup(file_path)
+        except errors.BackupError as error:
+            logger.exception(f"[DIFF RESTORE] Could not load backup '{file_path}'.")
+            QtWidgets.QMessageBox.critical(self, "Restore Error", f"Could not load backup. Error: {error}")
+            return
+
+        report = validation.validate_backup(data)
+        if not report.is_valid:
+            msg = ResizableMessageBox()
+            msg.setWindowTitle("Restore Error")
+            msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
+            msg.setText(f"Validation failed with {len(report.errors)} error(s). No data was changed.")
+            msg.setDetailedText(str(report))
+            msg.exec()
+            return
+
+        def on_planned(plan: diffrestore.DiffPlan) -> None:
+            if plan.total == 0:
+                QtWidgets.QMessageBox.information(self, "Restore Changed Data", "The database already matches this backup.")
                 return
-            
 
-            # lables_savepoint = session.begin_nested() # type: SessionTransaction
-            
-            logger.info("[DATABASE IMPORT] Preparing 'labels'.")
-            try:
-                session.execute(f"TRUNCATE {models.BreakoutLabel.__tablename__};")
-                for items in data["labels"]:
-                    id_ = items["id"]
-                    part_number = items["part_number"]
-                    value = items["value"]
-                    sort_index = items["sort_index"]
-                    rolling_label = items["rolling_label"]
-                    date_created = datetime.strptime(items["date_created"], config.DATETIME_FORMAT)
-                    date_modified = datetime.strptime(items["date_modified"], config.DATETIME_FORMAT)
-                    modified_by_user_id = items["modified_by_user_id"]
-                    created_by_user_id = items["created_by_user_id"]
-
-                    label = models.BreakoutLabel(
-                        id=id_,
-                        part_number=part_number,
-                        value=value,
-                        sort_index=sort_index,
-                        rolling_label=rolling_label,
-                        date_created=date_created,
-                        date_modified=date_modified,
-                        modified_by_user_id=modified_by_user_id,
-                        created_by_user_id=created_by_user_id
-                    )
-                    
-                    session.add(label)
-                    logger.info(f"[DATABASE IMPORT] Creating '{label}'.")
-                session.commit()
-            except Exception as error:
-                session.rollback()
-                logger.critical(f"[DATABASE IMPORT] Error importing labels. Rolling back database.")
-                logger.exception(f"[DATABASE IMPORT] Error importing labels. Last label: {item}")
-                msg = QtWidgets.QMessageBox()
-                msg.setWindowTitle("Data Import Error")
-                msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
-                msg.setText(f"Error importing labels. No data was imported. Last label: {item}")
-                msg.setInformativeText(f"Import will abort after closing this dialog. For more info check log file at '{config.LOG_FOLDER}'")
-                msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
-                msg.exec()
+            msg = ResizableMessageBox()
+            msg.setWindowTitle("Restore Changed Data")
+            msg.setIcon(QtWidgets.QMessageBox.Icon.Question)
+            msg.setText(f"{plan.total} row(s) differ from the backup. Do you want to apply these changes?")
+            msg.setInformativeText(f"Labels: {plan.labels}\nUsers: {plan.users}\nUser logins: {plan.user_logins}")
+            msg.setDetailedText(plan.report(max_part_numbers=1000))
+            msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No)
+            if msg.exec() != QtWidgets.QMessageBox.StandardButton.Yes:
                 return
-            
 
-            logger.info("[DATABASE IMPORT] Preparing 'users'.")
-            
-            # users_savepoint = session.begin_nested() # type: SessionTransaction
+            self.run_in_background("Restore Changed Data", lambda progress: diffrestore.apply_plan(plan, progress), lambda _: on_applied(plan))
 
-            try:
-                session.execute(f"TRUNCATE {models.User.__tablename__};")
-                for items in data["users"]:
-                    id_ = items["id"]
-                    active = items["active"]
-                    last_login_date = datetime.strptime(items["last_login_date"], config.DATETIME_FORMAT)
-                    first_name = items["first_name"]
-                    last_name = items["last_name"]
-                    username = items["username"]
-                    password_hash = items["password_hash"]
-
-                    user = models.User(
-                        id=id_,
-                        active=active,
-                        last_login_date=last_login_date,
-                        first_name=first_name,
-                        last_name=last_name,
-                        username=username,
-                        password_hash=password_hash
-                    )
-                    
-                    session.add(user)
-                    logger.info(f"[DATABASE IMPORT] Creating '{user}'.")
-                session.commit()
-            except Exception as error:
-                session.rollback()
-                logger.critical(f"[DATABASE IMPORT] Error importing users. Rolling back database.")
-                logger.exception(f"[DATABASE IMPORT] Error importing users. Last user: {item}")
-                msg = QtWidgets.QMessageBox()
-                msg.setWindowTitle("Data Import Error")
-                msg.setIcon(QtWidgets.QMessageBox.Icon.Critical)
-                msg.setText(f"Error importing users. No data was imported. Last user: {item}")
-                msg.setInformativeText(f"Import will abort after closing this dialog. For more info check log file at '{config.LOG_FOLDER}'")
-                msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
+        def on_applied(plan: diffrestore.DiffPlan) -> None:
+            QtWidgets.QMessageBox.information(self, "Restore Changed Data", f"Applied {plan.total} change(s).")
+            if plan.users.total:
+                users.refresh_directory()
+            self.refresh_replica()
+            self.reload_label_table()
+
+        def plan_task(progress) -> diffrestore.DiffPlan:
+            progress.start("Comparing backup with database")
+            return diffrestore.plan_restore(data)
+
+        self.run_in_background("Compare Backup", plan_task, on_planned)
+
+    def import_native_backup(self, file_path: str) -> None:
+        """Imports a backup created with mysqldump."""
+        def task(progress) -> nativedump.NativeDumpResult:
+            logger.info("[DATABASE IMPORT] Auto creating backup.")
+            result = backup.export_preferred(backup.auto_backup_path(), progress=progress, read_only=False)
+            logger.info(f"[DATABASE IMPORT] Finished creating backup. {result}")
+            # mysql can not be stopped part way through a table, so this is the last point to cancel.
+            progress.start("Restoring with mysql")
+            return backup.restore_native(file_path)
+
+        def on_success(result: nativedump.NativeDumpResult) -> None:
+            logger.info(f"[DATABASE IMPORT] Successfully imported all data. {result}")
+            if not result.integrity.is_valid:
+                msg = ResizableMessageBox()
+                msg.setWindowTitle("Data Import Warning")
+                msg.setIcon(QtWidgets.QMessageBox.Warning)
+                msg.setText("The backup was restored, but its tables were dumped separately and do not fully match. Run a database check after restarting.")
+                msg.setDetailedText(result.integrity.summary(max_errors=100))
                 msg.exec()
-                return
+            self.show_restart_required()
 
-            logger.info("[DATABASE IMPORT] Saving changes to database.")
+        def on_failure(error: Exception) -> None:
+            QtWidgets.QMessageBox.critical(
+                self,
+                "Data Import Error",
+                f"Error importing native backup. Tables are restored one at a time, so the database may be partly restored. Error: {error}"
+                )
 
-            logger.warning("[DATABASE IMPORT] Droping all data from database.")
-            
-            # end_savepoint = session.begin_nested() # type: SessionTransaction
-
-            # end_savepoint.commit()
-            # users_savepoint.commit()
-            # lables_savepoint.commit()
-            # user_logins_savepoint.commit()
-            session.commit()
-            logger.info("[DATABASE IMPORT] Successfully imported all data.")
-            msg = QtWidgets.QMessageBox()
-            msg.setWindowTitle("Data Import")
-            msg.setIcon(QtWidgets.QMessageBox.Icon.Information)
-            msg.setText("Successfully imported all data. For changes to take effect the program needs to be reopened.\n\nAfter closing this dialog the program will close.")
-            msg.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
-            msg.exec()
-        self.about_to_quit()
-        exit(0)
+        self.run_in_background("Data Import", task, on_success, on_failure)
 
     def get_export_file_path(self) -> str:
         file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save As", f"{config.DUMPS_FOLDER}/Harness_Labeler_Database_Backup_{datetime.now().strftime(config.DATETIME_FORMAT_FILE_SAFE)}", "Supported Files (*json)")
@@ -1181,36 +1390,36 @@ class Ui(QtWidgets.QMainWindow):
         if file_path == "":
             return
         
-        logger.info("Creating database backup.")
-        self.export_database(file_path)
-        QtWidgets.QMessageBox.information(self, "Database Backup", "Database backup saved.")
+        def on_failure(error: Exception) -> None:
+            QtWidgets.QMessageBox.critical(self, "Database Backup", f"Could not create database backup. Error: {error}")
 
-    def export_database(self, file_path: str) -> None:
-        logger.info(f"Starting database backup. File: '{file_path}'")
-        with DBContext() as session:
-
-            lables = session.query(models.BreakoutLabel)\
-                        .order_by(
-                            models.BreakoutLabel.part_number,
-                            models.BreakoutLabel.sort_index,
-                            models.BreakoutLabel.rolling_label
-                            ).all() # type: List[models.BreakoutLabel]
-            logger.info(f"Saving {len(lables)} lables.")
+        logger.info("Creating database backup.")
+        self.run_in_background(
+            "Database Backup",
+            lambda progress: backup.export_preferred(file_path, progress=progress),
+            lambda result: QtWidgets.QMessageBox.information(self, "Database Backup", f"Database backup saved. {result}"),
+            on_failure
+            )
 
-            users = session.query(models.User).all() # type: List[models.User]
-            logger.info(f"Saving {len(users)} users.")
+    def backup_database_incremental(self) -> None:
+        if not backup.BackupManifest.load().latest():
+            logger.warning("No previous backup found. Creating a full backup.")
+            QtWidgets.QMessageBox.information(self, "Database Backup", "No previous backup found. A full backup will be created.")
+            return self.backup_database()
 
-            login_logs = session.query(models.UserLoginLog).all()
-            logger.info(f"Saving {len(login_logs)} user logins.")
+        file_path = self.get_export_file_path()
+        if file_path == "":
+            return
 
-            data = {
-                "labels": [label.to_dict() for label in lables],
-                "users": [user.to_dict() for user in users],
-                "user_logins": [login_log.to_dict() for login_log in login_logs]
-            }
+        def on_success(result: backup.BackupResult) -> None:
+            QtWidgets.QMessageBox.information(
+                self,
+                "Database Backup",
+                f"Incremental backup saved. Changed labels: {result.labels}, new user logins: {result.user_logins}."
+                )
 
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=4)
+        logger.info("Creating incremental database backup.")
+        self.run_in_background("Incremental Backup", lambda progress: backup.export_incremental(file_path, progress=progress), on_success)
 
 
 def show_new_release_dialog(version: str, html_url: str) -> bool:
@@ -1254,6 +1463,9 @@ def prompt_user(skip_check: bool=False):
         skip_check (bool, optional): Force the dialog to be
         shown, even if all keys are populated in the registry. Defaults to False.
     """
+    if database.backend.name != backends.MYSQL:
+        # Embedded databases need no login.
+        return
     if not skip_check and not (config.DATABASE_USER.value == ""\
         or config.DATABASE_PASSWORD.value == ""\
         or config.DATABASE_HOST.value == ""\
@@ -1385,7 +1597,7 @@ if __name__ == "__main__":
     prompt_user()
 
     try:
-        models.create_database()
+        migrations.upgrade_database()
     except Exception as error:
         logger.exception("Could not create database.")
         msg = ResizableMessageBox()
@@ -1397,6 +1609,10 @@ if __name__ == "__main__":
         prompt_user(skip_check=True)
         exit(0)
         
+    database.start_liveness_check()
+    replica.start_replica()
+    loginevents.start_writer()
+    journal.start_journal()
     window = Ui() # Create an instance of our class
     app.aboutToQuit.connect(window.about_to_quit)
     app.exec() # Start the application
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""Micro-benchmark comparing the cached repository statements against building ORM queries per call.
+    Runs on an in-memory SQLite database, so both sides pay the same database cost and
+    the difference is the Python overhead of building and compiling the query.
+
+    Usage: python benchmarks/repository_benchmark.py [calls]"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from harnesslabeler import backends, models, repository
+
+
+PART_NUMBERS = 200
+LABELS_PER_PART = 40
+
+
+def make_session() -> Session:
+    backend = backends.SQLiteBackend(backends.SQLITE_MEMORY)
+    engine = create_engine(backend.url, **backend.engine_options())
+    event.listen(engine, "connect", backend.on_connect)
+    models.Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    user = models.User(first_name="Bench", last_name="User", username="bench", password_hash="x", last_login_date=datetime.now())
+    session.add(user)
+    session.flush()
+    session.execute(models.BreakoutLabel.__table__.insert(), [
+        {
+            "part_number": f"PN-{part:05d}", "value": f"X{index}", "sort_index": index + 1, "rolling_label": index % 2 == 0,
+            "date_created": datetime.now(), "date_modified": datetime.now(), "created_by_user_id": user.id, "modified_by_user_id": user.id
+        }
+        for part in range(PART_NUMBERS) for index in range(LABELS_PER_PART)
+    ])
+    session.commit()
+    return session
+
+
+def orm_search(session: Session, part_number: str, rolling_label: bool) -> list:
+    # Mirrors Ui.search_labels before the repository.
+    label = models.BreakoutLabel
+    labels = session.query(label)\
+                .filter(label.part_number == part_number)\
+                .filter(label.rolling_label == rolling_label)\
+                .order_by(label.part_number, label.sort_index).all()
+    return [(item.id, item.modified_by_user.full_name if item.modified_by_user else "") for item in labels]
+
+
+def orm_next_sort_index(session: Session, part_number: str) -> int:
+    # Mirrors BreakoutLabel.create before the repository.
+    label = session.query(models.BreakoutLabel).filter(models.BreakoutLabel.part_number == part_number)\
+                .order_by(models.BreakoutLabel.sort_index.desc()).first()
+    return label.sort_index + 1 if label else 1
+
+
+def cases(session: Session) -> list:
+    label_id = PART_NUMBERS * LABELS_PER_PART // 2
+    return [
+        (
+            "label search",
+            lambda: orm_search(session, "PN-00100", True),
+            lambda: repository.search_labels(session, "PN-00100", True)
+        ),
+        (
+            "label by id",
+            lambda: session.query(models.BreakoutLabel).filter(models.BreakoutLabel.id == label_id).first(),
+            lambda: repository.label_by_id(session, label_id)
+        ),
+        (
+            "user by username",
+            lambda: session.query(models.User).filter(models.User.username == "bench").first(),
+            lambda: repository.user_by_username(session, "bench")
+        ),
+        (
+            "next sort_index",
+            lambda: orm_next_sort_index(session, "PN-00100"),
+            lambda: repository.next_sort_index(session, "PN-00100")
+        ),
+    ]
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    session = make_session()
+    print(f"Labels: {PART_NUMBERS * LABELS_PER_PART}, Calls: {calls}")
+    for name, orm, cached in cases(session):
+        # Warm up both sides, so the compiled cache holds every statement before timing.
+        orm()
+        cached()
+        orm_seconds = timeit.timeit(orm, number=calls)
+        cached_seconds = timeit.timeit(cached, number=calls)
+        saved = (orm_seconds - cached_seconds) / calls * 1_000_000
+        print(f"{name:16} orm query: {orm_seconds / calls * 1_000_000:7.1f} us  cached: {cached_seconds / calls * 1_000_000:7.1f} us  saved: {saved:6.1f} us/call  speedup: {orm_seconds / cached_seconds:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
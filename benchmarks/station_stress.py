@@ -0,0 +1,363 @@
+"""Stress harness simulating many stations creating, editing, deleting and searching labels at once.
+    Each station is a thread running the same model layer calls as the main window, with
+    its own sessions, against a scratch database. Stations work on a few shared part
+    numbers, so they contend for the same harnesses like a busy shift does.
+
+    Reports throughput, latency percentiles per operation, deadlocks, lock timeouts,
+    constraint violations and conflicts, then checks the sort order the stations left behind.
+
+    Runs on a temporary SQLite file unless --url points at a scratch database. Never point
+    --url at the production database, its tables are dropped and filled with test labels.
+
+    Usage: python benchmarks/station_stress.py [--stations 40] [--duration 10] [--mix create=25,edit=35,delete=15,search=25]"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, IntegrityError, SAWarning
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import ObjectDeletedError, StaleDataError
+from sqlalchemy.pool import QueuePool
+
+from harnesslabeler import backends, models, repository
+
+
+CREATE = "create"
+EDIT = "edit"
+DELETE = "delete"
+SEARCH = "search"
+OPERATIONS = (CREATE, EDIT, DELETE, SEARCH)
+
+OK = "ok"
+DEADLOCK = "deadlock"
+LOCK_TIMEOUT = "lock timeout"
+CONSTRAINT = "constraint"
+CONFLICT = "conflict"
+ERROR = "error"
+OUTCOMES = (OK, DEADLOCK, LOCK_TIMEOUT, CONSTRAINT, CONFLICT, ERROR)
+
+# MySQL error codes.
+ER_LOCK_DEADLOCK = 1213
+ER_LOCK_WAIT_TIMEOUT = 1205
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """Parse 'create=25,edit=35' into weights. Operations left out get weight 0."""
+    mix = {operation: 0 for operation in OPERATIONS}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().lower()
+        if name not in mix:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'. Expected one of: {', '.join(OPERATIONS)}.")
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("At least one operation needs a weight above 0.")
+    return mix
+
+
+def classify(error: Exception) -> str:
+    """Return the outcome an operation that raised error is counted under."""
+    if isinstance(error, IntegrityError):
+        return CONSTRAINT
+    if isinstance(error, (StaleDataError, ObjectDeletedError)):
+        # The label was deleted or renumbered by another station between loading and saving.
+        return CONFLICT
+    if isinstance(error, DBAPIError):
+        code = error.orig.args[0] if error.orig is not None and error.orig.args else None
+        if code == ER_LOCK_DEADLOCK:
+            return DEADLOCK
+        if code == ER_LOCK_WAIT_TIMEOUT or "database is locked" in str(error.orig):
+            return LOCK_TIMEOUT
+    return ERROR
+
+
+@dataclass
+class StationResult:
+    """What one station did. Only touched by its own thread until the run ends."""
+
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+    outcomes: Dict[Tuple[str, str], int] = field(default_factory=Counter)
+    errors: List[str] = field(default_factory=list)
+
+
+class Station(threading.Thread):
+    """One station repeating random operations until stop_event is set."""
+
+    def __init__(self, number: int, engine: Engine, user_id: int, args: argparse.Namespace,
+                 start_barrier: threading.Barrier, stop_event: threading.Event):
+        super().__init__(name=f"Station {number}", daemon=True)
+        self.number = number
+        self.engine = engine
+        self.user_id = user_id
+        self.args = args
+        self.start_barrier = start_barrier
+        self.stop_event = stop_event
+        self.random = random.Random(args.seed + number)
+        self.result = StationResult()
+        self.user = None # type: models.User
+
+    def think(self) -> None:
+        # Time an operator spends in a dialog, between reading and writing.
+        if self.args.think_ms:
+            time.sleep(self.random.uniform(0, self.args.think_ms) / 1000)
+
+    def pick_part_number(self) -> str:
+        return f"PN-{self.random.randrange(self.args.part_numbers):04d}"
+
+    def pick_value(self) -> str:
+        return f"J{self.random.randrange(self.args.values) + 1}"
+
+    def timed(self, operation: str, function) -> None:
+        started = time.perf_counter()
+        try:
+            function()
+            outcome = OK
+        except Exception as error:
+            outcome = classify(error)
+            if outcome == ERROR and len(self.result.errors) < 5:
+                self.result.errors.append(f"{operation}: {type(error).__name__}: {error}")
+        self.result.latencies[operation].append(time.perf_counter() - started)
+        self.result.outcomes[(operation, outcome)] += 1
+
+    def pick_label_id(self, part_number: str) -> int:
+        """Search like an operator picking a row in the main window. The search is counted too."""
+        rows = []
+        self.timed(SEARCH, lambda: rows.extend(self.search(part_number)))
+        return self.random.choice(rows).id if rows else None
+
+    def search(self, part_number: str) -> list:
+        with Session(self.engine) as session:
+            return repository.search_labels(session, part_number, self.random.choice((None, True, False)))
+
+    def create(self, part_number: str) -> None:
+        # Mirrors LabelDialog and on_new_button_clicked: the sort_index is read in one
+        # session and the label is inserted in another once the dialog is accepted.
+        with Session(self.engine) as session:
+            sort_index = repository.next_sort_index(session, part_number)
+        self.think()
+        with Session(self.engine) as session:
+            try:
+                label = models.BreakoutLabel(
+                    part_number=part_number,
+                    value=self.pick_value(),
+                    sort_index=sort_index,
+                    rolling_label=self.random.random() < 0.5,
+                    created_by_user_id=self.user_id
+                )
+                session.add(label)
+                label.save(session, self.user)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def edit(self, label_id: int) -> None:
+        # Mirrors on_edit_button_clicked: the label stays loaded while the dialog is open.
+        with Session(self.engine) as session:
+            try:
+                label = repository.label_by_id(session, label_id)
+                if not label:
+                    raise StaleDataError(f"Label id {label_id} was deleted.")
+                self.think()
+                label.value = self.pick_value()
+                label.save(session, self.user)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def delete(self, label_id: int) -> None:
+        # Mirrors on_delete_button_clicked, including the renumbering in BreakoutLabel.delete.
+        with Session(self.engine) as session:
+            try:
+                label = repository.label_by_id(session, label_id)
+                if not label:
+                    raise StaleDataError(f"Label id {label_id} was deleted.")
+                label.delete(session, self.user)
+            except Exception:
+                session.rollback()
+                raise
+
+    def run(self) -> None:
+        with Session(self.engine) as session:
+            self.user = repository.user_by_id(session, self.user_id)
+            session.expunge(self.user)
+        operations = [operation for operation in OPERATIONS if self.args.mix[operation]]
+        weights = [self.args.mix[operation] for operation in operations]
+        self.start_barrier.wait()
+        while not self.stop_event.is_set():
+            operation = self.random.choices(operations, weights)[0]
+            part_number = self.pick_part_number()
+            if operation == CREATE:
+                self.timed(CREATE, lambda: self.create(part_number))
+            elif operation == SEARCH:
+                self.timed(SEARCH, lambda: self.search(part_number))
+            else:
+                label_id = self.pick_label_id(part_number)
+                if label_id is None:
+                    continue
+                self.think()
+                self.timed(operation, lambda: self.edit(label_id) if operation == EDIT else self.delete(label_id))
+
+
+def make_engine(args: argparse.Namespace) -> Engine:
+    """Engine with a connection per station, so stations wait on the database and not on the pool."""
+    options = {"poolclass": QueuePool, "pool_size": args.stations, "max_overflow": 0, "pool_timeout": 60}
+    url = args.url
+    backend = None
+    if not url:
+        backend = backends.SQLiteBackend(os.path.join(tempfile.mkdtemp(prefix="station_stress_"), "stress.sqlite3"))
+        url = backend.url
+    elif url.startswith("sqlite"):
+        backend = backends.SQLiteBackend(url.split("///", 1)[-1])
+    if backend:
+        options["connect_args"] = {"check_same_thread": False, "timeout": args.lock_timeout}
+    engine = create_engine(url, **options)
+    if backend:
+        event.listen(engine, "connect", backend.on_connect)
+    return engine
+
+
+def seed(engine: Engine, args: argparse.Namespace) -> List[int]:
+    """Create the tables, one user per station and the starting labels. Returns the user ids."""
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    now = datetime.now()
+    with Session(engine) as session:
+        users = [
+            models.User(first_name="Station", last_name=str(number), username=f"station{number}", password_hash="x", last_login_date=now)
+            for number in range(args.stations)
+        ]
+        session.add_all(users)
+        session.flush()
+        rows = []
+        for part in range(args.part_numbers):
+            for rolling_label in (False, True):
+                for index in range(args.labels_per_part):
+                    rows.append({
+                        "part_number": f"PN-{part:04d}", "value": f"J{index % args.values + 1}",
+                        "sort_index": index + 1, "rolling_label": rolling_label,
+                        "date_created": now, "date_modified": now,
+                        "created_by_user_id": users[0].id, "modified_by_user_id": users[0].id
+                    })
+        session.execute(models.BreakoutLabel.__table__.insert(), rows)
+        session.commit()
+        return [user.id for user in users]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values))) - 1))
+    return values[index]
+
+
+def check_sort_order(engine: Engine) -> Tuple[int, int]:
+    """Return the number of (part number, label type) groups with a repeated sort_index,
+    and the number of labels left with the sort_index -1 a failed delete leaves behind."""
+    label = models.BreakoutLabel
+    with Session(engine) as session:
+        duplicates = session.execute(
+            select(label.part_number, label.rolling_label, label.sort_index)
+            .where(label.sort_index > 0)
+            .group_by(label.part_number, label.rolling_label, label.sort_index)
+            .having(func.count(label.id) > 1)
+        ).all()
+        stranded = session.execute(select(func.count(label.id)).where(label.sort_index < 1)).scalar()
+    return len({(row.part_number, row.rolling_label) for row in duplicates}), stranded
+
+
+def report(stations: List[Station], seconds: float, engine: Engine) -> None:
+    latencies = defaultdict(list)
+    outcomes = Counter()
+    errors = []
+    for station in stations:
+        for operation, values in station.result.latencies.items():
+            latencies[operation].extend(values)
+        outcomes.update(station.result.outcomes)
+        errors.extend(station.result.errors)
+
+    total = sum(outcomes.values())
+    print(f"Operations: {total} in {seconds:.1f}s ({total / seconds:.0f} ops/s, {outcomes_total(outcomes, OK) / seconds:.0f} succeeded/s)")
+    print()
+    print(f"{'operation':10} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  " + "  ".join(f"{outcome:>12}" for outcome in OUTCOMES))
+    for operation in OPERATIONS:
+        values = sorted(latencies[operation])
+        if not values:
+            continue
+        counts = "  ".join(f"{outcomes[(operation, outcome)]:>12}" for outcome in OUTCOMES)
+        print(
+            f"{operation:10} {len(values):>7} {percentile(values, 50) * 1000:>8.1f} {percentile(values, 95) * 1000:>8.1f} "
+            f"{percentile(values, 99) * 1000:>8.1f} {values[-1] * 1000:>8.1f}  {counts}"
+        )
+    print()
+    print(f"Deadlocks: {outcomes_total(outcomes, DEADLOCK)}  Lock timeouts: {outcomes_total(outcomes, LOCK_TIMEOUT)}  "
+          f"Constraint violations: {outcomes_total(outcomes, CONSTRAINT)}  Conflicts: {outcomes_total(outcomes, CONFLICT)}  "
+          f"Other errors: {outcomes_total(outcomes, ERROR)}")
+    duplicate_groups, stranded = check_sort_order(engine)
+    print(f"Sort order after the run: {duplicate_groups} label groups with a repeated sort_index, {stranded} labels left at sort_index -1.")
+    for error in errors[:10]:
+        print(f"  {error}")
+
+
+def outcomes_total(outcomes: Counter, outcome: str) -> int:
+    return sum(count for (_, item), count in outcomes.items() if item == outcome)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Simulate many stations working on the same harnesses at once.")
+    parser.add_argument("--stations", type=int, default=40, help="Number of concurrent stations.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("create=25,edit=35,delete=15,search=25"),
+                        help="Operation weights, e.g. create=25,edit=35,delete=15,search=25.")
+    parser.add_argument("--part-numbers", type=int, default=5, help="Number of shared part numbers. Fewer means more contention.")
+    parser.add_argument("--labels-per-part", type=int, default=20, help="Starting labels per part number and label type.")
+    parser.add_argument("--values", type=int, default=30, help="Number of distinct label values, e.g. J1 to J30.")
+    parser.add_argument("--think-ms", type=float, default=20.0, help="Longest pause in a dialog between reading and saving.")
+    parser.add_argument("--lock-timeout", type=float, default=5.0, help="Seconds SQLite waits for a lock before failing.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable runs.")
+    parser.add_argument("--url", default="", help="SQLAlchemy URL of a scratch database. Defaults to a temporary SQLite file.")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    # Deletes of labels another station already deleted warn on every run, the check at the end covers them.
+    warnings.filterwarnings("ignore", category=SAWarning)
+    engine = make_engine(args)
+    user_ids = seed(engine, args)
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    print(f"Stations: {args.stations}, Part numbers: {args.part_numbers}, Labels: {args.part_numbers * 2 * args.labels_per_part}, "
+          f"Mix: {', '.join(f'{name}={weight}' for name, weight in args.mix.items())}")
+
+    start_barrier = threading.Barrier(args.stations + 1)
+    stop_event = threading.Event()
+    stations = [Station(number, engine, user_ids[number], args, start_barrier, stop_event) for number in range(args.stations)]
+    for station in stations:
+        station.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    stop_event.set()
+    for station in stations:
+        station.join()
+    seconds = time.perf_counter() - started
+    report(stations, seconds, engine)
+
+
+if __name__ == "__main__":
+    main()
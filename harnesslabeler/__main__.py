@@ -0,0 +1,5 @@
+import sys
+from harnesslabeler.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,216 @@
+"""Module for the database backends the program can run on.
+    The 'Database/Backend' setting picks MySQL (the default) or an embedded SQLite file.
+    Statements that differ between the two live here."""
+from __future__ import annotations
+from typing import Dict, List
+
+from sqlalchemy import Column, Computed, ForeignKey, MetaData, Table, UniqueConstraint, func, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import StaticPool
+
+from harnesslabeler import config
+
+
+MYSQL = "mysql"
+SQLITE = "sqlite"
+SQLITE_MEMORY = ":memory:"
+
+
+class Backend:
+    """Base class for a database backend."""
+
+    name = ""
+
+    @property
+    def url(self) -> str:
+        raise NotImplementedError
+
+    def engine_options(self) -> dict:
+        """Extra keyword arguments for create_engine."""
+        return {}
+
+    def on_connect(self, dbapi_connection, connection_record) -> None:
+        """Called for every new DBAPI connection."""
+        pass
+
+    def quote(self, name: str) -> str:
+        return f'"{name}"'
+
+    def set_foreign_key_checks(self, session, enabled: bool) -> None:
+        """Turn foreign key checks on or off for the connection of session."""
+        raise NotImplementedError
+
+    def create_staging_table(self, session, table: Table, suffix: str) -> None:
+        """Create an empty copy of table named table.name + suffix."""
+        raise NotImplementedError
+
+    def swap_tables(self, session, tables: List[Table], staging_suffix: str, old_suffix: str) -> None:
+        """Replace the live tables with the staging tables in one step.
+        The live tables may be left behind with old_suffix for the caller to drop."""
+        raise NotImplementedError
+
+    def add_login_days(self, session, table: Table, rows: List[dict]) -> None:
+        """Insert daily login rows, or add them to the row already stored for the same user and day.
+        A single statement, so two stations counting the same user and day can not collide."""
+        raise NotImplementedError
+
+
+class MySQLBackend(Backend):
+    name = MYSQL
+
+    @property
+    def url(self) -> str:
+        return config.DATABASE_URL_WITH_SCHEMA
+
+    def engine_options(self) -> dict:
+        return {
+            "pool_size": config.DATABASE_POOL_SIZE,
+            "max_overflow": config.DATABASE_MAX_OVERFLOW,
+            "pool_recycle": config.DATABASE_POOL_RECYCLE_SECONDS,
+            "pool_timeout": config.DATABASE_POOL_TIMEOUT_SECONDS
+        }
+
+    def quote(self, name: str) -> str:
+        return f"`{name}`"
+
+    def set_foreign_key_checks(self, session, enabled: bool) -> None:
+        session.execute(text(f"SET foreign_key_checks = {int(enabled)};"))
+
+    def create_staging_table(self, session, table: Table, suffix: str) -> None:
+        # Foreign keys point at the staging parent tables, so they follow the rename and
+        # point at the live tables after the swap.
+        staging = self.quote(table.name + suffix)
+        session.execute(text(f"CREATE TABLE {staging} LIKE {self.quote(table.name)};"))
+        for foreign_key in table.foreign_keys:
+            referenced = self.quote(foreign_key.column.table.name + suffix)
+            session.execute(text(
+                f"ALTER TABLE {staging} ADD FOREIGN KEY ({self.quote(foreign_key.parent.name)}) "
+                f"REFERENCES {referenced} ({self.quote(foreign_key.column.name)});"
+            ))
+
+    def swap_tables(self, session, tables: List[Table], staging_suffix: str, old_suffix: str) -> None:
+        # RENAME TABLE with several pairs is atomic. Live tables are renamed out of the way
+        # first so constraint names do not collide.
+        renames = [f"{self.quote(table.name)} TO {self.quote(table.name + old_suffix)}" for table in tables]
+        renames.extend(f"{self.quote(table.name + staging_suffix)} TO {self.quote(table.name)}" for table in tables)
+        session.execute(text(f"RENAME TABLE {', '.join(renames)};"))
+
+    def add_login_days(self, session, table: Table, rows: List[dict]) -> None:
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update(
+            logins=table.c.logins + statement.inserted.logins,
+            logouts=table.c.logouts + statement.inserted.logouts,
+            first_event_date=func.least(table.c.first_event_date, statement.inserted.first_event_date),
+            last_event_date=func.greatest(table.c.last_event_date, statement.inserted.last_event_date)
+        )
+        session.execute(statement, rows)
+
+
+class SQLiteBackend(Backend):
+    """Embedded SQLite file in WAL mode, or an in-memory database for benchmarks and tests."""
+
+    name = SQLITE
+
+    def __init__(self, file_path: str=None):
+        self.file_path = file_path or config.SQLITE_FILE
+
+    @property
+    def url(self) -> str:
+        if self.file_path == SQLITE_MEMORY:
+            return "sqlite://"
+        return f"sqlite:///{self.file_path}"
+
+    def engine_options(self) -> dict:
+        options = {"connect_args": {"check_same_thread": False}}
+        if self.file_path == SQLITE_MEMORY:
+            # Every connection would get its own empty database otherwise.
+            options["poolclass"] = StaticPool
+        else:
+            options["pool_size"] = config.DATABASE_POOL_SIZE
+            options["max_overflow"] = config.DATABASE_MAX_OVERFLOW
+            options["pool_timeout"] = config.DATABASE_POOL_TIMEOUT_SECONDS
+        return options
+
+    def on_connect(self, dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        if self.file_path != SQLITE_MEMORY:
+            # WAL lets searches read while another connection writes.
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    def set_foreign_key_checks(self, session, enabled: bool) -> None:
+        # Only takes effect outside a transaction, so call it before the first change.
+        session.execute(text(f"PRAGMA foreign_keys = {int(enabled)};"))
+
+    def create_staging_table(self, session, table: Table, suffix: str) -> None:
+        # SQLite can not add foreign keys to an existing table, so the copy is built with
+        # them pointing at the staging parent tables. Renames rewrite those references,
+        # so they point at the live tables after the swap like on MySQL. Index names are
+        # global in SQLite, so indexes are created after the swap.
+        connection = session.connection()
+        metadata = MetaData()
+        for foreign_key in table.foreign_keys:
+            Table(foreign_key.column.table.name + suffix, metadata, autoload_with=connection)
+        columns = [
+            Column(
+                column.name, column.type,
+                *[ForeignKey(f"{foreign_key.column.table.name}{suffix}.{foreign_key.column.name}") for foreign_key in column.foreign_keys],
+                *([Computed(column.computed.sqltext, persisted=column.computed.persisted)] if column.computed is not None else []),
+                primary_key=column.primary_key, nullable=column.nullable, autoincrement=column.autoincrement,
+                server_default=column.server_default
+                )
+            for column in table.columns
+        ]
+        constraints = [
+            UniqueConstraint(*constraint.columns.keys(), name=constraint.name)
+            for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+        ]
+        Table(table.name + suffix, metadata, *columns, *constraints).create(connection)
+
+    def swap_tables(self, session, tables: List[Table], staging_suffix: str, old_suffix: str) -> None:
+        # SQLite DDL is transactional, so the renames, drops and index creation commit together.
+        connection = session.connection()
+        for table in tables:
+            session.execute(text(f"ALTER TABLE {self.quote(table.name)} RENAME TO {self.quote(table.name + old_suffix)};"))
+        for table in tables:
+            session.execute(text(f"ALTER TABLE {self.quote(table.name + staging_suffix)} RENAME TO {self.quote(table.name)};"))
+        for table in reversed(tables):
+            session.execute(text(f"DROP TABLE {self.quote(table.name + old_suffix)};"))
+        for table in tables:
+            for index in table.indexes:
+                index.create(connection)
+
+    def add_login_days(self, session, table: Table, rows: List[dict]) -> None:
+        # min and max with two arguments are SQLite's least and greatest.
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={
+                "logins": table.c.logins + statement.excluded.logins,
+                "logouts": table.c.logouts + statement.excluded.logouts,
+                "first_event_date": func.min(table.c.first_event_date, statement.excluded.first_event_date),
+                "last_event_date": func.max(table.c.last_event_date, statement.excluded.last_event_date)
+            }
+        )
+        session.execute(statement, rows)
+
+
+BACKENDS = {
+    MYSQL: MySQLBackend,
+    SQLITE: SQLiteBackend
+} # type: Dict[str, type]
+
+
+def get_backend(name: str=None) -> Backend:
+    """Return the backend named by the 'Database/Backend' setting.
+
+    Raises:
+        ValueError: If the name is not a known backend.
+    """
+    name = (name or config.DATABASE_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{name}'. Expected one of: {', '.join(BACKENDS)}.")
+    return BACKENDS[name]()
@@ -0,0 +1,565 @@
+"""Module to create and restore database backups.
+    A full backup holds every row. An incremental backup only holds the rows
+    changed since its parent backup, found using high-water marks."""
+from __future__ import annotations
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import MetaData, func, text
+
+from harnesslabeler import config, database, errors, loginhistory, models, nativedump
+from harnesslabeler.codec import LABEL_CODEC, USER_CODEC, USER_LOGIN_CODEC, SECTION_CODECS
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import Progress, chunks
+from harnesslabeler.replica import CLOCK_SKEW_OVERLAP
+
+logger = logging.getLogger("backend")
+
+
+BACKUP_FORMAT_VERSION = 1
+FULL_BACKUP = "full"
+INCREMENTAL_BACKUP = "incremental"
+HIGH_WATER_MARK_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+@dataclass
+class HighWaterMarks:
+    """Highest values seen when a backup was taken."""
+
+    label_date_modified: Optional[datetime] = None
+    user_login_id: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "label_date_modified": self.label_date_modified.strftime(HIGH_WATER_MARK_FORMAT) if self.label_date_modified else None,
+            "user_login_id": self.user_login_id
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'HighWaterMarks':
+        label_date_modified = data.get("label_date_modified")
+        return HighWaterMarks(
+            label_date_modified=datetime.strptime(label_date_modified, HIGH_WATER_MARK_FORMAT) if label_date_modified else None,
+            user_login_id=data.get("user_login_id")
+        )
+
+    @staticmethod
+    def from_database(session) -> 'HighWaterMarks':
+        """Read the current high-water marks from the database."""
+        return HighWaterMarks(
+            label_date_modified=session.query(func.max(models.BreakoutLabel.date_modified)).scalar(),
+            user_login_id=session.query(func.max(models.UserLoginLog.id)).scalar()
+        )
+
+
+@dataclass
+class BackupResult:
+    """Summary of a created backup."""
+
+    file_path: str
+    backup_type: str
+    labels: int
+    users: int
+    user_logins: int
+    high_water_marks: HighWaterMarks
+    parent: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.backup_type} backup '{self.file_path}': {self.labels} labels, {self.users} users, {self.user_logins} user logins"
+
+
+@dataclass
+class ManifestEntry:
+    """A backup recorded in the backup manifest."""
+
+    file_path: str
+    backup_type: str
+    created: str
+    high_water_marks: HighWaterMarks
+    parent: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "file_path": self.file_path,
+            "backup_type": self.backup_type,
+            "created": self.created,
+            "high_water_marks": self.high_water_marks.to_dict(),
+            "parent": self.parent
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'ManifestEntry':
+        return ManifestEntry(
+            file_path=data["file_path"],
+            backup_type=data["backup_type"],
+            created=data["created"],
+            high_water_marks=HighWaterMarks.from_dict(data.get("high_water_marks", {})),
+            parent=data.get("parent")
+        )
+
+
+@dataclass
+class BackupManifest:
+    """List of backups taken, oldest first. Used to find the parent of the next incremental backup."""
+
+    file_path: str = config.BACKUP_MANIFEST_FILE
+    entries: List[ManifestEntry] = field(default_factory=list)
+
+    def latest(self) -> Optional[ManifestEntry]:
+        """Return the newest backup that still exists on disk."""
+        for entry in reversed(self.entries):
+            if os.path.exists(entry.file_path):
+                return entry
+        return None
+
+    def add(self, entry: ManifestEntry) -> None:
+        self.entries.append(entry)
+        self.save()
+
+    def start_new_chain(self) -> None:
+        """Forget earlier backups, so the next automatic backup is a full one.
+        Called after a restore, the old marks no longer describe the data."""
+        if self.entries:
+            logger.info(f"[BACKUP] Data was restored, the next backup starts a new chain. Cleared {len(self.entries)} manifest entries.")
+        self.entries = []
+        self.save()
+
+    def save(self) -> None:
+        with open(self.file_path, "w") as f:
+            json.dump({"entries": [entry.to_dict() for entry in self.entries]}, f, indent=4)
+
+    @staticmethod
+    def load(file_path: str=config.BACKUP_MANIFEST_FILE) -> 'BackupManifest':
+        if not os.path.exists(file_path):
+            return BackupManifest(file_path=file_path)
+
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return BackupManifest(file_path=file_path, entries=[ManifestEntry.from_dict(entry) for entry in data.get("entries", [])])
+
+
+def read_backup_header(file_path: str) -> dict:
+    """Return the 'backup' header of a backup file. Backups made before headers existed are treated as full backups."""
+    with open(file_path, "r") as f:
+        data = json.load(f)
+    return data.get("backup", {"type": FULL_BACKUP})
+
+
+def _start(progress: Optional[Progress], stage: str, session, model, where=None) -> None:
+    """Start a progress stage with the row count of the table. Skips the count query without progress."""
+    if not progress:
+        return
+    query = session.query(func.count(model.id))
+    if where is not None:
+        query = query.filter(where)
+    progress.start(stage, query.scalar())
+
+
+def _write_backup(file_path: str, header: dict, labels: List[dict], users: List[dict], user_logins: List[dict]) -> None:
+    data = {
+        "backup": header,
+        "labels": labels,
+        "users": users,
+        "user_logins": user_logins
+    }
+
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def export_full(file_path: str, manifest: BackupManifest=None, progress: Progress=None, read_only: bool=True) -> BackupResult:
+    """Create a full backup of the database. Reads from the read replica when one is set.
+
+    Args:
+        file_path (str): The file to save the backup to.
+        manifest (BackupManifest, optional): Manifest to record the backup in. Defaults to the program manifest.
+        progress (Progress, optional): Receives progress and cancellation.
+        read_only (bool, optional): Allow reading from the read replica. Defaults to True.
+
+    Returns:
+        BackupResult: Summary of the backup.
+    """
+    logger.info(f"[BACKUP] Starting full database backup. File: '{file_path}'")
+    manifest = manifest or BackupManifest.load()
+
+    with DBContext(read_only=read_only) as session:
+        marks = HighWaterMarks.from_database(session)
+        _start(progress, "Exporting labels", session, models.BreakoutLabel)
+        labels = list(LABEL_CODEC.fetch(session, order_by=(
+                        models.BreakoutLabel.part_number,
+                        models.BreakoutLabel.sort_index,
+                        models.BreakoutLabel.rolling_label
+                        ), progress=progress))
+        logger.info(f"[BACKUP] Saving {len(labels)} labels.")
+
+        _start(progress, "Exporting users", session, models.User)
+        users = list(USER_CODEC.fetch(session, order_by=(models.User.id,), progress=progress))
+        logger.info(f"[BACKUP] Saving {len(users)} users.")
+
+        _start(progress, "Exporting user logins", session, models.UserLoginLog)
+        login_logs = list(USER_LOGIN_CODEC.fetch(session, order_by=(models.UserLoginLog.id,), progress=progress))
+        logger.info(f"[BACKUP] Saving {len(login_logs)} user logins.")
+
+        header = {
+            "format_version": BACKUP_FORMAT_VERSION,
+            "type": FULL_BACKUP,
+            "created": datetime.now().strftime(HIGH_WATER_MARK_FORMAT),
+            "parent": None,
+            "high_water_marks": marks.to_dict()
+        }
+        _write_backup(file_path, header, labels, users, login_logs)
+
+    manifest.add(ManifestEntry(file_path=file_path, backup_type=FULL_BACKUP, created=header["created"], high_water_marks=marks))
+    result = BackupResult(file_path, FULL_BACKUP, len(labels), len(users), len(login_logs), marks)
+    logger.info(f"[BACKUP] Created {result}.")
+    return result
+
+
+def export_incremental(file_path: str, parent: ManifestEntry=None, manifest: BackupManifest=None, progress: Progress=None, read_only: bool=True) -> BackupResult:
+    """Create an incremental backup holding only the rows changed since the parent backup.
+
+    Labels are selected by date_modified and user logins by id. The users table is small
+    and has no modified date, so every increment holds all users. Every increment also holds
+    the ids of all labels and user logins, so rows deleted since the parent are dropped on restore.
+    Reads from the read replica when one is set, marks and rows come from the same snapshot.
+
+    Args:
+        file_path (str): The file to save the backup to.
+        parent (ManifestEntry, optional): The backup to build on. Defaults to the latest backup in the manifest.
+        manifest (BackupManifest, optional): Manifest to record the backup in. Defaults to the program manifest.
+        progress (Progress, optional): Receives progress and cancellation.
+        read_only (bool, optional): Allow reading from the read replica. Defaults to True.
+
+    Raises:
+        errors.BackupError: If there is no parent backup to build on.
+
+    Returns:
+        BackupResult: Summary of the backup.
+    """
+    manifest = manifest or BackupManifest.load()
+    parent = parent or manifest.latest()
+    if not parent:
+        raise errors.BackupError("No previous backup found. A full backup is required before an incremental backup.")
+
+    logger.info(f"[BACKUP] Starting incremental database backup. File: '{file_path}', Parent: '{parent.file_path}'")
+    parent_marks = parent.high_water_marks
+
+    with DBContext(read_only=read_only) as session:
+        marks = HighWaterMarks.from_database(session)
+
+        where = None
+        if parent_marks.label_date_modified:
+            # date_modified comes from the clock of the station that saved the label, so re-read
+            # a window before the mark to pick up rows saved by a station whose clock runs behind.
+            where = models.BreakoutLabel.date_modified >= parent_marks.label_date_modified - CLOCK_SKEW_OVERLAP
+        _start(progress, "Exporting changed labels", session, models.BreakoutLabel, where)
+        labels = list(LABEL_CODEC.fetch(session, order_by=(models.BreakoutLabel.part_number, models.BreakoutLabel.sort_index), where=where, progress=progress))
+        logger.info(f"[BACKUP] Saving {len(labels)} changed labels.")
+
+        label_ids = [row[0] for row in session.query(models.BreakoutLabel.id).order_by(models.BreakoutLabel.id)]
+
+        _start(progress, "Exporting users", session, models.User)
+        users = list(USER_CODEC.fetch(session, order_by=(models.User.id,), progress=progress))
+        logger.info(f"[BACKUP] Saving {len(users)} users.")
+
+        where = None
+        if parent_marks.user_login_id:
+            where = models.UserLoginLog.id > parent_marks.user_login_id
+        _start(progress, "Exporting new user logins", session, models.UserLoginLog, where)
+        login_logs = list(USER_LOGIN_CODEC.fetch(session, order_by=(models.UserLoginLog.id,), where=where, progress=progress))
+        logger.info(f"[BACKUP] Saving {len(login_logs)} new user logins.")
+        user_login_ids = [row[0] for row in session.query(models.UserLoginLog.id).order_by(models.UserLoginLog.id)]
+
+        header = {
+            "format_version": BACKUP_FORMAT_VERSION,
+            "type": INCREMENTAL_BACKUP,
+            "created": datetime.now().strftime(HIGH_WATER_MARK_FORMAT),
+            "parent": parent.file_path,
+            "high_water_marks": marks.to_dict(),
+            "label_ids": label_ids,
+            "user_login_ids": user_login_ids
+        }
+        _write_backup(file_path, header, labels, users, login_logs)
+
+    manifest.add(ManifestEntry(file_path=file_path, backup_type=INCREMENTAL_BACKUP, created=header["created"], high_water_marks=marks, parent=parent.file_path))
+    result = BackupResult(file_path, INCREMENTAL_BACKUP, len(labels), len(users), len(login_logs), marks, parent=parent.file_path)
+    logger.info(f"[BACKUP] Created {result}.")
+    return result
+
+
+def auto_backup_path(folder: str=config.DUMPS_FOLDER, prefix: str="AUTO_Harness_Labeler_Database_Backup") -> str:
+    """Return a time stamped file path for an automatic backup."""
+    return os.path.join(folder, f"{prefix}_{datetime.now().strftime(config.DATETIME_FORMAT_FILE_SAFE)}.json")
+
+
+def export_auto(folder: str=config.DUMPS_FOLDER, prefix: str="AUTO_Harness_Labeler_Database_Backup", progress: Progress=None) -> BackupResult:
+    """Create an incremental backup if a previous backup exists, otherwise a full backup.
+
+    This is the safety backup taken before a restore, so it reads from the primary. The
+    read replica can lag behind and the restore would then replace rows the backup misses.
+    """
+    file_path = auto_backup_path(folder, prefix)
+    manifest = BackupManifest.load()
+    if manifest.latest():
+        return export_incremental(file_path, manifest=manifest, progress=progress, read_only=False)
+    return export_full(file_path, manifest=manifest, progress=progress, read_only=False)
+
+
+def export_preferred(file_path: str, manifest: BackupManifest=None, progress: Progress=None, read_only: bool=True):
+    """Create a native mysqldump backup when mysqldump is configured, otherwise a full JSON backup.
+
+    Args:
+        file_path (str): The JSON file to create. A native backup uses a folder of the same name without the extension.
+        manifest (BackupManifest, optional): Manifest to record a JSON backup in. Defaults to the program manifest.
+        progress (Progress, optional): Receives progress and cancellation. A native backup only reports its stage.
+        read_only (bool, optional): Allow a JSON backup to read from the read replica. Pass False for
+            the backup taken before a restore. Defaults to True.
+
+    Returns:
+        NativeDumpResult or BackupResult: Summary of the backup.
+    """
+    if nativedump.is_available():
+        if progress:
+            progress.start("Running mysqldump")
+        return nativedump.dump(os.path.splitext(file_path)[0])
+
+    logger.info("[BACKUP] mysqldump is not configured. Using JSON backup.")
+    return export_full(file_path, manifest=manifest, progress=progress, read_only=read_only)
+
+
+def restore_native(file_path: str, manifest: BackupManifest=None) -> nativedump.NativeDumpResult:
+    """Restore a native backup, end the current backup chain and make replicas reload, see nativedump.restore."""
+    result = nativedump.restore(file_path)
+    (manifest or BackupManifest.load()).start_new_chain()
+    with DBContext() as session:
+        models.DataGeneration.bump(session)
+        session.commit()
+    return result
+
+
+def resolve_chain(file_path: str) -> List[str]:
+    """Return the backup files needed to restore the given backup, base backup first.
+
+    Raises:
+        errors.BackupError: If a parent backup in the chain is missing.
+    """
+    chain = []
+    current = file_path
+    while current:
+        if not os.path.exists(current):
+            # Parents are recorded by path. Fall back to the folder of the child in case backups were moved.
+            moved = os.path.join(os.path.dirname(file_path), os.path.basename(current))
+            if not os.path.exists(moved):
+                raise errors.BackupError(f"Backup chain is broken. Missing backup file: '{current}'.")
+            current = moved
+        if current in chain:
+            raise errors.BackupError(f"Backup chain has a loop at: '{current}'.")
+        chain.append(current)
+        header = read_backup_header(current)
+        current = header.get("parent") if header.get("type") == INCREMENTAL_BACKUP else None
+
+    chain.reverse()
+    return chain
+
+
+def merge_backups(base: dict, increments: List[dict]) -> dict:
+    """Replay incremental backups on top of a base backup.
+
+    Args:
+        base (dict): The loaded base (full) backup.
+        increments (List[dict]): The loaded incremental backups, oldest first.
+
+    Returns:
+        dict: Backup data in the full backup format.
+    """
+    labels = {item["id"]: item for item in base.get("labels", [])}
+    users = {item["id"]: item for item in base.get("users", [])}
+    user_logins = {item["id"]: item for item in base.get("user_logins", [])}
+    header = base.get("backup", {"type": FULL_BACKUP})
+
+    for increment in increments:
+        for item in increment.get("labels", []):
+            labels[item["id"]] = item
+        label_ids = increment.get("backup", {}).get("label_ids")
+        if label_ids is not None:
+            label_ids = set(label_ids)
+            labels = {id_: item for id_, item in labels.items() if id_ in label_ids}
+
+        # Every increment holds the complete users table.
+        users = {item["id"]: item for item in increment.get("users", [])}
+
+        for item in increment.get("user_logins", []):
+            user_logins[item["id"]] = item
+        # Increments made before user_login_ids existed can not drop deleted logins.
+        user_login_ids = increment.get("backup", {}).get("user_login_ids")
+        if user_login_ids is not None:
+            user_login_ids = set(user_login_ids)
+            user_logins = {id_: item for id_, item in user_logins.items() if id_ in user_login_ids}
+        header = increment.get("backup", header)
+
+    header = {key: value for key, value in header.items() if key not in ("label_ids", "user_login_ids")}
+    return {
+        "backup": dict(header, type=FULL_BACKUP, parent=None),
+        "labels": sorted(labels.values(), key=lambda item: (item["part_number"], item["sort_index"], item["rolling_label"])),
+        "users": sorted(users.values(), key=lambda item: item["id"]),
+        "user_logins": sorted(user_logins.values(), key=lambda item: item["id"])
+    }
+
+
+def load_backup(file_path: str) -> dict:
+    """Load a backup file. Incremental backups are replayed on top of their base backup.
+
+    Args:
+        file_path (str): The backup file to load.
+
+    Returns:
+        dict: Backup data in the full backup format.
+    """
+    chain = resolve_chain(file_path)
+    logger.info(f"[BACKUP] Loading backup chain: {chain}")
+
+    loaded = []
+    for path in chain:
+        with open(path, "r") as f:
+            loaded.append(json.load(f))
+    return merge_backups(loaded[0], loaded[1:])
+
+
+# Parent tables first, so staged rows can be checked against their foreign keys as they load.
+RESTORE_SECTIONS = (
+    ("users", models.User),
+    ("labels", models.BreakoutLabel),
+    ("user_logins", models.UserLoginLog)
+)
+STAGING_SUFFIX = "_staging"
+OLD_SUFFIX = "_old"
+
+
+def _quote(name: str) -> str:
+    return database.backend.quote(name)
+
+
+def _drop_tables(session, suffix: str) -> None:
+    """Drop leftover staging or old tables, children first."""
+    for _, model in reversed(RESTORE_SECTIONS):
+        session.execute(text(f"DROP TABLE IF EXISTS {_quote(model.__tablename__ + suffix)};"))
+
+
+def _create_staging_tables(session) -> None:
+    """Create empty copies of the live tables, parents first."""
+    for _, model in RESTORE_SECTIONS:
+        database.backend.create_staging_table(session, model.__table__, STAGING_SUFFIX)
+
+
+def _check_staging_tables(session, counts: Dict[str, int]) -> List[str]:
+    """Return problems found in the staged data. Checks row counts and every foreign key."""
+    problems = []
+    for section, model in RESTORE_SECTIONS:
+        staging = _quote(model.__tablename__ + STAGING_SUFFIX)
+        staged = session.execute(text(f"SELECT COUNT(*) FROM {staging};")).scalar()
+        if staged != counts[section]:
+            problems.append(f"'{section}' staged {staged} rows, expected {counts[section]}.")
+
+        for foreign_key in model.__table__.foreign_keys:
+            column = _quote(foreign_key.parent.name)
+            referenced = _quote(foreign_key.column.table.name + STAGING_SUFFIX)
+            orphans = session.execute(text(
+                f"SELECT COUNT(*) FROM {staging} AS child "
+                f"LEFT JOIN {referenced} AS parent ON parent.{_quote(foreign_key.column.name)} = child.{column} "
+                f"WHERE child.{column} IS NOT NULL AND parent.{_quote(foreign_key.column.name)} IS NULL;"
+            )).scalar()
+            if orphans:
+                problems.append(f"'{section}' has {orphans} rows where {foreign_key.parent.name} references a missing {foreign_key.column.table.name}.")
+    return problems
+
+
+def _swap_staging_tables(session) -> None:
+    """Publish the staging tables in one step: one RENAME TABLE on MySQL, one transaction on SQLite."""
+    database.backend.swap_tables(session, [model.__table__ for _, model in RESTORE_SECTIONS], STAGING_SUFFIX, OLD_SUFFIX)
+    session.commit()
+
+
+RESTORE_CHUNK_SIZE = 1000
+
+
+def restore_data(data: dict, progress: Progress=None, manifest: BackupManifest=None) -> Dict[str, int]:
+    """Replace all data in the database with the backup data. The restore is all-or-nothing.
+
+    Rows are loaded into staging tables while the live tables keep serving. Once the
+    row counts and foreign keys are checked, the staging tables replace the live tables
+    in one atomic step. If anything fails before the swap the live data is untouched.
+
+    Args:
+        data (dict): Validated backup data in the full backup format.
+        progress (Progress, optional): Receives progress. Cancelling before the swap leaves the live data untouched.
+        manifest (BackupManifest, optional): Manifest whose chain is ended by the restore. Defaults to the program manifest.
+
+    Raises:
+        errors.BackupError: If the data could not be staged or failed the checks.
+        errors.OperationCancelled: If cancelled through progress.
+
+    Returns:
+        Dict[str, int]: Number of rows restored per section.
+    """
+    counts = {}
+    with DBContext() as session:
+        try:
+            logger.info("[RESTORE] Creating staging tables.")
+            _drop_tables(session, STAGING_SUFFIX)
+            _drop_tables(session, OLD_SUFFIX)
+            _create_staging_tables(session)
+
+            for section, model in RESTORE_SECTIONS:
+                logger.info(f"[RESTORE] Staging '{section}'.")
+                rows = SECTION_CODECS[section].decode_all(data[section])
+                staging = model.__table__.to_metadata(MetaData(), name=model.__tablename__ + STAGING_SUFFIX)
+                if progress:
+                    progress.start(f"Staging {section}", len(rows))
+                for chunk in chunks(rows, RESTORE_CHUNK_SIZE):
+                    session.execute(staging.insert(), chunk)
+                    if progress:
+                        progress.advance(len(chunk))
+                session.commit()
+                counts[section] = len(rows)
+                logger.info(f"[RESTORE] Staged {len(rows)} {section}.")
+
+            problems = _check_staging_tables(session, counts)
+            if problems:
+                raise errors.BackupError(f"Staged data failed checks. {' '.join(problems)}")
+
+            if progress:
+                progress.start("Replacing live tables")
+            logger.warning("[RESTORE] Replacing live tables with staging tables.")
+            _swap_staging_tables(session)
+        except Exception as error:
+            session.rollback()
+            logger.critical("[RESTORE] Error staging data. Live data was not changed.")
+            logger.exception("[RESTORE] Error staging data.")
+            try:
+                _drop_tables(session, STAGING_SUFFIX)
+            except Exception:
+                logger.exception("[RESTORE] Could not drop staging tables.")
+            if isinstance(error, errors.OperationCancelled):
+                raise errors.OperationCancelled(f"{error} Live data was not changed.") from error
+            if isinstance(error, errors.Error):
+                raise
+            raise errors.BackupError(f"Error restoring data. Live data was not changed. Error: {error}") from error
+
+        _drop_tables(session, OLD_SUFFIX)
+        (manifest or BackupManifest.load()).start_new_chain()
+        # Restored labels keep their old date_modified, this makes every replica reload them.
+        models.DataGeneration.bump(session)
+        session.commit()
+        try:
+            loginhistory.rebuild(session)
+            session.commit()
+        except Exception as error:
+            session.rollback()
+            logger.exception("[RESTORE] Could not rebuild the daily login counts.")
+            raise errors.BackupError(f"Restored all data, but could not rebuild the daily login counts. Error: {error}") from error
+
+    logger.info(f"[RESTORE] Successfully imported all data. {counts}")
+    return counts
@@ -0,0 +1,236 @@
+"""Command line interface for backup, restore, import and integrity tasks.
+    Runs without a GUI session, so tasks can be scheduled or scripted.
+
+    Usage: python -m harnesslabeler <command> [options]"""
+from __future__ import annotations
+import argparse
+import logging
+import sys
+import time
+from typing import List, Optional
+from sqlalchemy import text
+
+from harnesslabeler import backup, config, database, diffrestore, errors, importer, integrity, loginhistory, migrations, models, nativedump, repository, validation
+from harnesslabeler.database import DBContext
+
+logger = logging.getLogger("backend")
+
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+
+
+def _print_rate(action: str, rows: int, seconds: float) -> None:
+    rate = rows / seconds if seconds else 0.0
+    print(f"{action} {rows} rows in {seconds:.2f}s ({rate:.0f} rows/s).")
+
+
+def _find_user_id(username: str) -> int:
+    with DBContext() as session:
+        user = repository.user_by_username(session, username) # type: Optional[models.User]
+        if not user:
+            raise errors.Error(f"User '{username}' does not exist.")
+        if not user.active:
+            raise errors.Error(f"User '{username}' has been deactivated.")
+        return user.id
+
+
+def command_export(args: argparse.Namespace) -> int:
+    started = time.perf_counter()
+    if args.incremental:
+        result = backup.export_incremental(args.file)
+    elif args.native:
+        result = backup.export_preferred(args.file)
+        print(result)
+        return EXIT_OK
+    else:
+        result = backup.export_full(args.file)
+    print(result)
+    _print_rate("Exported", result.labels + result.users + result.user_logins, time.perf_counter() - started)
+    return EXIT_OK
+
+
+def command_restore(args: argparse.Namespace) -> int:
+    if args.diff or args.dry_run:
+        return command_diff_restore(args)
+
+    if not args.yes:
+        print("Restoring erases all data currently in the database. Pass --yes to continue.", file=sys.stderr)
+        return EXIT_FAILURE
+
+    started = time.perf_counter()
+    if nativedump.is_native_backup(args.file):
+        if not args.skip_backup:
+            print(f"Created {backup.export_preferred(backup.auto_backup_path(), read_only=False)}.")
+        result = backup.restore_native(args.file)
+        print(result)
+        if not result.integrity.is_valid:
+            print(result.integrity.summary(max_errors=args.max_errors), file=sys.stderr)
+            return EXIT_FAILURE
+        return EXIT_OK
+
+    data = backup.load_backup(args.file)
+    report = validation.validate_backup(data)
+    if not report.is_valid:
+        print(report.summary(max_errors=args.max_errors), file=sys.stderr)
+        return EXIT_FAILURE
+
+    if not args.skip_backup:
+        print(f"Created {backup.export_auto()}.")
+
+    counts = backup.restore_data(data)
+    for section, count in counts.items():
+        print(f"Restored {count} {section}.")
+    _print_rate("Restored", sum(counts.values()), time.perf_counter() - started)
+    return EXIT_OK
+
+
+def command_diff_restore(args: argparse.Namespace) -> int:
+    started = time.perf_counter()
+    data = backup.load_backup(args.file)
+    report = validation.validate_backup(data)
+    if not report.is_valid:
+        print(report.summary(max_errors=args.max_errors), file=sys.stderr)
+        return EXIT_FAILURE
+
+    plan = diffrestore.plan_restore(data)
+    print(plan.report(max_part_numbers=args.max_errors))
+    if args.dry_run:
+        return EXIT_OK
+
+    if not args.yes:
+        print("Pass --yes to apply these changes, or --dry-run to only report them.", file=sys.stderr)
+        return EXIT_FAILURE
+
+    diffrestore.apply_plan(plan)
+    _print_rate("Applied", plan.total, time.perf_counter() - started)
+    return EXIT_OK
+
+
+def command_import(args: argparse.Namespace) -> int:
+    user_id = _find_user_id(args.username)
+    if args.format == "csv":
+        items = importer.read_csv(args.file)
+    else:
+        items = importer.read_json(args.file)
+
+    workers = args.workers or config.IMPORT_WORKERS
+    if workers > 1:
+        result = importer.import_labels_parallel(items, user_id, workers)
+    else:
+        result = importer.import_labels(items, user_id)
+    print(result)
+    for error in result.errors[:args.max_errors]:
+        print(error, file=sys.stderr)
+    return EXIT_FAILURE if result.errors else EXIT_OK
+
+
+def command_check(args: argparse.Namespace) -> int:
+    started = time.perf_counter()
+    if args.file:
+        report = validation.validate_backup(backup.load_backup(args.file))
+    else:
+        with DBContext() as session:
+            report = integrity.check_database(session)
+
+    print(report.summary(max_errors=args.max_errors))
+    _print_rate("Checked", sum(report.counts.values()), time.perf_counter() - started)
+    return EXIT_OK if report.is_valid else EXIT_FAILURE
+
+
+def command_migrate(args: argparse.Namespace) -> int:
+    print(f"Schema version {migrations.upgrade_database()} (latest {migrations.LATEST_VERSION}).")
+    return EXIT_OK
+
+
+def command_prune_logins(args: argparse.Namespace) -> int:
+    started = time.perf_counter()
+    result = loginhistory.apply_retention(
+        months=config.LOGIN_RETENTION_MONTHS if args.months is None else args.months,
+        action=args.action or config.LOGIN_RETENTION_ACTION,
+        batch_size=args.batch_size or config.LOGIN_RETENTION_BATCH_SIZE
+    )
+    print(result)
+    _print_rate("Pruned", result.deleted, time.perf_counter() - started)
+    return EXIT_OK
+
+
+def command_diagnostics(args: argparse.Namespace) -> int:
+    """Open probe sessions at once and print the pool counters, so pool settings can be checked from a station."""
+    started = time.perf_counter()
+    sessions = [DBContext() for _ in range(args.probe)]
+    try:
+        for context in sessions:
+            context.db.execute(text("SELECT 1"))
+    finally:
+        for context in sessions:
+            context.db.close()
+    print(f"Opened {args.probe} session(s) in {time.perf_counter() - started:.3f}s.")
+    print(database.pool_statistics.report(database.engine.pool, database.read_engine.pool if database.read_engine else None))
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m harnesslabeler", description="Harness Labeler data tasks.")
+    parser.add_argument("--max-errors", type=int, default=25, help="Maximum number of errors to print.")
+    parser.add_argument("--profile", action="store_true", help="Profile every query and save the report to the dumps folder.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Backup the database to a JSON file.")
+    export_parser.add_argument("file", help="The backup file to create.")
+    export_parser.add_argument("--incremental", action="store_true", help="Only backup data changed since the last backup.")
+    export_parser.add_argument("--native", action="store_true", help="Use mysqldump when 'MySQLDump Location' is set. Falls back to JSON.")
+    export_parser.set_defaults(func=command_export)
+
+    restore_parser = subparsers.add_parser("restore", help="Replace all data with a backup. Incremental backups are replayed on their base backup.")
+    restore_parser.add_argument("file", help="The backup file to restore.")
+    restore_parser.add_argument("--yes", action="store_true", help="Confirm erasing the current data.")
+    restore_parser.add_argument("--skip-backup", action="store_true", help="Do not backup the current data first.")
+    restore_parser.add_argument("--diff", action="store_true", help="Only apply rows that differ from the database.")
+    restore_parser.add_argument("--dry-run", action="store_true", help="Report the rows --diff would change without changing them.")
+    restore_parser.set_defaults(func=command_restore)
+
+    for name, file_format in (("import-json", "json"), ("import-csv", "csv")):
+        import_parser = subparsers.add_parser(name, help=f"Import labels from a {file_format.upper()} file.")
+        import_parser.add_argument("file", help="The file to import.")
+        import_parser.add_argument("--username", default="admin", help="User recorded as creator of the new labels.")
+        import_parser.add_argument("--workers", type=int, help="Partitions written at once. 1 imports in a single transaction. Defaults to the 'Import Workers' setting.")
+        import_parser.set_defaults(func=command_import, format=file_format)
+
+    check_parser = subparsers.add_parser("check", help="Check the database, or a backup file, for problems.")
+    check_parser.add_argument("--file", help="Validate this backup file instead of the database.")
+    check_parser.set_defaults(func=command_check)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Create the database or apply missing schema migrations.")
+    migrate_parser.set_defaults(func=command_migrate)
+
+    prune_parser = subparsers.add_parser("prune-logins", help="Archive or delete login events older than the retention period. Daily login counts are kept.")
+    prune_parser.add_argument("--months", type=int, help="Keep this many months of events. Defaults to the 'Retention Months' setting.")
+    prune_parser.add_argument("--action", choices=loginhistory.RETENTION_ACTIONS, help="Defaults to the 'Retention Action' setting.")
+    prune_parser.add_argument("--batch-size", type=int, help="Events deleted per transaction. Defaults to the 'Batch Size' setting.")
+    prune_parser.set_defaults(func=command_prune_logins)
+
+    diagnostics_parser = subparsers.add_parser("diagnostics", help="Print connection pool settings and counters.")
+    diagnostics_parser.add_argument("--probe", type=int, default=1, help="Number of sessions to open at once before printing.")
+    diagnostics_parser.set_defaults(func=command_diagnostics)
+    return parser
+
+
+def main(argv: List[str]=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        database.query_profiler.enabled = True
+    try:
+        return args.func(args)
+    except errors.Error as error:
+        logger.error(f"[CLI] {error}")
+        print(f"Error: {error}", file=sys.stderr)
+        return EXIT_FAILURE
+    except Exception as error:
+        logger.exception(f"[CLI] Command '{args.command}' failed.")
+        print(f"Error: {error}", file=sys.stderr)
+        return EXIT_FAILURE
+    finally:
+        if args.profile:
+            print(database.query_profiler.report())
+            print(f"Saved query profile to '{database.query_profiler.dump()}'.")
@@ -0,0 +1,188 @@
+"""Module to convert database rows to and from the backup/export format.
+    Works on plain tuples or Core rows instead of ORM instances, which makes
+    export and import of large tables much faster."""
+from __future__ import annotations
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import Table, select
+
+from harnesslabeler import config, enums, models
+
+logger = logging.getLogger("backend")
+
+
+NEVER = "Never"
+DATETIME_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def parse_datetime(value: str) -> datetime:
+    """Parse a DATETIME_FORMAT string. Timestamps only have minute resolution and repeat heavily, so results are cached."""
+    return datetime.strptime(value, config.DATETIME_FORMAT)
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def format_datetime(value: datetime) -> str:
+    """Format a datetime using DATETIME_FORMAT. Results are cached."""
+    return value.strftime(config.DATETIME_FORMAT)
+
+
+def parse_optional_datetime(value: Optional[str]) -> Optional[datetime]:
+    if value is None or value == NEVER:
+        return None
+    return parse_datetime(value)
+
+
+def format_optional_datetime(value: Optional[datetime]) -> str:
+    if value is None:
+        return NEVER
+    return format_datetime(value)
+
+
+def parse_login_event_type(value: str) -> enums.LoginEventType:
+    return enums.LoginEventType[value]
+
+
+def format_login_event_type(value) -> str:
+    # Core rows return the enum member, raw DBAPI rows return the string.
+    return value.name if isinstance(value, enums.LoginEventType) else value
+
+
+# Converter name -> (encode, decode)
+DATETIME = (format_datetime, parse_datetime)
+OPTIONAL_DATETIME = (format_optional_datetime, parse_optional_datetime)
+LOGIN_EVENT_TYPE = (format_login_event_type, parse_login_event_type)
+
+
+class RowCodec:
+    """Encodes rows of one table to export dicts and decodes export dicts to insert parameters.
+
+    Field order, converters and column lookups are worked out once when the codec is created,
+    so encoding and decoding a row is a single pass with no attribute lookups.
+    """
+
+    def __init__(self, table: Table, fields: Sequence[str], converters: Dict[str, Tuple[Callable, Callable]]=None):
+        self.table = table
+        self.fields = tuple(fields)
+        self.columns = tuple(table.c[name] for name in self.fields)
+        converters = converters or {}
+        self._encoders = tuple((index, name, converters[name][0]) for index, name in enumerate(self.fields) if name in converters)
+        self._decoders = tuple((name, converters[name][1]) for name in self.fields if name in converters)
+
+    def __repr__(self) -> str:
+        return f"<RowCodec(table={self.table.name}, fields={self.fields})>"
+
+    def select(self):
+        """Return a Core select of this codec's columns in field order."""
+        return select(*self.columns)
+
+    def encode(self, row: Sequence[Any]) -> dict:
+        """Encode a tuple or Core row, in field order, to an export dict."""
+        item = dict(zip(self.fields, row))
+        for index, name, encoder in self._encoders:
+            value = row[index]
+            if value is not None or encoder is format_optional_datetime:
+                item[name] = encoder(value)
+        return item
+
+    def encode_all(self, rows: Iterable[Sequence[Any]]) -> List[dict]:
+        encode = self.encode
+        return [encode(row) for row in rows]
+
+    def decode(self, item: dict) -> dict:
+        """Decode an export dict to insert parameters keyed by column name."""
+        values = {name: item[name] for name in self.fields}
+        for name, decoder in self._decoders:
+            value = values[name]
+            if value is not None:
+                values[name] = decoder(value)
+        return values
+
+    def decode_all(self, items: Iterable[dict]) -> List[dict]:
+        decode = self.decode
+        return [decode(item) for item in items]
+
+    def decode_tuple(self, item: dict) -> tuple:
+        """Decode an export dict to a tuple in field order."""
+        values = self.decode(item)
+        return tuple(values[name] for name in self.fields)
+
+    def fetch(self, session, order_by: Sequence=None, where=None, batch_size: int=5000, progress=None) -> Iterator[dict]:
+        """Stream encoded rows of this table from the database. Advances progress once per batch."""
+        statement = self.select()
+        if where is not None:
+            statement = statement.where(where)
+        if order_by:
+            statement = statement.order_by(*order_by)
+
+        result = session.execute(statement.execution_options(stream_results=True))
+        for rows in result.partitions(batch_size):
+            for row in rows:
+                yield self.encode(row)
+            if progress:
+                progress.advance(len(rows))
+
+
+LABEL_CODEC = RowCodec(
+    models.BreakoutLabel.__table__,
+    fields=(
+        "id",
+        "part_number",
+        "value",
+        "sort_index",
+        "rolling_label",
+        "date_created",
+        "date_modified",
+        "created_by_user_id",
+        "modified_by_user_id"
+    ),
+    converters={
+        "date_created": DATETIME,
+        "date_modified": DATETIME
+    }
+)
+
+USER_CODEC = RowCodec(
+    models.User.__table__,
+    fields=(
+        "id",
+        "active",
+        "last_login_date",
+        "first_name",
+        "last_name",
+        "username",
+        "password_hash"
+    ),
+    converters={
+        "last_login_date": OPTIONAL_DATETIME
+    }
+)
+
+USER_LOGIN_CODEC = RowCodec(
+    models.UserLoginLog.__table__,
+    fields=(
+        "id",
+        "event_type",
+        "event_date",
+        "user_id"
+    ),
+    converters={
+        "event_type": LOGIN_EVENT_TYPE,
+        "event_date": DATETIME
+    }
+)
+
+# Backup section name -> codec
+SECTION_CODECS = {
+    "labels": LABEL_CODEC,
+    "users": USER_CODEC,
+    "user_logins": USER_LOGIN_CODEC
+}
+
+
+def clear_caches() -> None:
+    """Clear the datetime parse/format caches."""
+    parse_datetime.cache_clear()
+    format_datetime.cache_clear()
@@ -65,6 +65,7 @@ COMPANY_FOLDER = os.path.join(USER_HOME_FOLDER, "Documents", COMPANY_NAME)
 PROGRAM_FOLDER = os.path.join(COMPANY_FOLDER, PROGRAM_NAME)
 LOG_FOLDER = os.path.join(PROGRAM_FOLDER, "Logs")
 DUMPS_FOLDER = os.path.join(PROGRAM_FOLDER, 'Dumps')
+BACKUP_MANIFEST_FILE = os.path.join(DUMPS_FOLDER, "Backup Manifest.json")
 
 
 if not os.path.exists(COMPANY_FOLDER):
@@ -113,6 +114,8 @@ else:
 
 
 # Database Settings
+DATABASE_BACKEND = DefaultSetting(settings=settings, group_name="Database", name="Backend", value="mysql").initialize_setting().value
+SQLITE_FILE = DefaultSetting(settings=settings, group_name="Database/SQLite", name="File", value=os.path.join(PROGRAM_FOLDER, "Harness Labeler.sqlite3")).initialize_setting().value
 SCHEMA_NAME = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Schema Name", value="wire_label").initialize_setting().value
 DATABASE_USER = DefaultSetting(settings=settings, group_name="Database/MySQL", name="User", value="").initialize_setting()
 DATABASE_PASSWORD = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Password", value="").initialize_setting()
@@ -128,6 +131,47 @@ if FORCE_REBUILD_DATABASE == "true":
     FORCE_REBUILD_DATABASE = True
 else:
     FORCE_REBUILD_DATABASE = False
+DATABASE_POOL_SIZE = int(DefaultSetting(settings=settings, group_name="Database/Pool", name="Pool Size", value=5).initialize_setting().value)
+DATABASE_MAX_OVERFLOW = int(DefaultSetting(settings=settings, group_name="Database/Pool", name="Max Overflow", value=10).initialize_setting().value)
+DATABASE_POOL_RECYCLE_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Pool", name="Recycle Seconds", value=3600).initialize_setting().value)
+DATABASE_POOL_TIMEOUT_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Pool", name="Timeout Seconds", value=30).initialize_setting().value)
+# Connections idle at least this long are pinged when checked out. 0 turns the check off.
+DATABASE_LIVENESS_CHECK_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Pool", name="Liveness Check Seconds", value=60).initialize_setting().value)
+DATABASE_READ_REPLICA_URL = DefaultSetting(settings=settings, group_name="Database/Read Replica", name="URL", value="").initialize_setting().value
+READ_YOUR_WRITES_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Read Replica", name="Read Your Writes Seconds", value=10).initialize_setting().value)
+QUERY_PROFILER = DefaultSetting(settings=settings, group_name="Database/Profiler", name="Enabled", value=False).initialize_setting().value
+if QUERY_PROFILER == "true":
+    QUERY_PROFILER = True
+else:
+    QUERY_PROFILER = False
+SLOW_QUERY_MS = int(DefaultSetting(settings=settings, group_name="Database/Profiler", name="Slow Query Ms", value=500).initialize_setting().value)
+REPLICA_FILE = os.path.join(PROGRAM_FOLDER, "Label Replica.sqlite3")
+REPLICA_ENABLED = DefaultSetting(settings=settings, group_name="Database/Replica", name="Local Replica", value=True).initialize_setting().value
+if REPLICA_ENABLED == "false":
+    REPLICA_ENABLED = False
+else:
+    REPLICA_ENABLED = True
+REPLICA_SYNC_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Replica", name="Sync Seconds", value=30).initialize_setting().value)
+REPLICA_STALE_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Replica", name="Stale Seconds", value=120).initialize_setting().value)
+JOURNAL_FILE = os.path.join(PROGRAM_FOLDER, "Label Journal.sqlite3")
+JOURNAL_REPLAY_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Journal", name="Replay Seconds", value=30).initialize_setting().value)
+JOURNAL_BATCH_SIZE = int(DefaultSetting(settings=settings, group_name="Database/Journal", name="Batch Size", value=50).initialize_setting().value)
+LOGIN_EVENT_SPOOL_FILE = os.path.join(PROGRAM_FOLDER, "Login Events.spool")
+LOGIN_EVENT_FLUSH_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Login Events", name="Flush Seconds", value=2).initialize_setting().value)
+LOGIN_EVENT_BATCH_SIZE = int(DefaultSetting(settings=settings, group_name="Database/Login Events", name="Batch Size", value=100).initialize_setting().value)
+LOGIN_EVENT_RETRY_SECONDS = int(DefaultSetting(settings=settings, group_name="Database/Login Events", name="Retry Seconds", value=30).initialize_setting().value)
+# Raw login events older than this many months are archived or deleted by 'prune-logins'. 0 keeps them forever.
+LOGIN_RETENTION_MONTHS = int(DefaultSetting(settings=settings, group_name="Database/Login History", name="Retention Months", value=0).initialize_setting().value)
+# 'archive' writes pruned events to a file in the dumps folder before deleting them, 'delete' only deletes them.
+LOGIN_RETENTION_ACTION = DefaultSetting(settings=settings, group_name="Database/Login History", name="Retention Action", value="archive").initialize_setting().value
+LOGIN_RETENTION_BATCH_SIZE = int(DefaultSetting(settings=settings, group_name="Database/Login History", name="Batch Size", value=5000).initialize_setting().value)
+IMPORT_WORKERS = int(DefaultSetting(settings=settings, group_name="Database", name="Import Workers", value=4).initialize_setting().value)
+
+
+# User settings
+# bcrypt cost, each step doubles the time to check a password. Passwords are rehashed at the next login when it changes.
+PASSWORD_HASH_ROUNDS = max(4, min(31, int(DefaultSetting(settings=settings, group_name="Users", name="Password Hash Rounds", value=12).initialize_setting().value)))
+USER_PAGE_SIZE = int(DefaultSetting(settings=settings, group_name="Users", name="Page Size", value=100).initialize_setting().value)
 
 
 # Github settings
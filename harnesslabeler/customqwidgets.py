@@ -1,4 +1,5 @@
-from PyQt5.QtWidgets import QMessageBox, QTextEdit, QSizePolicy
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QDialog, QLabel, QMessageBox, QProgressBar, QPushButton, QSizePolicy, QTextEdit, QVBoxLayout
 
 
 class ResizableMessageBox(QMessageBox):
@@ -27,3 +28,48 @@ class ResizableMessageBox(QMessageBox):
                                    QSizePolicy.Expanding)
 
         return result
+
+
+class ProgressDialog(QDialog):
+    """Non-modal dialog showing the progress of a background operation with a cancel button."""
+
+    cancel_requested = pyqtSignal()
+
+    def __init__(self, title: str, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle(title)
+        self.setModal(False)
+        self.setMinimumWidth(420)
+
+        self.status_label = QLabel("Starting...")
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.on_cancel_clicked)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+
+    def on_cancel_clicked(self) -> None:
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling...")
+        self.cancel_requested.emit()
+
+    def update_progress(self, done: int, total: int, text: str) -> None:
+        if not self.cancel_button.isEnabled():
+            return
+        if total:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(min(done, total))
+        else:
+            # Unknown total. Show a busy indicator.
+            self.progress_bar.setRange(0, 0)
+        self.status_label.setText(text)
+
+    def closeEvent(self, e):
+        # Closing the window cancels the operation, the dialog is closed by the owner when the worker stops.
+        if self.cancel_button.isEnabled():
+            self.on_cancel_clicked()
+        e.ignore()
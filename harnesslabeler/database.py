@@ -1,9 +1,22 @@
 from __future__ import annotations
+import json
 import logging
-from sqlalchemy import create_engine
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List
+import sqlalchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
 from .config import *
+from . import backends
 
 logger = logging.getLogger("backend")
 
@@ -17,22 +30,370 @@ if not log_started:
     log_started = True
 
 
-engine = create_engine(DATABASE_URL_WITH_SCHEMA, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine)
+@dataclass
+class PoolStatistics:
+    """Counters of connection pool events since the program started. Updated from any thread."""
+
+    checkouts: int = 0
+    checkins: int = 0
+    connects: int = 0
+    invalidations: int = 0
+    liveness_pings: int = 0
+    stale_connections: int = 0
+    reconnect_retries: int = 0
+    read_only_sessions: int = 0
+    replica_sessions: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def average_wait_ms(self) -> float:
+        return self.wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0
+
+    def add(self, name: str, count: int=1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def report(self, pool=None, read_pool=None) -> str:
+        """Return the pool settings, its current state and the counters as text."""
+        lines = [
+            f"Pool size: {DATABASE_POOL_SIZE}, max overflow: {DATABASE_MAX_OVERFLOW}, recycle: {DATABASE_POOL_RECYCLE_SECONDS}s, timeout: {DATABASE_POOL_TIMEOUT_SECONDS}s"
+        ]
+        if pool is not None:
+            lines.append(f"Pool status: {pool.status()}")
+        if read_pool is not None:
+            lines.append(f"Read replica pool status: {read_pool.status()}")
+        lines.extend([
+            f"Checkouts: {self.checkouts}",
+            f"Checkins: {self.checkins}",
+            f"Connects: {self.connects}",
+            f"Invalidations: {self.invalidations}",
+            f"Liveness pings: {self.liveness_pings} ({self.stale_connections} stale connections replaced)",
+            f"Statements retried after reconnect: {self.reconnect_retries}",
+            f"Read-only sessions: {self.read_only_sessions} ({self.replica_sessions} on the read replica)",
+            f"Checkout wait: {self.average_wait_ms:.2f} ms average, {self.max_wait_seconds * 1000:.2f} ms max, {self.wait_seconds:.3f}s total"
+        ])
+        return "\n".join(lines)
+
+
+pool_statistics = PoolStatistics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection, including connecting."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_statistics.record_wait(time.perf_counter() - started)
+
+
+def attach_pool_statistics(target) -> None:
+    """Count pool events of an engine or pool in pool_statistics."""
+    event.listen(target, "connect", lambda *args: pool_statistics.add("connects"))
+    event.listen(target, "checkout", lambda *args: pool_statistics.add("checkouts"))
+    event.listen(target, "checkin", lambda *args: pool_statistics.add("checkins"))
+    event.listen(target, "invalidate", lambda *args: pool_statistics.add("invalidations"))
+    event.listen(target, "soft_invalidate", lambda *args: pool_statistics.add("invalidations"))
+
+
+class LivenessCheck:
+    """Pings a pooled connection when it is checked out after sitting idle for idle_seconds.
+
+    Replaces pool_pre_ping, which costs a round trip on every checkout. Connections in
+    steady use are never pinged, and the check runs inside the checkout, so it never
+    holds idle connections away from the GUI or opens connections of its own. A connection
+    that fails the ping is invalidated and the pool retries the checkout on a fresh one.
+    """
+
+    def __init__(self, engine, idle_seconds: float):
+        self.engine = engine
+        self.idle_seconds = idle_seconds
+
+    def attach(self) -> None:
+        event.listen(self.engine, "checkin", self._on_checkin)
+        event.listen(self.engine, "checkout", self._on_checkout)
+
+    def detach(self) -> None:
+        event.remove(self.engine, "checkin", self._on_checkin)
+        event.remove(self.engine, "checkout", self._on_checkout)
+
+    @staticmethod
+    def _on_checkin(dbapi_connection, connection_record) -> None:
+        connection_record.info["checked_in"] = time.monotonic()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        checked_in = connection_record.info.get("checked_in")
+        if checked_in is None or time.monotonic() - checked_in < self.idle_seconds:
+            return
+        pool_statistics.add("liveness_pings")
+        try:
+            alive = self.engine.dialect.do_ping(dbapi_connection)
+        except Exception:
+            alive = False
+        if not alive:
+            pool_statistics.add("stale_connections")
+            logger.warning("[DATABASE] Idle connection failed liveness check. Replacing it.")
+            raise DisconnectionError("Idle connection failed liveness check.")
+
+
+liveness_checks = [] # type: List[LivenessCheck]
+
+
+def start_liveness_check(idle_seconds: float=DATABASE_LIVENESS_CHECK_SECONDS) -> None:
+    """Ping connections idle for idle_seconds when they are checked out, on the primary and
+    the read replica. 0 turns the check off. Embedded SQLite connections can not go stale,
+    so the check only runs on MySQL."""
+    if idle_seconds <= 0 or liveness_checks or backend.name != backends.MYSQL:
+        return
+    logger.info(f"[DATABASE] Checking connections idle for {idle_seconds}s at checkout.")
+    for target in (engine, read_engine):
+        if target is None:
+            continue
+        check = LivenessCheck(target, idle_seconds)
+        check.attach()
+        liveness_checks.append(check)
+
+
+def stop_liveness_check() -> None:
+    while liveness_checks:
+        liveness_checks.pop().detach()
+
+
+class RetryingSession(Session):
+    """Session that reconnects and retries a statement once when the connection was lost.
+
+    A statement is only retried when it started the transaction and nothing is waiting
+    to be flushed, so the retry can not lose or repeat earlier work in the transaction.
+    """
+
+    def execute(self, *args, **kwargs):
+        can_retry = not self.in_transaction() and not (self.new or self.dirty or self.deleted)
+        try:
+            return super().execute(*args, **kwargs)
+        except DBAPIError as error:
+            if not (can_retry and error.connection_invalidated):
+                raise
+            pool_statistics.add("reconnect_retries")
+            logger.warning(f"[DATABASE] Connection lost, retrying statement once on a new connection. Error: {error.orig}")
+            self.rollback()
+            return super().execute(*args, **kwargs)
+
+
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+_SQLALCHEMY_FOLDER = os.path.dirname(sqlalchemy.__file__)
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def _caller_location() -> str:
+    """Return 'file:line function' of the first frame outside SQLAlchemy and this module."""
+    frame = sys._getframe(2)
+    while frame:
+        file_name = frame.f_code.co_filename
+        if not file_name.startswith(_SQLALCHEMY_FOLDER) and file_name != __file__:
+            return f"{os.path.basename(file_name)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+@dataclass
+class StatementProfile:
+    """Timing of one SQL statement, with IN lists collapsed so their length does not matter."""
+
+    statement: str
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    rows: int = 0
+    histogram: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BOUNDS_MS) + 1))
+    callers: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def average_ms(self) -> float:
+        return self.total_seconds / self.count * 1000 if self.count else 0.0
+
+    def add(self, seconds: float, rows: int, caller: str) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += max(rows, 0)
+        milliseconds = seconds * 1000
+        bucket = 0
+        while bucket < len(HISTOGRAM_BOUNDS_MS) and milliseconds > HISTOGRAM_BOUNDS_MS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        self.callers[caller] = self.callers.get(caller, 0) + 1
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "average_ms": round(self.average_ms, 3),
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "rows": self.rows,
+            "histogram": dict(zip(labels, self.histogram)),
+            "callers": dict(sorted(self.callers.items(), key=lambda item: -item[1]))
+        }
+
+
+class QueryProfiler:
+    """Times every statement run by an engine.
+
+    Slow queries are always logged with their calling code location. Per statement
+    statistics are only collected while enabled, because finding the caller walks the stack.
+    """
+
+    def __init__(self, enabled: bool=QUERY_PROFILER, slow_query_ms: int=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.statements = {} # type: Dict[str, StatementProfile]
+        self.started = datetime.now()
+        self._lock = threading.Lock()
+
+    def attach(self, target) -> None:
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        connection.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        seconds = time.perf_counter() - connection.info["query_start_time"].pop()
+        slow = seconds * 1000 >= self.slow_query_ms
+        if not (self.enabled or slow):
+            return
+
+        caller = _caller_location()
+        if slow:
+            logger.warning(f"[SLOW QUERY] {seconds * 1000:.0f} ms, {cursor.rowcount} rows, called from {caller}:\n{statement}")
+        if self.enabled:
+            key = _PLACEHOLDER_LIST.sub("(...)", statement)
+            with self._lock:
+                profile = self.statements.get(key)
+                if profile is None:
+                    profile = self.statements[key] = StatementProfile(key)
+                profile.add(seconds, cursor.rowcount, caller)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements.clear()
+            self.started = datetime.now()
+
+    def sorted_statements(self) -> List[StatementProfile]:
+        with self._lock:
+            return sorted(self.statements.values(), key=lambda profile: -profile.total_seconds)
+
+    def report(self, limit: int=10) -> str:
+        """Return the statements with the most total time as text."""
+        if not self.enabled:
+            return f"Query profiler is off. Slow queries over {self.slow_query_ms} ms are logged."
+        profiles = self.sorted_statements()
+        lines = [f"Query profile since {self.started.strftime(DATETIME_FORMAT)}: {len(profiles)} statements, slow query threshold {self.slow_query_ms} ms."]
+        for profile in profiles[:limit]:
+            statement = " ".join(profile.statement.split())
+            lines.append(f"{profile.total_seconds * 1000:9.1f} ms total, {profile.count:6d} calls, {profile.average_ms:7.2f} ms avg, {profile.max_seconds * 1000:7.1f} ms max, {profile.rows} rows: {statement[:120]}")
+        return "\n".join(lines)
+
+    def dump(self, folder: str=DUMPS_FOLDER) -> str:
+        """Save the aggregated profile as JSON in folder. Returns the file path."""
+        file_path = os.path.join(folder, f"Query Profile {datetime.now().strftime(DATETIME_FORMAT_FILE_SAFE)}.json")
+        data = {
+            "started": self.started.strftime(DATETIME_FORMAT_FILE_SAFE),
+            "slow_query_ms": self.slow_query_ms,
+            "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "statements": [profile.to_dict() for profile in self.sorted_statements()]
+        }
+        with open(file_path, "w") as f:
+            json.dump(data, f, indent=4)
+        logger.info(f"[PROFILER] Saved query profile to '{file_path}'.")
+        return file_path
+
+
+query_profiler = QueryProfiler()
+
+
+backend = backends.get_backend()
+engine_options = {"poolclass": TimedQueuePool}
+engine_options.update(backend.engine_options())
+engine = create_engine(backend.url, **engine_options)
+event.listen(engine, "connect", backend.on_connect)
+attach_pool_statistics(engine)
+query_profiler.attach(engine)
+SessionLocal = sessionmaker(bind=engine, class_=RetryingSession)
 DeclarativeBase = declarative_base(bind=engine)
 
+read_engine = None
+if DATABASE_READ_REPLICA_URL:
+    read_engine = create_engine(DATABASE_READ_REPLICA_URL, **engine_options)
+    attach_pool_statistics(read_engine)
+    query_profiler.attach(read_engine)
+ReadOnlySessionLocal = sessionmaker(bind=read_engine or engine, class_=RetryingSession)
+
+
+WRITE_STATEMENTS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "ALTER", "DROP", "RENAME", "TRUNCATE"}
+last_write_time = 0.0
+
+
+def _note_write(connection, cursor, statement: str, parameters, context, executemany: bool) -> None:
+    words = statement.lstrip()[:9].split(None, 1)
+    if words and words[0].upper() in WRITE_STATEMENTS:
+        connection.info["wrote"] = True
+
+
+def _record_commit(connection) -> None:
+    global last_write_time
+    if connection.info.pop("wrote", False):
+        last_write_time = time.monotonic()
+
+
+def _forget_write(connection) -> None:
+    connection.info.pop("wrote", None)
+
+
+event.listen(engine, "after_cursor_execute", _note_write)
+event.listen(engine, "commit", _record_commit)
+event.listen(engine, "rollback", _forget_write)
+
+
+def use_read_replica() -> bool:
+    """Return True if read-only sessions should go to the read replica.
+    Reads stay on the primary for READ_YOUR_WRITES_SECONDS after this program commits
+    a write, so a search right after a save sees the saved rows even if the replica lags."""
+    return read_engine is not None and time.monotonic() - last_write_time > READ_YOUR_WRITES_SECONDS
+
 
 class DBContext:
     """Context manager for talking to the database.
+
+    Args:
+        dissable_foreign_key_checks (bool, optional): Turn foreign key checks off for the session. Defaults to False.
+        read_only (bool, optional): The session only reads, so it may use the read replica
+            set in 'Database/Read Replica/URL'. Defaults to False.
     """
-    def __init__(self, dissable_foreign_key_checks: bool=False):
+    def __init__(self, dissable_foreign_key_checks: bool=False, read_only: bool=False):
         logger.debug("[DATABASE] Session created.")
-        self.db = SessionLocal()
+        if read_only:
+            pool_statistics.add("read_only_sessions")
+        if read_only and use_read_replica():
+            pool_statistics.add("replica_sessions")
+            self.db = ReadOnlySessionLocal()
+        else:
+            self.db = SessionLocal()
         self.db.expire_on_commit = False
         self.dissable_foreign_key_checks = dissable_foreign_key_checks
         if self.dissable_foreign_key_checks:
             logger.warning("[DATABASE] Dissabling foreign key checks.")
-            self.db.execute("SET foreign_key_checks = 0;")
+            backend.set_foreign_key_checks(self.db, False)
 
     def __enter__(self) -> Session:
         logger.debug("Starting DB context.")
@@ -42,7 +403,7 @@ class DBContext:
         logger.debug("Exiting DB context.")
         if self.dissable_foreign_key_checks:
             logger.warning("[DATABASE] Reenabling foreign key checks.")
-            self.db.execute("SET foreign_key_checks = 1;")
+            backend.set_foreign_key_checks(self.db, True)
         self.db.close()
         logger.debug("[DATABASE] Session closed.")
 
@@ -0,0 +1,189 @@
+"""Module to restore a backup by applying only the rows that differ from the database.
+    The comparison is a full in-memory diff: every live row is loaded and compared with
+    the backup row of the same id. Only the writes are limited to the rows that differ."""
+from __future__ import annotations
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+from harnesslabeler import backup, errors, loginhistory, models
+from harnesslabeler.codec import LABEL_CODEC, USER_CODEC, USER_LOGIN_CODEC
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import Progress, chunks
+
+logger = logging.getLogger("backend")
+
+
+def row_digest(codec, item: dict) -> bytes:
+    """Return a digest of an encoded row. Both sides are encoded by the same codec, so equal rows give equal digests."""
+    # Older backups store booleans as 0/1.
+    values = tuple(int(value) if isinstance(value, bool) else value for value in (item[name] for name in codec.fields))
+    return hashlib.sha1(repr(values).encode()).digest()
+
+
+@dataclass
+class TableChanges:
+    """Rows to insert, update and delete in one table. Inserts and updates hold backup rows, deletes hold ids."""
+
+    inserts: List[dict] = field(default_factory=list)
+    updates: List[dict] = field(default_factory=list)
+    deletes: List[int] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.inserts) + len(self.updates) + len(self.deletes)
+
+    def __str__(self) -> str:
+        return f"{len(self.inserts)} inserts, {len(self.updates)} updates, {len(self.deletes)} deletes"
+
+
+@dataclass
+class DiffPlan:
+    """The changes needed to make the database match a backup."""
+
+    labels: TableChanges = field(default_factory=TableChanges)
+    users: TableChanges = field(default_factory=TableChanges)
+    user_logins: TableChanges = field(default_factory=TableChanges)
+    changed_part_numbers: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.labels.total + self.users.total + self.user_logins.total
+
+    def report(self, max_part_numbers: int=20) -> str:
+        """Return a human readable dry-run report."""
+        lines = [
+            f"Labels: {self.labels}",
+            f"Users: {self.users}",
+            f"User logins: {self.user_logins}",
+            f"Changed part numbers: {len(self.changed_part_numbers)}"
+        ]
+        lines.extend(f"    {part_number}" for part_number in self.changed_part_numbers[:max_part_numbers])
+        if len(self.changed_part_numbers) > max_part_numbers:
+            lines.append(f"    ... and {len(self.changed_part_numbers) - max_part_numbers} more.")
+        return "\n".join(lines)
+
+
+def _diff_rows(codec, live: Dict[int, dict], backup: Dict[int, dict], changes: TableChanges) -> None:
+    for id_, item in backup.items():
+        current = live.get(id_)
+        if current is None:
+            changes.inserts.append(item)
+        elif row_digest(codec, current) != row_digest(codec, item):
+            changes.updates.append(item)
+    changes.deletes.extend(id_ for id_ in live if id_ not in backup)
+
+
+def _changed_part_numbers(live: Dict[int, dict], changes: TableChanges) -> List[str]:
+    # A label moved to another part number changes both, so take the part number of both sides.
+    part_numbers = {item["part_number"] for item in changes.inserts + changes.updates} # type: Set[str]
+    part_numbers.update(live[item["id"]]["part_number"] for item in changes.updates)
+    part_numbers.update(live[id_]["part_number"] for id_ in changes.deletes)
+    return sorted(part_numbers)
+
+
+def plan_restore(data: dict) -> DiffPlan:
+    """Compare validated backup data with the database. Every live label, user and user
+    login is read into memory, so this costs a full read of those tables.
+
+    Args:
+        data (dict): Validated backup data in the full backup format.
+
+    Returns:
+        DiffPlan: The changes needed. Nothing is written.
+    """
+    logger.info("[DIFF RESTORE] Comparing backup with database.")
+    plan = DiffPlan()
+    with DBContext() as session:
+        live_labels = {item["id"]: item for item in LABEL_CODEC.fetch(session)}
+        live_users = {item["id"]: item for item in USER_CODEC.fetch(session)}
+        live_logins = {item["id"]: item for item in USER_LOGIN_CODEC.fetch(session)}
+
+    _diff_rows(LABEL_CODEC, live_labels, {item["id"]: item for item in data["labels"]}, plan.labels)
+    plan.changed_part_numbers = _changed_part_numbers(live_labels, plan.labels)
+    _diff_rows(USER_CODEC, live_users, {item["id"]: item for item in data["users"]}, plan.users)
+    _diff_rows(USER_LOGIN_CODEC, live_logins, {item["id"]: item for item in data["user_logins"]}, plan.user_logins)
+
+    logger.info(f"[DIFF RESTORE] Plan:\n{plan.report()}")
+    return plan
+
+
+def _delete(session, model, ids: List[int]) -> None:
+    table = model.__table__
+    for start in range(0, len(ids), 500):
+        session.execute(table.delete().where(table.c.id.in_(ids[start:start + 500])))
+
+
+def apply_plan(plan: DiffPlan, progress: Progress=None) -> None:
+    """Apply a DiffPlan in one transaction.
+
+    Changed labels are deleted and reinserted with their ids, so reordering a harness
+    can not trip UC_pn_value_sort_rolling halfway through. Users are updated in place
+    because labels reference them. Deleted users are removed before any user is written
+    and updated usernames are parked first, so UNIQUE(username) holds at every step.
+
+    Args:
+        plan (DiffPlan): The changes to apply.
+        progress (Progress, optional): Receives progress. Cancelling rolls back every change.
+
+    Raises:
+        errors.BackupError: If the changes could not be applied. Nothing is changed.
+        errors.OperationCancelled: If cancelled through progress. Nothing is changed.
+    """
+    if plan.total == 0:
+        logger.info("[DIFF RESTORE] Database already matches the backup.")
+        return
+
+    user_table = models.User.__table__
+    row_changes = ((models.BreakoutLabel, LABEL_CODEC, plan.labels), (models.UserLoginLog, USER_LOGIN_CODEC, plan.user_logins))
+    if progress:
+        progress.start("Applying changes", plan.total)
+    with DBContext() as session:
+        try:
+            for model, codec, changes in row_changes:
+                _delete(session, model, changes.deletes + [item["id"] for item in changes.updates])
+                if progress:
+                    progress.advance(len(changes.deletes))
+
+            # Users go after their labels and logins but before any user is written, so a
+            # username freed by a deleted user can be taken by a re-created one.
+            _delete(session, models.User, plan.users.deletes)
+            if progress:
+                progress.advance(len(plan.users.deletes))
+
+            # Park updated usernames first, two users may have swapped them.
+            for item in plan.users.updates:
+                session.execute(user_table.update().where(user_table.c.id == item["id"]).values(username=f"~restore~{item['id']}"))
+            for item in plan.users.updates:
+                values = USER_CODEC.decode(item)
+                session.execute(user_table.update().where(user_table.c.id == values.pop("id")).values(**values))
+            if plan.users.inserts:
+                session.execute(user_table.insert(), USER_CODEC.decode_all(plan.users.inserts))
+            if progress:
+                progress.advance(len(plan.users.inserts) + len(plan.users.updates))
+
+            for model, codec, changes in row_changes:
+                for chunk in chunks(codec.decode_all(changes.updates + changes.inserts), 1000):
+                    session.execute(model.__table__.insert(), chunk)
+                    if progress:
+                        progress.advance(len(chunk))
+
+            if plan.user_logins.total or plan.users.deletes:
+                loginhistory.rebuild(session)
+            models.DataGeneration.bump(session)
+            if progress:
+                progress.check_cancelled()
+            session.commit()
+        except errors.OperationCancelled as error:
+            session.rollback()
+            logger.warning("[DIFF RESTORE] Cancelled. Rolled back all changes.")
+            raise errors.OperationCancelled(f"{error} No data was changed.") from error
+        except Exception as error:
+            session.rollback()
+            logger.exception("[DIFF RESTORE] Error applying changes. Rolling back.")
+            raise errors.BackupError(f"Error applying changes. No data was changed. Error: {error}") from error
+
+    # Restored rows keep their old date_modified, so incremental backups would miss them.
+    backup.BackupManifest.load().start_new_chain()
+    logger.info(f"[DIFF RESTORE] Applied {plan.total} changes.")
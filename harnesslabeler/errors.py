@@ -1,3 +1,28 @@
 class Error(Exception):
     """Base class for exceptions in this module."""
-    pass
\ No newline at end of file
+    pass
+
+
+class BackupError(Error):
+    """Raised when a backup can not be created, read or restored."""
+    pass
+
+
+class DataImportError(Error):
+    """Raised when label data can not be imported."""
+    pass
+
+
+class OperationCancelled(Error):
+    """Raised inside a long running operation when the user cancels it."""
+    pass
+
+
+class MigrationError(Error):
+    """Raised when the database schema can not be upgraded."""
+    pass
+
+
+class JournalConflict(Error):
+    """Raised when a journaled label change no longer matches the database."""
+    pass
@@ -0,0 +1,286 @@
+"""Module to bulk import labels from engineering JSON or CSV files.
+    Labels that already exist are skipped. Large imports are split by part number
+    and written by several connections at once."""
+from __future__ import annotations
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Set, Tuple
+
+from harnesslabeler import config, errors, models
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import Progress, chunks
+
+logger = logging.getLogger("backend")
+
+
+REQUIRED_FIELDS = ("part_number", "value", "sort_index", "rolling_label")
+TRUE_VALUES = ("1", "true", "yes", "y")
+LOOKUP_CHUNK_SIZE = 500
+INSERT_CHUNK_SIZE = 1000
+
+LabelKey = Tuple[str, str, int, bool]
+
+
+@dataclass
+class ImportResult:
+    """Summary of a label import."""
+
+    total: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    errors: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    partitions: int = 1
+    failed_partitions: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        text = f"{self.total} rows, {self.inserted} inserted, {self.skipped} skipped, {len(self.errors)} errors in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)"
+        if self.partitions > 1:
+            text += f" using {self.partitions} partitions, {self.failed_partitions} failed"
+        return text
+
+
+def parse_bool(value) -> bool:
+    """Parse a rolling_label value. Accepts bools, 0/1 and common strings."""
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def read_json(file_path: str) -> List[dict]:
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+def read_csv(file_path: str) -> List[dict]:
+    with open(file_path, "r", newline="") as csv_file:
+        return list(csv.DictReader(csv_file, delimiter=","))
+
+
+def normalize_items(items: Iterable[dict], result: ImportResult) -> List[LabelKey]:
+    """Convert raw file rows to label keys. Rows that can not be converted are recorded in result.errors."""
+    keys = []
+    for index, item in enumerate(items):
+        result.total += 1
+        missing = [name for name in REQUIRED_FIELDS if name not in item]
+        if missing:
+            result.errors.append(f"Row {index}: Missing required field(s): {', '.join(missing)}.")
+            continue
+        try:
+            keys.append((
+                str(item["part_number"]).strip(),
+                str(item["value"]).strip(),
+                int(item["sort_index"]),
+                parse_bool(item["rolling_label"])
+            ))
+        except (TypeError, ValueError) as error:
+            result.errors.append(f"Row {index}: {error}")
+    return keys
+
+
+def find_existing(session, part_numbers: Iterable[str]) -> Set[LabelKey]:
+    """Return the keys of every label already stored for the given part numbers."""
+    part_numbers = list(part_numbers)
+    existing = set()
+    table = models.BreakoutLabel
+    for start in range(0, len(part_numbers), LOOKUP_CHUNK_SIZE):
+        chunk = part_numbers[start:start + LOOKUP_CHUNK_SIZE]
+        rows = session.query(table.part_number, table.value, table.sort_index, table.rolling_label)\
+                    .filter(table.part_number.in_(chunk))
+        existing.update((part_number, value, sort_index, bool(rolling_label)) for part_number, value, sort_index, rolling_label in rows)
+    return existing
+
+
+def insert_labels(session, keys: List[LabelKey], user_id: int, progress: Progress=None) -> int:
+    """Insert labels that do not exist yet. Returns the number of labels inserted. Does not commit."""
+    existing = find_existing(session, {key[0] for key in keys})
+    now = datetime.now()
+    rows = []
+    for key in keys:
+        if key in existing:
+            continue
+        existing.add(key)
+        part_number, value, sort_index, rolling_label = key
+        rows.append({
+            "part_number": part_number,
+            "value": value,
+            "sort_index": sort_index,
+            "rolling_label": rolling_label,
+            "date_created": now,
+            "date_modified": now,
+            "created_by_user_id": user_id,
+            "modified_by_user_id": user_id
+        })
+
+    if progress:
+        progress.start("Importing labels", len(rows))
+    for chunk in chunks(rows, INSERT_CHUNK_SIZE):
+        session.execute(models.BreakoutLabel.__table__.insert(), chunk)
+        if progress:
+            progress.advance(len(chunk))
+    return len(rows)
+
+
+def import_labels(items: Iterable[dict], user_id: int, progress: Progress=None) -> ImportResult:
+    """Import labels in one transaction.
+
+    Args:
+        items (Iterable[dict]): Rows with part_number, value, sort_index and rolling_label.
+        user_id (int): The user recorded as creator of the new labels.
+        progress (Progress, optional): Receives progress. Cancelling rolls back the import.
+
+    Raises:
+        errors.DataImportError: If the database rejects the import. Nothing is imported.
+        errors.OperationCancelled: If cancelled through progress. Nothing is imported.
+
+    Returns:
+        ImportResult: Summary of the import.
+    """
+    started = time.perf_counter()
+    result = ImportResult()
+    keys = normalize_items(items, result)
+    logger.info(f"[IMPORT] Importing {len(keys)} labels.")
+
+    with DBContext() as session:
+        try:
+            result.inserted = insert_labels(session, keys, user_id, progress)
+            session.commit()
+        except errors.OperationCancelled as error:
+            session.rollback()
+            logger.warning("[IMPORT] Cancelled. Rolled back the import.")
+            raise errors.OperationCancelled(f"{error} No data was imported.") from error
+        except Exception as error:
+            session.rollback()
+            logger.exception("[IMPORT] Error importing labels. Rolling back.")
+            raise errors.DataImportError(f"Error importing labels. No data was imported. Error: {error}") from error
+
+    result.skipped = len(keys) - result.inserted
+    result.seconds = time.perf_counter() - started
+    logger.info(f"[IMPORT] Finished. {result}")
+    return result
+
+
+def partition_keys(keys: List[LabelKey], partition_rows: int=INSERT_CHUNK_SIZE) -> List[List[LabelKey]]:
+    """Split keys into partitions of about partition_rows rows. A part number is never split across partitions."""
+    by_part_number = {} # type: Dict[str, List[LabelKey]]
+    for key in keys:
+        by_part_number.setdefault(key[0], []).append(key)
+
+    partitions = []
+    current = [] # type: List[LabelKey]
+    for part_keys in by_part_number.values():
+        current.extend(part_keys)
+        if len(current) >= partition_rows:
+            partitions.append(current)
+            current = []
+    if current:
+        partitions.append(current)
+    return partitions
+
+
+def _import_partition(keys: List[LabelKey], user_id: int, progress: Progress=None) -> int:
+    # Runs on a pool thread, so only the thread safe cancel flag of progress is used here.
+    if progress and progress.cancelled:
+        raise errors.OperationCancelled("Partition not started.")
+    with DBContext() as session:
+        try:
+            inserted = insert_labels(session, keys, user_id)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return inserted
+
+
+def import_labels_parallel(items: Iterable[dict], user_id: int, workers: int=None, progress: Progress=None) -> ImportResult:
+    """Import labels split by part number, writing up to workers partitions at once.
+
+    Each partition is written in its own transaction on its own pooled connection.
+    Partitions never share a part number, so they can not collide on UC_pn_value_sort_rolling.
+    A failed partition is rolled back and reported in result.errors, the other partitions are kept.
+
+    Args:
+        items (Iterable[dict]): Rows with part_number, value, sort_index and rolling_label.
+        user_id (int): The user recorded as creator of the new labels.
+        workers (int, optional): Number of partitions written at once. Defaults to the 'Import Workers' setting.
+        progress (Progress, optional): Receives progress. Cancelling stops partitions that have not started.
+
+    Raises:
+        errors.OperationCancelled: If cancelled through progress. Partitions already committed are kept.
+
+    Returns:
+        ImportResult: Summary of every partition.
+    """
+    started = time.perf_counter()
+    workers = workers or config.IMPORT_WORKERS
+    result = ImportResult()
+    keys = normalize_items(items, result)
+    partitions = partition_keys(keys)
+    result.partitions = len(partitions)
+    logger.info(f"[IMPORT] Importing {len(keys)} labels in {len(partitions)} partitions using {workers} workers.")
+
+    if progress:
+        progress.start("Importing labels", len(keys))
+    failed_rows = 0
+    cancelled_rows = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_import_partition, partition, user_id, progress): partition for partition in partitions}
+        try:
+            for future in as_completed(futures):
+                partition = futures[future]
+                try:
+                    result.inserted += future.result()
+                except errors.OperationCancelled:
+                    cancelled_rows += len(partition)
+                    continue
+                except Exception as error:
+                    failed_rows += len(partition)
+                    result.failed_partitions += 1
+                    message = f"Part numbers {partition[0][0]} to {partition[-1][0]}: {error}"
+                    logger.error(f"[IMPORT] Partition failed and was rolled back. {message}")
+                    result.errors.append(message)
+                if progress:
+                    progress.advance(len(partition))
+        except errors.OperationCancelled as error:
+            executor.shutdown(cancel_futures=True)
+            logger.warning(f"[IMPORT] Cancelled. {result.inserted} labels were already committed.")
+            raise errors.OperationCancelled(f"{error} {result.inserted} labels in finished partitions were kept.") from error
+    if cancelled_rows:
+        # Cancelled partitions were not imported, they must not be reported as existing labels.
+        logger.warning(f"[IMPORT] Cancelled. {result.inserted} labels were already committed.")
+        raise errors.OperationCancelled(
+            f"Import cancelled. {result.inserted} labels in finished partitions were kept, {cancelled_rows} were not imported."
+        )
+
+    result.skipped = len(keys) - result.inserted - failed_rows
+    result.seconds = time.perf_counter() - started
+    logger.info(f"[IMPORT] Finished. {result}")
+    return result
+
+
+def import_file(file_path: str, user_id: int, progress: Progress=None, workers: int=None) -> ImportResult:
+    """Import labels from a .json or .csv file.
+
+    With more than one worker the import is split by part number, see import_labels_parallel.
+    Cancelling then keeps the partitions already committed. With one worker the import runs
+    in one transaction and cancelling rolls it all back.
+    """
+    if file_path.lower().endswith(".csv"):
+        items = read_csv(file_path)
+    elif file_path.lower().endswith(".json"):
+        items = read_json(file_path)
+    else:
+        raise errors.DataImportError(f"Could not parse file: {file_path}. Extention: {file_path.split('.')[-1]} not supported.")
+    workers = workers or config.IMPORT_WORKERS
+    if workers > 1:
+        return import_labels_parallel(items, user_id, workers, progress)
+    return import_labels(items, user_id, progress)
@@ -0,0 +1,79 @@
+"""Module to check the data stored in the database for consistency problems."""
+from __future__ import annotations
+import logging
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+
+from harnesslabeler import models
+from harnesslabeler.validation import ValidationReport
+
+logger = logging.getLogger("backend")
+
+
+def _check_user_references(session: Session, report: ValidationReport) -> None:
+    user = aliased(models.User)
+    references = (
+        ("label", models.BreakoutLabel, models.BreakoutLabel.created_by_user_id),
+        ("label", models.BreakoutLabel, models.BreakoutLabel.modified_by_user_id),
+        ("user_login", models.UserLoginLog, models.UserLoginLog.user_id)
+    )
+    for table_name, model, column in references:
+        rows = session.query(model.id, column)\
+                    .outerjoin(user, user.id == column)\
+                    .filter(column != None, user.id == None)
+        for id_, user_id in rows:
+            report.add(f"{table_name}[id={id_}].{column.key}", f"References missing user id {user_id}.")
+
+
+def _check_sort_index(session: Session, report: ValidationReport) -> None:
+    """Breakout and rolling labels of a part number each need distinct, positive sort_index values.
+
+    Gaps are normal. New labels take one past the highest sort_index of the part number
+    across both types, while deleting renumbers only the labels of the deleted type.
+    A sort_index below 1 is left behind by a delete that did not finish.
+    """
+    label = models.BreakoutLabel
+    rows = session.query(
+                label.part_number,
+                label.rolling_label,
+                func.count(label.id),
+                func.count(func.distinct(label.sort_index)),
+                func.min(label.sort_index)
+                )\
+                .group_by(label.part_number, label.rolling_label)\
+                .having(
+                    (func.count(label.id) != func.count(func.distinct(label.sort_index)))
+                    | (func.min(label.sort_index) < 1)
+                )
+    for part_number, rolling_label, count, distinct, minimum in rows:
+        type_name = "Rolling" if rolling_label else "Breakout"
+        location = f"label[part_number={part_number!r}, {type_name}]"
+        if count != distinct:
+            report.add(location, f"{count - distinct} duplicate sort_index value(s).")
+        if minimum < 1:
+            report.add(location, f"sort_index {minimum} is below 1, left behind by an unfinished delete.")
+
+
+def check_database(session: Session) -> ValidationReport:
+    """Check the database for broken user references and duplicate or unfinished sort_index values.
+
+    Args:
+        session (Session): The session to use.
+
+    Returns:
+        ValidationReport: Every problem found along with table row counts.
+    """
+    logger.info("[INTEGRITY] Checking database.")
+    report = ValidationReport()
+    report.counts["labels"] = session.query(func.count(models.BreakoutLabel.id)).scalar()
+    report.counts["users"] = session.query(func.count(models.User.id)).scalar()
+    report.counts["user_logins"] = session.query(func.count(models.UserLoginLog.id)).scalar()
+
+    _check_user_references(session, report)
+    _check_sort_index(session, report)
+
+    if report.is_valid:
+        logger.info(f"[INTEGRITY] {report.summary()}")
+    else:
+        logger.error(f"[INTEGRITY] {report.summary()}")
+    return report
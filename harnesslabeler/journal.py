@@ -0,0 +1,324 @@
+"""Module for the offline journal of label changes.
+    When the database can not be reached, new and edited labels are recorded in a local
+    SQLite journal instead of being lost. Once the database is back the journal is
+    replayed in order, in batches, and changes that clash with other stations are reported."""
+from __future__ import annotations
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table, create_engine, event, func, select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from harnesslabeler import config, errors, models, repository
+from harnesslabeler.database import DBContext
+
+logger = logging.getLogger("backend")
+
+
+CREATE = "create"
+UPDATE = "update"
+
+metadata = MetaData()
+
+journal_table = Table(
+    "journal", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("action", String(10), nullable=False),
+    Column("label_id", Integer),
+    Column("part_number", String(100), nullable=False),
+    Column("value", String(256), nullable=False),
+    Column("rolling_label", Boolean, nullable=False),
+    # date_modified of the label when it was edited, to detect edits made by other stations meanwhile.
+    Column("base_date_modified", DateTime),
+    Column("user_id", Integer, nullable=False),
+    Column("date_recorded", DateTime, nullable=False)
+)
+
+conflict_table = Table(
+    "conflict", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("entry", String(512), nullable=False),
+    Column("reason", String(512), nullable=False)
+)
+
+
+def is_connection_error(error: Exception) -> bool:
+    """Return True if error means the database could not be reached, rather than bad data."""
+    if isinstance(error, (OperationalError, InterfaceError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+@dataclass
+class JournalEntry:
+    """A label change waiting to be written."""
+
+    id: int
+    action: str
+    label_id: Optional[int]
+    part_number: str
+    value: str
+    rolling_label: bool
+    base_date_modified: Optional[datetime]
+    user_id: int
+    date_recorded: datetime
+
+    def __str__(self) -> str:
+        label_type = "Rolling" if self.rolling_label else "Breakout"
+        return f"{self.action.title()} {label_type} label '{self.value}' on part number '{self.part_number}'"
+
+
+@dataclass
+class Conflict:
+    """A journaled change that was not applied because the database changed meanwhile."""
+
+    entry: str
+    reason: str
+
+    def __str__(self) -> str:
+        return f"{self.entry}: {self.reason}"
+
+
+@dataclass
+class ReplayResult:
+    applied: int = 0
+    conflicts: List[Conflict] = field(default_factory=list)
+
+
+class LabelJournal:
+    """Durable, ordered journal of label changes in a SQLite file. Safe to use from several threads."""
+
+    def __init__(self, file_path: str=config.JOURNAL_FILE):
+        self.file_path = file_path
+        self.engine = create_engine(f"sqlite:///{file_path}", connect_args={"check_same_thread": False})
+        event.listen(self.engine, "connect", self._on_connect)
+        metadata.create_all(self.engine)
+        self.last_error = None # type: Optional[str]
+        self._replay_lock = threading.Lock()
+
+    @staticmethod
+    def _on_connect(dbapi_connection, connection_record) -> None:
+        # FULL sync, a journaled change must survive a power cut.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=FULL")
+        cursor.close()
+
+    def _record(self, action: str, label: models.BreakoutLabel, user: models.User, base_date_modified: Optional[datetime]) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(journal_table.insert(), {
+                "action": action,
+                "label_id": label.id,
+                "part_number": label.part_number,
+                "value": label.value.strip(),
+                "rolling_label": label.rolling_label,
+                "base_date_modified": base_date_modified,
+                "user_id": user.id,
+                # Whole seconds, so the date matches once stored in a MySQL DATETIME.
+                "date_recorded": datetime.now().replace(microsecond=0)
+            })
+        logger.warning(f"[JOURNAL] Recorded {action} of label '{label}' for later.")
+
+    def record_create(self, label: models.BreakoutLabel, user: models.User) -> None:
+        """Record a new label. Its sort_index is chosen when it is replayed."""
+        self._record(CREATE, label, user, None)
+
+    def record_update(self, label: models.BreakoutLabel, base_date_modified: datetime, user: models.User) -> None:
+        """Record an edit of label, which had date_modified base_date_modified when it was loaded."""
+        self._record(UPDATE, label, user, base_date_modified)
+
+    def pending(self, limit: int=None) -> List[JournalEntry]:
+        query = select(journal_table).order_by(journal_table.c.id).limit(limit)
+        with self.engine.connect() as connection:
+            return [JournalEntry(**row._mapping) for row in connection.execute(query)]
+
+    def pending_count(self) -> int:
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.count(journal_table.c.id))).scalar()
+
+    def take_conflicts(self) -> List[Conflict]:
+        """Return the conflicts found by replays and forget them."""
+        with self.engine.begin() as connection:
+            rows = connection.execute(select(conflict_table.c.entry, conflict_table.c.reason).order_by(conflict_table.c.id)).all()
+            connection.execute(conflict_table.delete())
+        return [Conflict(entry, reason) for entry, reason in rows]
+
+    def status_text(self) -> str:
+        """Return a short note for the window title, or an empty string when nothing is waiting."""
+        count = self.pending_count()
+        if not count:
+            return ""
+        return f"[{count} label change{'s' if count != 1 else ''} waiting for the database]"
+
+    @staticmethod
+    def _apply(session, entry: JournalEntry) -> None:
+        """Apply one entry in session.
+
+        Raises:
+            errors.JournalConflict: If the label changed since the entry was recorded.
+        """
+        label = models.BreakoutLabel
+        user = repository.user_by_id(session, entry.user_id)
+        if not user:
+            raise errors.JournalConflict(f"User id {entry.user_id} no longer exists.")
+
+        if entry.action == CREATE:
+            # A replay that stopped between the database commit and the journal update
+            # already created the label, recognise it by its creator and creation date.
+            existing = session.query(label.id).filter(
+                label.part_number == entry.part_number, label.value == entry.value, label.rolling_label == entry.rolling_label,
+                label.created_by_user_id == entry.user_id, label.date_created == entry.date_recorded
+                ).first()
+            if existing:
+                return
+            new_label = label(
+                part_number=entry.part_number,
+                value=entry.value,
+                rolling_label=entry.rolling_label,
+                sort_index=repository.next_sort_index(session, entry.part_number),
+                date_created=entry.date_recorded,
+                created_by_user_id=entry.user_id
+            )
+            session.add(new_label)
+            new_label.save(session, user)
+            session.flush()
+            return
+
+        current = repository.label_by_id(session, entry.label_id)
+        if not current:
+            raise errors.JournalConflict("The label was deleted by another station.")
+        if current.date_modified.replace(microsecond=0) != entry.base_date_modified.replace(microsecond=0):
+            raise errors.JournalConflict(f"The label was changed by another station at {current.date_modified.strftime(config.DATETIME_FORMAT)}.")
+        current.part_number = entry.part_number
+        current.value = entry.value
+        current.rolling_label = entry.rolling_label
+        current.save(session, user)
+        session.flush()
+
+    def _finish(self, entries: List[JournalEntry], conflicts: List[Conflict]) -> None:
+        """Remove applied entries and store conflicts in one journal transaction."""
+        with self.engine.begin() as connection:
+            connection.execute(journal_table.delete().where(journal_table.c.id.in_([entry.id for entry in entries])))
+            if conflicts:
+                connection.execute(conflict_table.insert(), [{"entry": conflict.entry, "reason": conflict.reason} for conflict in conflicts])
+
+    def _replay_batch(self, entries: List[JournalEntry]) -> List[Conflict]:
+        """Apply entries in one transaction. Returns a Conflict for each entry that was skipped.
+
+        Raises:
+            Exception: Any database error. Nothing is applied.
+        """
+        conflicts = []
+        with DBContext() as session:
+            try:
+                for entry in entries:
+                    try:
+                        self._apply(session, entry)
+                    except errors.JournalConflict as error:
+                        conflicts.append(Conflict(str(entry), str(error)))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        return conflicts
+
+    def replay(self, batch_size: int=config.JOURNAL_BATCH_SIZE) -> ReplayResult:
+        """Write journaled changes in the order they were recorded, one batch per transaction.
+
+        Raises:
+            Exception: A database error that is not a conflict. Entries not yet applied stay in the journal.
+
+        Returns:
+            ReplayResult: Number of entries applied and the conflicts found.
+        """
+        result = ReplayResult()
+        size = batch_size
+        isolate_until = 0
+        with self._replay_lock:
+            while True:
+                entries = self.pending(size)
+                if not entries:
+                    break
+                try:
+                    conflicts = self._replay_batch(entries)
+                except Exception as error:
+                    if is_connection_error(error):
+                        self.last_error = str(error)
+                        raise
+                    if len(entries) > 1:
+                        # Apply the failed batch one entry at a time to find the entry that fails.
+                        logger.warning(f"[JOURNAL] Batch failed, replaying {len(entries)} entries one at a time. Error: {error}")
+                        isolate_until = entries[-1].id
+                        size = 1
+                        continue
+                    # Retrying can not fix it, report it instead of blocking every change behind it.
+                    logger.exception(f"[JOURNAL] Could not apply '{entries[0]}'.")
+                    conflicts = [Conflict(str(entries[0]), f"Could not be applied. Error: {error}")]
+                self._finish(entries, conflicts)
+                result.applied += len(entries) - len(conflicts)
+                result.conflicts.extend(conflicts)
+                for conflict in conflicts:
+                    logger.warning(f"[JOURNAL] Conflict: {conflict}")
+                if entries[-1].id >= isolate_until:
+                    size = batch_size
+        self.last_error = None
+        if result.applied or result.conflicts:
+            logger.info(f"[JOURNAL] Replayed {result.applied} changes, {len(result.conflicts)} conflicts.")
+        return result
+
+
+class JournalReplay(threading.Thread):
+    """Background thread that replays the journal every interval seconds while it has entries, or sooner when woken."""
+
+    def __init__(self, journal: LabelJournal, interval: float):
+        super().__init__(name="Label Journal Replay", daemon=True)
+        self.journal = journal
+        self.interval = interval
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake(self) -> None:
+        self._wake_event.set()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                if self.journal.pending_count():
+                    self.journal.replay()
+            except Exception as error:
+                logger.debug(f"[JOURNAL] Replay failed, will retry. Error: {error}")
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+
+label_journal = None # type: Optional[LabelJournal]
+journal_replay = None # type: Optional[JournalReplay]
+
+
+def start_journal(interval: float=config.JOURNAL_REPLAY_SECONDS) -> Optional[LabelJournal]:
+    """Open the journal and replay it in the background. Changes left by an earlier run are replayed first."""
+    global label_journal, journal_replay
+    if label_journal is not None:
+        return label_journal
+    try:
+        label_journal = LabelJournal()
+    except Exception:
+        logger.exception(f"[JOURNAL] Could not open '{config.JOURNAL_FILE}'. Changes can not be saved while the database is down.")
+        return None
+    journal_replay = JournalReplay(label_journal, interval)
+    journal_replay.start()
+    return label_journal
+
+
+def stop_journal() -> None:
+    global journal_replay
+    if journal_replay is not None:
+        journal_replay.stop()
+        journal_replay = None
@@ -0,0 +1,276 @@
+"""Module for writing login and logout events in the background.
+    Logging in only queues the event, so a station does not wait on the database at shift
+    change. A writer thread inserts queued events in batches. While the database can not
+    be reached, events are appended to a local spool file and replayed in order later."""
+from __future__ import annotations
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from harnesslabeler import config, enums, loginhistory, models
+from harnesslabeler.database import DBContext
+
+logger = logging.getLogger("backend")
+
+
+@dataclass
+class LoginEvent:
+    """A login or logout waiting to be written."""
+
+    user_id: int
+    event_type: enums.LoginEventType
+    event_date: datetime
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "event_type": self.event_type.value,
+            "event_date": self.event_date.isoformat()
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'LoginEvent':
+        return LoginEvent(
+            user_id=data["user_id"],
+            event_type=enums.LoginEventType(data["event_type"]),
+            event_date=datetime.fromisoformat(data["event_date"])
+        )
+
+
+def write_events(events: List[LoginEvent]) -> None:
+    """Insert events and add them to the daily rollup in one transaction, and move each user's last_login_date forward.
+
+    Raises:
+        Exception: Any database error. Nothing is written.
+    """
+    log_table = models.UserLoginLog.__table__
+    user_table = models.User.__table__
+    last_logins = {}
+    for event in events:
+        if event.event_type == enums.LoginEventType.Login:
+            last_logins[event.user_id] = max(event.event_date, last_logins.get(event.user_id, event.event_date))
+
+    with DBContext() as session:
+        try:
+            session.execute(log_table.insert(), [
+                {"user_id": event.user_id, "event_type": event.event_type, "event_date": event.event_date}
+                for event in events
+            ])
+            loginhistory.add_events(session, events)
+            for user_id, event_date in last_logins.items():
+                # Replayed events must not move last_login_date backwards.
+                session.execute(
+                    user_table.update()
+                    .where(user_table.c.id == user_id)
+                    .where(or_(user_table.c.last_login_date == None, user_table.c.last_login_date < event_date))
+                    .values(last_login_date=event_date)
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+
+class LoginEventSpool:
+    """Append-only JSON lines file of events that could not be written."""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+
+    def append(self, events: List[LoginEvent]) -> None:
+        with self._lock:
+            with open(self.file_path, "a") as file:
+                for event in events:
+                    file.write(json.dumps(event.to_dict()) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+    def read(self) -> List[LoginEvent]:
+        with self._lock:
+            if not os.path.exists(self.file_path):
+                return []
+            with open(self.file_path, "r") as file:
+                return [LoginEvent.from_dict(json.loads(line)) for line in file if line.strip()]
+
+    def replace(self, events: List[LoginEvent]) -> None:
+        """Keep only events. Written to a temp file first, so a crash leaves the old or the new spool."""
+        with self._lock:
+            if not events:
+                if os.path.exists(self.file_path):
+                    os.remove(self.file_path)
+                return
+            temp_path = self.file_path + ".tmp"
+            with open(temp_path, "w") as file:
+                for event in events:
+                    file.write(json.dumps(event.to_dict()) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.file_path)
+
+
+class LoginEventWriter(threading.Thread):
+    """Background thread that writes queued events in batches.
+
+    Events keep their order. Once anything is spooled, new events are spooled behind it
+    until the spool has been replayed.
+    """
+
+    def __init__(self, spool: LoginEventSpool, flush_seconds: float, batch_size: int, retry_seconds: float):
+        super().__init__(name="Login Event Writer", daemon=True)
+        self.spool = spool
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.queue = queue.Queue() # type: queue.Queue[Optional[LoginEvent]]
+        self.offline = False
+        self.written = 0
+        self.dropped = 0
+        self._stopping = False
+        self._last_replay = 0.0
+
+    def put(self, event: LoginEvent) -> None:
+        self.queue.put(event)
+
+    def stop(self, timeout: float=None) -> None:
+        """Write or spool every queued event, then end the thread."""
+        self._stopping = True
+        self.queue.put(None)
+        self.join(timeout)
+
+    def _take_batch(self, timeout: float) -> List[LoginEvent]:
+        events = []
+        try:
+            event = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return events
+        while event is not None:
+            events.append(event)
+            if len(events) >= self.batch_size:
+                break
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if event is None:
+            self._stopping = True
+        return events
+
+    def _write_batch(self, events: List[LoginEvent]) -> List[LoginEvent]:
+        """Write events in one transaction. If the batch holds bad data, write the events one
+        at a time, so only the events that fail are dropped.
+
+        Returns:
+            List[LoginEvent]: Events not written because the database can not be reached.
+        """
+        try:
+            write_events(events)
+            self.written += len(events)
+            return []
+        except (OperationalError, InterfaceError) as error:
+            logger.debug(f"[LOGIN EVENTS] Database unreachable. Error: {error}")
+            return events
+        except Exception as error:
+            if len(events) == 1:
+                # Retrying can not fix bad data, keep the event in the log instead of blocking the ones behind it.
+                logger.error(f"[LOGIN EVENTS] Could not write event, dropping it: {events[0].to_dict()}. Error: {error}")
+                self.dropped += 1
+                return []
+            logger.warning(f"[LOGIN EVENTS] Batch failed, writing {len(events)} events one at a time. Error: {error}")
+        for index, event in enumerate(events):
+            if self._write_batch([event]):
+                return events[index:]
+        return []
+
+    def _write(self, events: List[LoginEvent]) -> None:
+        if self.offline:
+            self.spool.append(events)
+            return
+        unwritten = self._write_batch(events)
+        if unwritten:
+            logger.warning(f"[LOGIN EVENTS] Database unreachable, spooling {len(unwritten)} events to '{self.spool.file_path}'.")
+            self.offline = True
+            self.spool.append(unwritten)
+
+    def replay(self) -> bool:
+        """Write spooled events in order, one batch per transaction.
+
+        Returns:
+            bool: True if the spool is empty afterwards.
+        """
+        self._last_replay = time.monotonic()
+        pending = self.spool.read()
+        while pending:
+            batch = pending[:self.batch_size]
+            unwritten = self._write_batch(batch)
+            pending = unwritten + pending[self.batch_size:]
+            # Drop written events right away, so a crash does not write them twice.
+            self.spool.replace(pending)
+            if unwritten:
+                logger.debug(f"[LOGIN EVENTS] Replay failed, {len(pending)} events still spooled.")
+                return False
+        if self.offline:
+            logger.info("[LOGIN EVENTS] Database reachable again, spooled events replayed.")
+        self.offline = False
+        return True
+
+    def run(self) -> None:
+        if os.path.exists(self.spool.file_path):
+            self.offline = not self.replay()
+        while True:
+            timeout = self.retry_seconds if self.offline else self.flush_seconds
+            events = self._take_batch(0 if self._stopping else timeout)
+            if events:
+                self._write(events)
+            if self.offline and not self._stopping and time.monotonic() - self._last_replay >= self.retry_seconds:
+                self.replay()
+            if self._stopping and self.queue.empty():
+                # Anything still spooled is replayed by the next start.
+                break
+
+
+login_event_writer = None # type: Optional[LoginEventWriter]
+
+
+def start_writer(
+        file_path: str=config.LOGIN_EVENT_SPOOL_FILE,
+        flush_seconds: float=config.LOGIN_EVENT_FLUSH_SECONDS,
+        batch_size: int=config.LOGIN_EVENT_BATCH_SIZE,
+        retry_seconds: float=config.LOGIN_EVENT_RETRY_SECONDS
+        ) -> LoginEventWriter:
+    """Start writing events in the background. Replays events spooled by an earlier run first."""
+    global login_event_writer
+    if login_event_writer is None:
+        login_event_writer = LoginEventWriter(LoginEventSpool(file_path), flush_seconds, batch_size, retry_seconds)
+        login_event_writer.start()
+    return login_event_writer
+
+
+def stop_writer(timeout: float=None) -> None:
+    """Write or spool every queued event and stop the writer."""
+    global login_event_writer
+    if login_event_writer is not None:
+        login_event_writer.stop(timeout)
+        login_event_writer = None
+
+
+def record(user: models.User, event_type: enums.LoginEventType) -> LoginEvent:
+    """Queue a login or logout of user. Written right away when the writer is not running."""
+    event = LoginEvent(user.id, event_type, datetime.now())
+    logger.info(f"[USER] User '{user}' {'logged in' if event_type == enums.LoginEventType.Login else 'logged out'}.")
+    if event_type == enums.LoginEventType.Login:
+        user.last_login_date = event.event_date
+    if login_event_writer is None:
+        write_events([event])
+    else:
+        login_event_writer.put(event)
+    return event
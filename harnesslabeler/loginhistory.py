@@ -0,0 +1,219 @@
+"""Module for the daily login rollup and the retention policy of raw login events.
+    user_login_day holds logins and logouts per user per day. It is updated in the same
+    transaction that inserts the raw events, so activity is read without scanning user_login.
+    Raw events older than 'Retention Months' can then be archived to a file and deleted in
+    batches, which keeps user_login and the backups small."""
+from __future__ import annotations
+import calendar
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from harnesslabeler import config, database, enums, errors, models
+from harnesslabeler.codec import USER_LOGIN_CODEC
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import Progress
+
+logger = logging.getLogger("backend")
+
+
+ARCHIVE = "archive"
+DELETE = "delete"
+RETENTION_ACTIONS = (ARCHIVE, DELETE)
+# Days counted by the activity shown in user administration.
+ACTIVITY_DAYS = 30
+
+
+def daily_rows(events: Iterable) -> List[dict]:
+    """Count events, anything with user_id, event_type and event_date, per user and day.
+
+    Returns:
+        List[dict]: Insert parameters for user_login_day.
+    """
+    days = {} # type: Dict[Tuple[int, date], dict]
+    for event in events:
+        key = (event.user_id, event.event_date.date())
+        row = days.get(key)
+        if row is None:
+            row = days[key] = {
+                "user_id": event.user_id,
+                "day": key[1],
+                "logins": 0,
+                "logouts": 0,
+                "first_event_date": event.event_date,
+                "last_event_date": event.event_date
+            }
+        if event.event_type == enums.LoginEventType.Login:
+            row["logins"] += 1
+        else:
+            row["logouts"] += 1
+        row["first_event_date"] = min(row["first_event_date"], event.event_date)
+        row["last_event_date"] = max(row["last_event_date"], event.event_date)
+    return list(days.values())
+
+
+def add_events(session: Session, events: Iterable) -> None:
+    """Add events to the daily rollup. Does not commit, call it in the transaction that inserts the events."""
+    rows = daily_rows(events)
+    if rows:
+        database.backend.add_login_days(session, models.UserLoginDay.__table__, rows)
+
+
+def rebuild(session) -> int:
+    """Recount the rollup from the raw events still in user_login. Does not commit.
+
+    Days before the oldest raw event were pruned and are kept as they are. Rows of
+    users that no longer exist are removed. Called after a restore replaced user_login.
+
+    Args:
+        session: A Session or Connection.
+
+    Returns:
+        int: Number of daily rows written.
+    """
+    log_table = models.UserLoginLog.__table__
+    day_table = models.UserLoginDay.__table__
+    user_table = models.User.__table__
+
+    session.execute(day_table.delete().where(day_table.c.user_id.not_in(select(user_table.c.id))))
+    oldest = session.execute(select(func.min(log_table.c.event_date))).scalar()
+    if oldest is None:
+        return 0
+    since = oldest.date()
+    session.execute(day_table.delete().where(day_table.c.day >= since))
+
+    # Grouped in Python, DATE() returns a string on SQLite and a date on MySQL.
+    statement = select(log_table.c.user_id, log_table.c.event_type, log_table.c.event_date)\
+                .where(log_table.c.event_date >= datetime.combine(since, datetime.min.time()))\
+                .where(log_table.c.user_id.in_(select(user_table.c.id)))
+    result = session.execute(statement.execution_options(stream_results=True))
+    days = {} # type: Dict[Tuple[int, date], dict]
+    for rows in result.partitions(config.LOGIN_RETENTION_BATCH_SIZE):
+        for row in daily_rows(rows):
+            key = (row["user_id"], row["day"])
+            total = days.get(key)
+            if total is None:
+                days[key] = row
+                continue
+            total["logins"] += row["logins"]
+            total["logouts"] += row["logouts"]
+            total["first_event_date"] = min(total["first_event_date"], row["first_event_date"])
+            total["last_event_date"] = max(total["last_event_date"], row["last_event_date"])
+    if days:
+        session.execute(day_table.insert(), list(days.values()))
+    logger.info(f"[LOGIN HISTORY] Rebuilt {len(days)} daily rows from {since} on.")
+    return len(days)
+
+
+def login_count(session: Session, user_id: int, days: int=ACTIVITY_DAYS) -> int:
+    """Return the logins of user_id over the last days, today included, from the rollup."""
+    day_table = models.UserLoginDay.__table__
+    since = date.today() - timedelta(days=days - 1)
+    return session.execute(
+        select(func.coalesce(func.sum(day_table.c.logins), 0))
+        .where(day_table.c.user_id == user_id)
+        .where(day_table.c.day >= since)
+    ).scalar()
+
+
+def months_ago(today: date, months: int) -> date:
+    """Return the same day months earlier, or the last day of that month if it is shorter."""
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    month += 1
+    return date(year, month, min(today.day, calendar.monthrange(year, month)[1]))
+
+
+@dataclass
+class RetentionResult:
+    cutoff: date
+    action: str
+    deleted: int = 0
+    archive_file: Optional[str] = None
+
+    def __str__(self) -> str:
+        text = f"Deleted {self.deleted} login events before {self.cutoff.strftime(config.DATE_FORMAT)}."
+        if self.archive_file and self.deleted:
+            text += f" Archived them to '{self.archive_file}'."
+        return text
+
+
+def apply_retention(
+        months: int=config.LOGIN_RETENTION_MONTHS,
+        action: str=config.LOGIN_RETENTION_ACTION,
+        batch_size: int=config.LOGIN_RETENTION_BATCH_SIZE,
+        archive_folder: str=config.DUMPS_FOLDER,
+        progress: Progress=None
+        ) -> RetentionResult:
+    """Archive or delete raw login events from before the day months ago, oldest first.
+
+    Each batch is its own short transaction, so stations logging in are never blocked for
+    long. The daily rollup already counts every event, so activity history is kept.
+    Archived events are written in the backup format, one JSON object per line, and the
+    file is synced before the batch is deleted. A batch whose delete fails is archived
+    again by the next run.
+
+    Args:
+        months (int, optional): Events older than this are removed. Defaults to 'Retention Months'.
+        action (str, optional): 'archive' or 'delete'. Defaults to 'Retention Action'.
+        batch_size (int, optional): Events per transaction. Defaults to 'Batch Size'.
+        archive_folder (str, optional): Where the archive file is written. Defaults to the dumps folder.
+        progress (Progress, optional): Receives progress. Cancelling keeps the batches already deleted.
+
+    Raises:
+        errors.Error: If months is not positive or action is unknown.
+        errors.OperationCancelled: If cancelled through progress.
+
+    Returns:
+        RetentionResult: Events deleted and the archive file.
+    """
+    if months <= 0:
+        raise errors.Error("Login retention is turned off. Set 'Retention Months' above 0 or pass --months.")
+    action = action.lower()
+    if action not in RETENTION_ACTIONS:
+        raise errors.Error(f"Unknown retention action '{action}'. Expected one of: {', '.join(RETENTION_ACTIONS)}.")
+
+    log_table = models.UserLoginLog.__table__
+    result = RetentionResult(months_ago(date.today(), months), action)
+    cutoff = datetime.combine(result.cutoff, datetime.min.time())
+    if action == ARCHIVE:
+        file_name = f"Login Archive {datetime.now().strftime(config.DATETIME_FORMAT_FILE_SAFE)}.jsonl"
+        result.archive_file = os.path.join(archive_folder, file_name)
+    id_index = USER_LOGIN_CODEC.fields.index("id")
+
+    with DBContext() as session:
+        if progress:
+            total = session.execute(select(func.count()).select_from(log_table).where(log_table.c.event_date < cutoff)).scalar()
+            progress.start("Pruning login events", total)
+        while True:
+            rows = session.execute(
+                USER_LOGIN_CODEC.select().where(log_table.c.event_date < cutoff).order_by(log_table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                session.rollback()
+                break
+            if result.archive_file:
+                with open(result.archive_file, "a") as file:
+                    for row in rows:
+                        file.write(json.dumps(USER_LOGIN_CODEC.encode(row)) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+            try:
+                session.execute(log_table.delete().where(log_table.c.id.in_([row[id_index] for row in rows])))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            result.deleted += len(rows)
+            logger.debug(f"[LOGIN HISTORY] Deleted {result.deleted} login events so far.")
+            if progress:
+                progress.advance(len(rows))
+                progress.check_cancelled()
+
+    logger.info(f"[LOGIN HISTORY] {result}")
+    return result
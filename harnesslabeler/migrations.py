@@ -0,0 +1,255 @@
+"""Module for versioned schema migrations.
+    The schema_version table records every migration applied. Startup reads the
+    highest version in one query and only runs migrations that are missing.
+    Works on MySQL and SQLite."""
+from __future__ import annotations
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from harnesslabeler import config, database, errors, loginhistory, models
+
+logger = logging.getLogger("backend")
+
+
+metadata = MetaData()
+
+schema_version_table = Table(
+    "schema_version", metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(256), nullable=False),
+    Column("date_applied", DateTime, nullable=False)
+)
+
+
+SEARCH_INDEXES = ("IX_label_part_number_rolling_sort", "IX_label_date_modified")
+USER_SEARCH_COLUMNS = ("first_name_search", "last_name_search", "username_search")
+USER_SEARCH_INDEXES = ("IX_user_name_search", "IX_user_first_name_search", "IX_user_username_search")
+
+
+@dataclass
+class Migration:
+    """One schema change. upgrade must be safe to run again, MySQL commits DDL as it goes."""
+
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_default_user(connection: Connection) -> None:
+    user_table = models.User.__table__
+    if connection.execute(select(user_table.c.id).where(user_table.c.username == "admin")).first():
+        return
+    connection.execute(user_table.insert(), {
+        "active": True,
+        "first_name": "Admin",
+        "last_name": "User",
+        "username": "admin",
+        "password_hash": models.User.generate_password_hash("admin"),
+        "must_change_password": True,
+        "last_login_date": datetime.now()
+    })
+    logger.warning("[MIGRATION] Created default user. Username: 'admin', Password: 'admin'.")
+
+
+def _upgrade_legacy_label_table(connection: Connection) -> None:
+    """Upgrade a label table from before users were added. Replaces 'Original Database Upgrade.sql'."""
+    if connection.dialect.name != "mysql":
+        raise errors.MigrationError("Legacy label tables can only be upgraded on MySQL.")
+    logger.warning("[MIGRATION] Upgrading legacy label table.")
+    connection.execute(text("""
+        ALTER TABLE `label`
+        ADD COLUMN `date_created` DATETIME NOT NULL AFTER `rolling_label`,
+        ADD COLUMN `date_modified` DATETIME NOT NULL AFTER `date_created`,
+        ADD COLUMN `modified_by_user_id` INT NULL AFTER `date_modified`,
+        ADD COLUMN `created_by_user_id` INT NULL AFTER `modified_by_user_id`,
+        CHANGE COLUMN `sort_id` `sort_index` INT NOT NULL,
+        CHANGE COLUMN `rolling_label` `rolling_label` TINYINT(1) NOT NULL,
+        DROP INDEX `UC_part_number_sort_id`,
+        ADD UNIQUE INDEX `UC_pn_value_sort_rolling` (`part_number` ASC, `value` ASC, `sort_index` ASC, `rolling_label` ASC),
+        ADD INDEX `label_ibfk_1_idx` (`modified_by_user_id` ASC),
+        ADD INDEX `label_ibfk_2_idx` (`created_by_user_id` ASC)
+    """))
+    # The default user is created first, so every existing label can point at it.
+    connection.execute(text("UPDATE `label` SET created_by_user_id = 1, modified_by_user_id = 1, date_created = NOW(), date_modified = NOW()"))
+    connection.execute(text("""
+        ALTER TABLE `label`
+        ADD CONSTRAINT `label_ibfk_1` FOREIGN KEY (`modified_by_user_id`) REFERENCES `user` (`id`),
+        ADD CONSTRAINT `label_ibfk_2` FOREIGN KEY (`created_by_user_id`) REFERENCES `user` (`id`)
+    """))
+
+
+def _baseline(connection: Connection) -> None:
+    """Create the tables that are missing and the default user. Upgrades a legacy label table."""
+    tables = [models.User.__table__, models.UserLoginLog.__table__, models.BreakoutLabel.__table__]
+    inspector = inspect(connection)
+    legacy = inspector.has_table("label") and "sort_id" in {column["name"] for column in inspector.get_columns("label")}
+
+    # New tables are created from the current models, later migrations check before changing them.
+    for table in tables:
+        if not inspector.has_table(table.name):
+            table.create(connection)
+    _add_must_change_password_column(connection)
+    _create_default_user(connection)
+    if legacy:
+        _upgrade_legacy_label_table(connection)
+
+
+def _search_indexes(connection: Connection) -> None:
+    """Add the composite search index and the date_modified index used by sync and incremental backups."""
+    for index in models.BreakoutLabel.__table__.indexes:
+        if index.name in SEARCH_INDEXES:
+            index.create(connection, checkfirst=True)
+
+
+def _add_must_change_password_column(connection: Connection) -> bool:
+    """Add user.must_change_password if it is missing. Returns True if it was added."""
+    if "must_change_password" in {column["name"] for column in inspect(connection).get_columns("user")}:
+        return False
+    user = connection.dialect.identifier_preparer.quote("user")
+    connection.execute(text(f"ALTER TABLE {user} ADD COLUMN must_change_password BOOLEAN NOT NULL DEFAULT 0"))
+    return True
+
+
+def _must_change_password(connection: Connection) -> None:
+    """Store the must change password flag, so login no longer hashes 'admin' to find the default password."""
+    _add_must_change_password_column(connection)
+    user_table = models.User.__table__
+    admin = connection.execute(select(user_table.c.id, user_table.c.password_hash).where(user_table.c.id == 1)).first()
+    if admin and models.User.verify_password(admin.password_hash, "admin"):
+        connection.execute(user_table.update().where(user_table.c.id == admin.id).values(must_change_password=True))
+
+
+def _user_search_columns(connection: Connection) -> None:
+    """Add the lower case search columns of the user table and their indexes."""
+    user_table = models.User.__table__
+    existing = {column["name"] for column in inspect(connection).get_columns("user")}
+    quote = connection.dialect.identifier_preparer.quote
+    for name in USER_SEARCH_COLUMNS:
+        if name in existing:
+            continue
+        column = user_table.c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(
+            f"ALTER TABLE {quote('user')} ADD COLUMN {quote(name)} {column_type} GENERATED ALWAYS AS ({column.computed.sqltext}) VIRTUAL"
+        ))
+    for index in user_table.indexes:
+        if index.name in USER_SEARCH_INDEXES:
+            index.create(connection, checkfirst=True)
+
+
+def _login_day_rollup(connection: Connection) -> None:
+    """Create the daily login rollup, count every existing event into it and index user_login by date."""
+    day_table = models.UserLoginDay.__table__
+    if not inspect(connection).has_table(day_table.name):
+        day_table.create(connection)
+        loginhistory.rebuild(connection)
+    for index in models.UserLoginLog.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _data_generation(connection: Connection) -> None:
+    """Create the restore counter read by the label replica."""
+    table = models.DataGeneration.__table__
+    if not inspect(connection).has_table(table.name):
+        table.create(connection)
+    if not connection.execute(select(table.c.id)).first():
+        connection.execute(table.insert(), {"id": 1, "generation": 0, "date_changed": datetime.now()})
+
+
+MIGRATIONS = [
+    Migration(1, "Baseline schema", _baseline),
+    Migration(2, "Label search and date_modified indexes", _search_indexes),
+    Migration(3, "User must_change_password flag", _must_change_password),
+    Migration(4, "User search columns and indexes", _user_search_columns),
+    Migration(5, "Daily login rollup and user_login date index", _login_day_rollup),
+    Migration(6, "Restore generation", _data_generation),
+] # type: List[Migration]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """Return the schema version in one query, or None if the schema or schema_version table does not exist."""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(func.max(schema_version_table.c.version))).scalar() or 0
+    except DBAPIError:
+        return None
+
+
+def _create_schema(engine: Engine) -> None:
+    if engine.dialect.name == "mysql":
+        logger.info(f"[MIGRATION] Creating database '{config.SCHEMA_NAME}' if it does not exist.")
+        temp_engine = create_engine(engine.url.set(database=None))
+        with temp_engine.connect() as connection:
+            connection.execute(text(config.SCHEMA_CREATE_STATEMENT))
+        temp_engine.dispose()
+
+
+def upgrade_database(engine: Engine=None) -> int:
+    """Bring the schema up to LATEST_VERSION. Called at startup.
+
+    Args:
+        engine (Engine, optional): Defaults to the program engine.
+
+    Raises:
+        errors.MigrationError: If the database is newer than the program or a migration fails.
+
+    Returns:
+        int: The schema version after upgrading.
+    """
+    engine = engine or database.engine
+    version = current_version(engine)
+    if version == LATEST_VERSION:
+        logger.info(f"[MIGRATION] Schema is at version {version}.")
+        return version
+    if version is not None and version > LATEST_VERSION:
+        raise errors.MigrationError(f"Database schema version {version} is newer than this program supports ({LATEST_VERSION}). Please update the program.")
+
+    if version is None:
+        _create_schema(engine)
+        metadata.create_all(engine)
+        version = 0
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.warning(f"[MIGRATION] Applying version {migration.version}: {migration.description}.")
+        try:
+            with engine.begin() as connection:
+                migration.upgrade(connection)
+                connection.execute(schema_version_table.insert(), {
+                    "version": migration.version,
+                    "description": migration.description,
+                    "date_applied": datetime.now()
+                })
+        except Exception as error:
+            logger.exception(f"[MIGRATION] Version {migration.version} failed.")
+            raise errors.MigrationError(f"Could not apply schema version {migration.version} '{migration.description}'. Error: {error}") from error
+        version = migration.version
+
+    logger.info(f"[MIGRATION] Schema upgraded to version {version}.")
+    return version
+
+
+def force_recreate(engine: Engine=None) -> int:
+    """Drop every table and build the schema again from version 1. Data loss will occur.
+
+    Args:
+        engine (Engine, optional): Defaults to the program engine.
+
+    Returns:
+        int: The schema version after rebuilding.
+    """
+    engine = engine or database.engine
+    logger.warning("[MIGRATION] Force recreating database. Data loss will occur.")
+    _create_schema(engine)
+    models.Base.metadata.drop_all(engine)
+    metadata.drop_all(engine)
+    return upgrade_database(engine)
@@ -5,11 +5,11 @@ from typing import List, Optional
 from datetime import datetime
 from typing import Optional
 from sqlalchemy.orm.session import Session
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Enum, UniqueConstraint
+from sqlalchemy import Column, Computed, Integer, String, Date, DateTime, ForeignKey, Boolean, Enum, Index, UniqueConstraint, select
 from sqlalchemy.orm import relationship
 
 from harnesslabeler.mixins import AuditMixin
-from harnesslabeler.database import DBContext, DeclarativeBase, engine, create_engine
+from harnesslabeler.database import DeclarativeBase
 
 from harnesslabeler import errors, enums, config
 
@@ -67,6 +67,12 @@ class Type_(Base):
 
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (
+        # Serve the case-insensitive prefix search and the sort order of the user administration list.
+        Index("IX_user_name_search", "last_name_search", "first_name_search"),
+        Index("IX_user_first_name_search", "first_name_search"),
+        Index("IX_user_username_search", "username_search"),
+    )
 
     active = Column(Boolean, nullable=False, default=True)
     last_login_date = Column(DateTime) # type: datetime
@@ -74,6 +80,11 @@ class User(Base):
     last_name = Column(String(15), nullable=False)
     username = Column(String(256), nullable=False, unique=True, index=True)
     password_hash = Column(String(256), nullable=False)
+    must_change_password = Column(Boolean, nullable=False, default=False)
+    # Lower case copies kept by the database, so searches ignore case and still use an index.
+    first_name_search = Column(String(15), Computed("lower(first_name)", persisted=False))
+    last_name_search = Column(String(15), Computed("lower(last_name)", persisted=False))
+    username_search = Column(String(256), Computed("lower(username)", persisted=False))
 
     # Relationship
 
@@ -127,17 +138,35 @@ class User(Base):
     @property
     def full_name(self) -> str:
         """Return the full name of the user. In the following format: first_name, last_name"""
-        return f"{self.first_name}, {self.last_name}"
+        return User.format_full_name(self.first_name, self.last_name)
     
     @property
     def initials(self) -> str:
         """Return the initials of the user."""
-        return f"{self.first_name[0].upper()}{self.last_name[0].upper()}"
+        return User.format_initials(self.first_name, self.last_name)
+    
+    @staticmethod
+    def format_full_name(first_name: str, last_name: str) -> str:
+        return f"{first_name}, {last_name}"
+    
+    @staticmethod
+    def format_initials(first_name: str, last_name: str) -> str:
+        return f"{first_name[0].upper()}{last_name[0].upper()}"
     
     def check_password(self, password: str) -> bool:
         """Check user password. Returns True if password is correct."""
         return User.verify_password(self.password_hash, password)
     
+    @property
+    def needs_rehash(self) -> bool:
+        """True if the password was hashed with a different cost than 'Password Hash Rounds'."""
+        return User.hash_rounds(self.password_hash) != config.PASSWORD_HASH_ROUNDS
+    
+    @staticmethod
+    def hash_rounds(password_hash: str) -> int:
+        """Return the cost stored in a bcrypt hash, e.g. 12 for '$2b$12$...'."""
+        return int(password_hash.split("$")[2])
+    
     @staticmethod
     def verify_password(password_hash: str, password: str) -> bool:
         """Check if password matches the one provided."""
@@ -146,12 +175,16 @@ class User(Base):
     @staticmethod
     def generate_password_hash(password: str) -> str:
         """Generate a hashed password."""
-        return bcrypt.hashpw(password.encode(config.ENCODING_STR), bcrypt.gensalt()).decode(config.ENCODING_STR)
+        return bcrypt.hashpw(password.encode(config.ENCODING_STR), bcrypt.gensalt(rounds=config.PASSWORD_HASH_ROUNDS)).decode(config.ENCODING_STR)
 
 
 class UserLoginLog(Base):
     """A simple log for tracking who logged in or out and when."""
     __tablename__ = 'user_login'
+    __table_args__ = (
+        # Serves the retention policy, which removes events by date.
+        Index("IX_user_login_event_date", "event_date"),
+    )
 
     event_date = Column(DateTime, nullable=False, default=datetime.now)
     event_type = Column(Enum(enums.LoginEventType))
@@ -191,11 +224,62 @@ class UserLoginLog(Base):
         return UserLoginLog.create(event_type=enums.LoginEventType.Logout, user=user)
 
 
+class UserLoginDay(Base):
+    """Logins and logouts of one user on one day, kept when the raw user_login events are pruned.
+
+    user_id has no foreign key, so a restore can replace the user table without touching this one.
+    """
+    __tablename__ = 'user_login_day'
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", name="UC_user_login_day_user_day"),
+        Index("IX_user_login_day_day", "day"),
+    )
+
+    user_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    logins = Column(Integer, nullable=False, default=0)
+    logouts = Column(Integer, nullable=False, default=0)
+    first_event_date = Column(DateTime, nullable=False)
+    last_event_date = Column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<UserLoginDay(user_id={self.user_id}, day={self.day}, logins={self.logins}, logouts={self.logouts})>"
+
+
+class DataGeneration(Base):
+    """Counter raised by every restore. Stations keeping a copy of the data, like the label
+    replica, reload all of it when the counter changes, restored rows keep their old dates."""
+    __tablename__ = 'data_generation'
+
+    generation = Column(Integer, nullable=False, default=0)
+    date_changed = Column(DateTime)
+
+    @staticmethod
+    def current(session) -> int:
+        """Return the current generation. Works on a Session or Connection."""
+        table = DataGeneration.__table__
+        return session.execute(select(table.c.generation).where(table.c.id == 1)).scalar() or 0
+
+    @staticmethod
+    def bump(session) -> None:
+        """Raise the generation. Does not commit."""
+        table = DataGeneration.__table__
+        updated = session.execute(
+            table.update().where(table.c.id == 1).values(generation=table.c.generation + 1, date_changed=datetime.now())
+        ).rowcount
+        if not updated:
+            session.execute(table.insert(), {"id": 1, "generation": 1, "date_changed": datetime.now()})
+
+
 class BreakoutLabel(Base, AuditMixin):
     """Represents a label for a harness breakout point."""
     __tablename__ = "label"
     __table_args__ = (
         UniqueConstraint("part_number", "value", "sort_index", "rolling_label", name="UC_pn_value_sort_rolling"),
+        # Serves the main window search, which filters on part number and label type and sorts by sort_index.
+        Index("IX_label_part_number_rolling_sort", "part_number", "rolling_label", "sort_index"),
+        # Serves incremental backups and the replica sync.
+        Index("IX_label_date_modified", "date_modified"),
     )
 
     part_number = Column(String(100), index=True, nullable=False)
@@ -263,70 +347,3 @@ class BreakoutLabel(Base, AuditMixin):
 
         session.delete(self)
         session.commit()
-
-    @staticmethod
-    def create(part_number: str, value: str, rolling_label: bool=False) -> 'BreakoutLabel':
-        with DBContext() as session:
-            breakout_label = session.query(BreakoutLabel).filter(BreakoutLabel.part_number == part_number)\
-                                .order_by(BreakoutLabel.sort_index.desc()).first() # type: BreakoutLabel
-            if not breakout_label:
-                sort_index = 1
-            else:
-                sort_index = breakout_label.sort_index + 1
-            
-        return BreakoutLabel(
-            part_number=part_number,
-            value=value,
-            sort_index=sort_index,
-            rolling_label=rolling_label
-        )
-
-
-
-def create_tables():
-    logger.info("[SYSTEM] Creating tables...")
-    Base.metadata.create_all(engine)
-
-
-def drop_tables():
-    logger.warning("[SYSTEM] Droping tables...")
-    Base.metadata.drop_all(engine)
-
-
-def create_default_data():
-    logger.info("[SYSTEM] Creating default data...")
-    user = User(
-        first_name = "Admin",
-        last_name = "User",
-        username = "admin",
-        password = "admin"
-    )
-
-    with DBContext() as session:
-        if not session.query(User).filter(User.username == "admin").first():
-            session.add(user)
-            user.last_login_date = datetime.now()
-            session.commit()
-            logger.warning(f"[SYSTEM] Created default user '{user}'. Username: 'admin', Password: 'admin'.")
-
-
-def force_recreate():
-    logger.warning("[SYSTEM] Force recreating database. Data loss will occur.")
-    if config.DATABASE_URL_WITHOUT_SCHEMA.startswith("mysql"):
-        temp_engine = create_engine(config.DATABASE_URL_WITHOUT_SCHEMA)
-        temp_engine.execute(config.SCHEMA_CREATE_STATEMENT)
-        temp_engine.dispose()
-
-    drop_tables()
-    create_database()
-
-
-def create_database():
-    logger.info(f"[SYSTEM] Creating database '{config.SCHEMA_NAME}'...")
-    if config.DATABASE_URL_WITHOUT_SCHEMA.startswith("mysql"):
-        temp_engine = create_engine(config.DATABASE_URL_WITHOUT_SCHEMA)
-        temp_engine.execute(config.SCHEMA_CREATE_STATEMENT)
-        temp_engine.dispose()
-
-    create_tables()
-    create_default_data()
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Module for reporting progress from long running data operations.
+    Does not use Qt, so the same engines report progress to the GUI and the CLI."""
+from __future__ import annotations
+import threading
+import time
+from typing import Callable, Optional
+
+from harnesslabeler import errors
+
+
+class Progress:
+    """Tracks rows done for the current stage of an operation and carries a cancel flag.
+
+    The callback is called with this object at most once per interval, from the
+    thread doing the work.
+    """
+
+    def __init__(self, callback: Callable[['Progress'], None]=None, interval: float=0.2):
+        self.callback = callback
+        self.interval = interval
+        self.stage = ""
+        self.total = 0
+        self.done = 0
+        self.started = time.perf_counter()
+        self._stage_started = self.started
+        self._last_report = 0.0
+        self._cancel_event = threading.Event()
+
+    def __str__(self) -> str:
+        text = f"{self.stage}: {self.done}"
+        if self.total:
+            text += f" of {self.total}"
+        text += f" rows ({self.rows_per_second:.0f} rows/s"
+        eta = self.eta_seconds
+        if eta is not None:
+            text += f", {eta:.0f}s left"
+        return text + ")"
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = time.perf_counter() - self._stage_started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        rate = self.rows_per_second
+        if not self.total or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """Ask the operation to stop. Safe to call from any thread."""
+        self._cancel_event.set()
+
+    def check_cancelled(self) -> None:
+        """Raise errors.OperationCancelled if cancel was requested."""
+        if self._cancel_event.is_set():
+            raise errors.OperationCancelled(f"Cancelled during '{self.stage}'.")
+
+    def start(self, stage: str, total: int=0) -> None:
+        """Start a new stage. A total of 0 means the number of rows is unknown."""
+        self.check_cancelled()
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self._stage_started = time.perf_counter()
+        self._report(force=True)
+
+    def advance(self, count: int=1) -> None:
+        """Record rows done and check for cancellation."""
+        self.check_cancelled()
+        self.done += count
+        self._report()
+
+    def _report(self, force: bool=False) -> None:
+        if not self.callback:
+            return
+        now = time.perf_counter()
+        if force or now - self._last_report >= self.interval or self.done == self.total:
+            self._last_report = now
+            self.callback(self)
+
+
+def chunks(items: list, size: int):
+    """Yield successive slices of items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
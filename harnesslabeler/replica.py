@@ -0,0 +1,299 @@
+"""Module for the local SQLite replica of labels kept on every station.
+    Label searches read from the replica, so lookups keep working while MySQL is slow
+    or unreachable. Writes always go to MySQL. The replica catches up by date_modified,
+    and copies every label again after a restore."""
+from __future__ import annotations
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, MetaData, String, Table, create_engine, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from harnesslabeler import backends, config, database, models, users
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import chunks
+
+logger = logging.getLogger("backend")
+
+
+# Labels are stamped with the clock of the station that saved them, so re-read a window
+# before the last mark to pick up rows saved by a station whose clock runs behind.
+CLOCK_SKEW_OVERLAP = timedelta(minutes=5)
+SYNC_CHUNK_SIZE = 1000
+
+metadata = MetaData()
+
+label_table = Table(
+    "label", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("part_number", String(100), nullable=False),
+    Column("value", String(256), nullable=False),
+    Column("sort_index", Integer, nullable=False),
+    Column("rolling_label", Boolean, nullable=False),
+    Column("date_modified", DateTime, nullable=False),
+    Column("modified_by_user_id", Integer),
+    Index("IX_label_part_number_rolling_sort", "part_number", "rolling_label", "sort_index")
+)
+
+sync_state_table = Table(
+    "sync_state", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("label_date_modified", DateTime),
+    Column("last_sync", DateTime),
+    # models.DataGeneration when last synced. A restore raises it and forces a full copy.
+    Column("data_generation", Integer)
+)
+
+
+@dataclass
+class LabelRow:
+    """A label as shown in the main window search table."""
+
+    id: int
+    part_number: str
+    value: str
+    sort_index: int
+    rolling_label: bool
+    date_modified: datetime
+    modified_by_user_id: Optional[int]
+
+    @property
+    def modified_by_full_name(self) -> str:
+        return users.directory.full_name(self.modified_by_user_id)
+
+    @property
+    def type_name(self) -> str:
+        return "Rolling" if self.rolling_label else "Breakout"
+
+    @property
+    def date_modified_str(self) -> str:
+        return self.date_modified.strftime(config.DATETIME_FORMAT)
+
+    @staticmethod
+    def from_row(row: tuple) -> 'LabelRow':
+        """Build from (id, part_number, value, sort_index, rolling_label, date_modified, modified_by_user_id)."""
+        id_, part_number, value, sort_index, rolling_label, date_modified, modified_by_user_id = row
+        return LabelRow(id_, part_number, value, sort_index, bool(rolling_label), date_modified, modified_by_user_id)
+
+
+class LabelReplica:
+    """SQLite copy of the label table. User names come from users.directory. Safe to use from several threads."""
+
+    def __init__(self, file_path: str=config.REPLICA_FILE):
+        self.file_path = file_path
+        self.engine = create_engine(f"sqlite:///{file_path}", connect_args={"check_same_thread": False})
+        event.listen(self.engine, "connect", self._on_connect)
+        if inspect(self.engine).has_table(sync_state_table.name) and \
+                "data_generation" not in {column["name"] for column in inspect(self.engine).get_columns(sync_state_table.name)}:
+            # Replica from an older version. Dropping the state makes the next sync a full copy.
+            sync_state_table.drop(self.engine)
+        metadata.create_all(self.engine)
+        self.last_error = None # type: Optional[str]
+        self._sync_lock = threading.Lock()
+
+    @staticmethod
+    def _on_connect(dbapi_connection, connection_record) -> None:
+        # WAL lets searches read while a sync writes.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def _state(self, connection) -> Optional[tuple]:
+        return connection.execute(select(sync_state_table.c.label_date_modified, sync_state_table.c.last_sync, sync_state_table.c.data_generation)).first()
+
+    @property
+    def last_sync(self) -> Optional[datetime]:
+        with self.engine.connect() as connection:
+            state = self._state(connection)
+        return state[1] if state else None
+
+    def staleness_seconds(self) -> Optional[float]:
+        """Seconds since the last successful sync, or None if the replica was never synced."""
+        last_sync = self.last_sync
+        if last_sync is None:
+            return None
+        return (datetime.now() - last_sync).total_seconds()
+
+    def status_text(self, stale_seconds: int=config.REPLICA_STALE_SECONDS) -> str:
+        """Return a short warning for the window title, or an empty string while the replica is current."""
+        last_sync = self.last_sync
+        if last_sync is None:
+            return ""
+        behind = (datetime.now() - last_sync).total_seconds()
+        if self.last_error:
+            return f"[OFFLINE - labels as of {last_sync.strftime(config.DATETIME_FORMAT)}]"
+        if behind > stale_seconds:
+            return f"[Labels {behind / 60:.0f} min behind]"
+        return ""
+
+    def sync(self) -> int:
+        """Copy labels changed since the last sync and drop deleted labels.
+
+        Raises:
+            Exception: Any database error. The replica keeps its previous contents.
+
+        Returns:
+            int: Number of labels copied.
+        """
+        with self._sync_lock:
+            try:
+                copied = self._sync()
+            except Exception as error:
+                self.last_error = str(error)
+                raise
+            self.last_error = None
+            return copied
+
+    def _sync(self) -> int:
+        label = models.BreakoutLabel
+        started = datetime.now()
+        with self.engine.connect() as connection:
+            state = self._state(connection)
+        mark = state[0] if state else None
+
+        with DBContext(read_only=True) as session:
+            generation = models.DataGeneration.current(session)
+            if state and state[2] != generation:
+                logger.info(f"[REPLICA] Data was restored (generation {state[2]} to {generation}), copying every label.")
+                mark = None
+            query = session.query(
+                label.id, label.part_number, label.value, label.sort_index,
+                label.rolling_label, label.date_modified, label.modified_by_user_id
+                )
+            if mark is not None:
+                query = query.filter(label.date_modified >= mark - CLOCK_SKEW_OVERLAP)
+            changed = [dict(row._mapping) for row in query]
+            primary_count = session.query(func.count(label.id)).scalar()
+            primary_ids = None
+            if mark is not None:
+                # Only fetch every id when the counts show labels were deleted.
+                with self.engine.connect() as connection:
+                    local_ids = {row[0] for row in connection.execute(select(label_table.c.id))}
+                local_count = len(local_ids | {row["id"] for row in changed})
+                if local_count > primary_count:
+                    primary_ids = {row[0] for row in session.query(label.id)}
+
+        new_mark = max((row["date_modified"] for row in changed), default=mark)
+        with self.engine.begin() as connection:
+            if mark is None:
+                connection.execute(label_table.delete())
+            for chunk in chunks(changed, SYNC_CHUNK_SIZE):
+                connection.execute(sqlite_insert(label_table).prefix_with("OR REPLACE"), chunk)
+            if primary_ids is not None:
+                deleted = list(local_ids - primary_ids)
+                for chunk in chunks(deleted, SYNC_CHUNK_SIZE):
+                    connection.execute(label_table.delete().where(label_table.c.id.in_(chunk)))
+                logger.info(f"[REPLICA] Removed {len(deleted)} deleted labels.")
+
+            connection.execute(sync_state_table.delete())
+            connection.execute(sync_state_table.insert(), {"id": 1, "label_date_modified": new_mark, "last_sync": started, "data_generation": generation})
+
+        logger.debug(f"[REPLICA] Synced {len(changed)} labels.")
+        return len(changed)
+
+    def _select(self):
+        return select(
+                    label_table.c.id, label_table.c.part_number, label_table.c.value, label_table.c.sort_index,
+                    label_table.c.rolling_label, label_table.c.date_modified, label_table.c.modified_by_user_id
+                    )\
+                    .order_by(label_table.c.part_number, label_table.c.sort_index)
+
+    def get(self, label_id: int) -> Optional[LabelRow]:
+        """Return one label, used to edit labels while MySQL can not be reached."""
+        with self.engine.connect() as connection:
+            row = connection.execute(self._select().where(label_table.c.id == label_id)).first()
+        return LabelRow.from_row(row) if row else None
+
+    def search(self, part_number: str="", rolling_label: Optional[bool]=None) -> List[LabelRow]:
+        """Search labels like the main window. rolling_label None returns both types."""
+        query = self._select()
+        if part_number != "":
+            query = query.where(label_table.c.part_number == part_number)
+        if rolling_label is not None:
+            query = query.where(label_table.c.rolling_label == rolling_label)
+
+        with self.engine.connect() as connection:
+            return [LabelRow.from_row(row) for row in connection.execute(query)]
+
+
+class ReplicaSync(threading.Thread):
+    """Background thread that syncs the replica every interval seconds, or sooner when woken.
+    Listeners are called on this thread after every successful sync."""
+
+    def __init__(self, replica: LabelReplica, interval: float):
+        super().__init__(name="Label Replica Sync", daemon=True)
+        self.replica = replica
+        self.interval = interval
+        self.listeners = [] # type: List[Callable[[], None]]
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def wake(self) -> None:
+        self._wake_event.set()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.replica.sync()
+            except Exception as error:
+                logger.warning(f"[REPLICA] Sync failed. Searches use the last synced data. Error: {error}")
+            else:
+                for listener in self.listeners:
+                    listener()
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+
+
+label_replica = None # type: Optional[LabelReplica]
+replica_sync = None # type: Optional[ReplicaSync]
+
+
+def start_replica(interval: float=config.REPLICA_SYNC_SECONDS) -> Optional[LabelReplica]:
+    """Open the replica and start syncing it in the background. Does nothing if the replica is turned off
+    or the database is already an embedded SQLite file."""
+    global label_replica, replica_sync
+    if not config.REPLICA_ENABLED or label_replica is not None or database.backend.name != backends.MYSQL:
+        return label_replica
+    try:
+        label_replica = LabelReplica()
+    except Exception:
+        logger.exception(f"[REPLICA] Could not open '{config.REPLICA_FILE}'. Searches use MySQL.")
+        return None
+    replica_sync = ReplicaSync(label_replica, interval)
+    replica_sync.start()
+    logger.info(f"[REPLICA] Syncing '{config.REPLICA_FILE}' every {interval}s.")
+    return label_replica
+
+
+def request_sync() -> bool:
+    """Wake the background sync without waiting for it. A sync already running is followed
+    by another one, so a change written before the call is always picked up.
+
+    Returns:
+        bool: False if the replica is not running.
+    """
+    if replica_sync is None:
+        return False
+    replica_sync.wake()
+    return True
+
+
+def add_sync_listener(listener: Callable[[], None]) -> None:
+    """Call listener on the sync thread after every successful sync."""
+    if replica_sync is not None:
+        replica_sync.listeners.append(listener)
+
+
+def stop_replica() -> None:
+    global replica_sync
+    if replica_sync is not None:
+        replica_sync.stop()
+        replica_sync = None
@@ -0,0 +1,79 @@
+"""Module of the statements run on every search, edit and login.
+    Each statement is built once with bound parameters, so SQLAlchemy finds its
+    compiled form in the compiled cache instead of rebuilding an ORM Query per call.
+
+    Benchmark: python benchmarks/repository_benchmark.py"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from harnesslabeler import models
+from harnesslabeler.replica import LabelRow
+
+
+def _label_search(by_part_number: bool, by_rolling_label: bool) -> Select:
+    # User names come from users.directory, so the user table is not joined.
+    label = models.BreakoutLabel
+    statement = select(
+                    label.id, label.part_number, label.value, label.sort_index,
+                    label.rolling_label, label.date_modified, label.modified_by_user_id
+                    )\
+                    .order_by(label.part_number, label.sort_index)
+    if by_part_number:
+        statement = statement.where(label.part_number == bindparam("part_number"))
+    if by_rolling_label:
+        statement = statement.where(label.rolling_label == bindparam("rolling_label"))
+    return statement
+
+
+# One statement per filter combination, keyed by (part number given, label type given).
+LABEL_SEARCH = {
+    (by_part_number, by_rolling_label): _label_search(by_part_number, by_rolling_label)
+    for by_part_number in (False, True)
+    for by_rolling_label in (False, True)
+} # type: Dict[Tuple[bool, bool], Select]
+
+LABEL_BY_ID = select(models.BreakoutLabel).where(models.BreakoutLabel.id == bindparam("label_id"))
+USER_BY_ID = select(models.User).where(models.User.id == bindparam("user_id"))
+USER_BY_USERNAME = select(models.User).where(models.User.username == bindparam("username"))
+MAX_SORT_INDEX = select(func.max(models.BreakoutLabel.sort_index)).where(models.BreakoutLabel.part_number == bindparam("part_number"))
+
+
+def search_labels(session: Session, part_number: str="", rolling_label: Optional[bool]=None) -> List[LabelRow]:
+    """Search labels like the main window. LabelRow.modified_by_full_name comes from users.directory.
+
+    Args:
+        session (Session): The session to use. May be read-only.
+        part_number (str, optional): Only labels of this part number. Defaults to every part number.
+        rolling_label (Optional[bool], optional): Only rolling or breakout labels. Defaults to both.
+
+    Returns:
+        List[LabelRow]: Labels ordered by part number and sort index.
+    """
+    statement = LABEL_SEARCH[(part_number != "", rolling_label is not None)]
+    parameters = {}
+    if part_number != "":
+        parameters["part_number"] = part_number
+    if rolling_label is not None:
+        parameters["rolling_label"] = rolling_label
+    return [LabelRow.from_row(row) for row in session.execute(statement, parameters)]
+
+
+def label_by_id(session: Session, label_id: int) -> Optional[models.BreakoutLabel]:
+    return session.execute(LABEL_BY_ID, {"label_id": label_id}).scalars().first()
+
+
+def user_by_id(session: Session, user_id: int) -> Optional[models.User]:
+    return session.execute(USER_BY_ID, {"user_id": user_id}).scalars().first()
+
+
+def user_by_username(session: Session, username: str) -> Optional[models.User]:
+    return session.execute(USER_BY_USERNAME, {"username": username}).scalars().first()
+
+
+def next_sort_index(session: Session, part_number: str) -> int:
+    """Return the sort_index for a new label on part_number, one past the highest in use."""
+    return (session.execute(MAX_SORT_INDEX, {"part_number": part_number}).scalar() or 0) + 1
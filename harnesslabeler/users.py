@@ -0,0 +1,275 @@
+"""Module for searching, deleting and deactivating users, and the user directory.
+    Searches return one page at a time. Each change is a few set-based UPDATE and DELETE
+    statements in one transaction, so users with years of login events are not loaded
+    into the session row by row. The directory keeps the display name of every user in
+    memory, so rows that store a user id are shown without loading the user."""
+from __future__ import annotations
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, tuple_, union
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from harnesslabeler import config, models
+from harnesslabeler.database import DBContext
+
+logger = logging.getLogger("backend")
+
+
+SUPERUSER_ID = 1
+# Sorts after every character a name can hold, so prefix <= value < prefix + PREFIX_END is a prefix match.
+PREFIX_END = "\uffff"
+# An id missing from the directory reloads it, at most this often. Covers users added by other stations.
+DIRECTORY_MISS_REFRESH_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class DirectoryEntry:
+    full_name: str
+    initials: str
+    active: bool
+
+
+class UserDirectory:
+    """Display name, initials and active flag of every user by id. Safe to use from several threads.
+
+    Loaded after login and reloaded whenever users are changed through this program.
+    """
+
+    def __init__(self):
+        self._entries = {} # type: Dict[int, DirectoryEntry]
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    def refresh(self) -> int:
+        """Reload every user in one query. Returns the number of users.
+
+        Raises:
+            Exception: Any database error. The previous entries are kept.
+        """
+        user = models.User
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            with DBContext(read_only=True) as session:
+                rows = session.execute(select(user.id, user.first_name, user.last_name, user.active)).all()
+            # Replace the whole dict, readers never see a half loaded directory.
+            self._entries = {
+                row.id: DirectoryEntry(
+                    models.User.format_full_name(row.first_name, row.last_name),
+                    models.User.format_initials(row.first_name, row.last_name),
+                    bool(row.active)
+                    )
+                for row in rows
+            }
+        logger.debug(f"[USER] Directory loaded {len(self._entries)} users.")
+        return len(self._entries)
+
+    def get(self, user_id: Optional[int]) -> Optional[DirectoryEntry]:
+        if user_id is None:
+            return None
+        entry = self._entries.get(user_id)
+        if entry is None and time.monotonic() - self._last_refresh >= DIRECTORY_MISS_REFRESH_SECONDS:
+            try:
+                self.refresh()
+            except DBAPIError as error:
+                logger.debug(f"[USER] Could not reload the directory for user id {user_id}. Error: {error}")
+            entry = self._entries.get(user_id)
+        return entry
+
+    def full_name(self, user_id: Optional[int]) -> str:
+        """Return the full name of user_id, or an empty string if it is None or unknown."""
+        entry = self.get(user_id)
+        return entry.full_name if entry else ""
+
+    def initials(self, user_id: Optional[int]) -> str:
+        entry = self.get(user_id)
+        return entry.initials if entry else ""
+
+
+directory = UserDirectory()
+
+
+@dataclass
+class UserRow:
+    """A user as shown in the user administration list."""
+
+    id: int
+    first_name: str
+    last_name: str
+    username: str
+    active: bool
+    last_login_date: Optional[datetime]
+    # Position in the list order, the next page starts after it.
+    sort_key: Tuple[str, str, int]
+
+    @property
+    def last_login_date_str(self) -> str:
+        return self.last_login_date.strftime(config.DATETIME_FORMAT) if self.last_login_date else "Never"
+
+
+def search_users(
+        session: Session,
+        first_name: str="",
+        last_name: str="",
+        username: str="",
+        active_only: bool=True,
+        after: Optional[Tuple[str, str, int]]=None,
+        limit: int=config.USER_PAGE_SIZE
+        ) -> List[UserRow]:
+    """Return one page of users whose names start with the given text, ignoring case.
+
+    Users are ordered by last name, first name and id. Each filter is a range on an
+    indexed lower case column, and pages are read by key instead of offset.
+
+    Args:
+        session (Session): The session to use. May be read-only.
+        first_name (str, optional): First name prefix. Defaults to any.
+        last_name (str, optional): Last name prefix. Defaults to any.
+        username (str, optional): Username prefix. Defaults to any.
+        active_only (bool, optional): Leave out deactivated users. Defaults to True.
+        after (Optional[Tuple[str, str, int]], optional): sort_key of the last row of the previous page. Defaults to the first page.
+        limit (int, optional): Page size. Defaults to 'Users/Page Size'.
+
+    Returns:
+        List[UserRow]: Up to limit users.
+    """
+    user = models.User
+    statement = select(
+                    user.id, user.first_name, user.last_name, user.username, user.active,
+                    user.last_login_date, user.last_name_search, user.first_name_search
+                    )\
+                    .order_by(user.last_name_search, user.first_name_search, user.id)\
+                    .limit(limit)
+    for column, prefix in ((user.first_name_search, first_name), (user.last_name_search, last_name), (user.username_search, username)):
+        if prefix != "":
+            prefix = prefix.lower()
+            statement = statement.where(column >= prefix).where(column < prefix + PREFIX_END)
+    if active_only:
+        statement = statement.where(user.active == True)
+    if after is not None:
+        statement = statement.where(tuple_(user.last_name_search, user.first_name_search, user.id) > tuple_(*after))
+    return [
+        UserRow(row.id, row.first_name, row.last_name, row.username, row.active, row.last_login_date, (row.last_name_search, row.first_name_search, row.id))
+        for row in session.execute(statement)
+    ]
+
+
+@dataclass
+class UserChangeSummary:
+    """Rows affected by delete_users or deactivate_users."""
+
+    users_deleted: int = 0
+    users_deactivated: int = 0
+    login_events_deleted: int = 0
+    # Users left alone because they created or modified labels. Deactivate them instead.
+    kept_with_labels: List[int] = field(default_factory=list)
+    # The superuser and the logged in user, who can not remove themselves.
+    protected: List[int] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        lines = []
+        if self.users_deleted:
+            lines.append(f"Deleted {self.users_deleted} user(s) and {self.login_events_deleted} login event(s).")
+        if self.users_deactivated:
+            lines.append(f"Deactivated {self.users_deactivated} user(s).")
+        if self.kept_with_labels:
+            lines.append(f"Kept {len(self.kept_with_labels)} user(s) who created or modified labels. Deactivate them to hide them.")
+        if self.protected:
+            lines.append(f"Skipped {len(self.protected)} user(s) that can not be removed: the superuser and the logged in user.")
+        return "\n".join(lines) or "No users were changed."
+
+
+def refresh_directory() -> None:
+    # The change is already committed, a failed reload only leaves names stale until the next one.
+    try:
+        directory.refresh()
+    except Exception:
+        logger.exception("[USER] Could not reload the user directory.")
+
+
+def _split_protected(user_ids: Iterable[int], current_user_id: int, summary: UserChangeSummary) -> Set[int]:
+    ids = set(user_ids)
+    summary.protected = sorted(ids & {SUPERUSER_ID, current_user_id})
+    return ids - {SUPERUSER_ID, current_user_id}
+
+
+def users_with_labels(session: Session, user_ids: Iterable[int]) -> Set[int]:
+    """Return the ids in user_ids that created or modified at least one label, in one query."""
+    ids = list(user_ids)
+    if not ids:
+        return set()
+    label = models.BreakoutLabel.__table__
+    statement = union(
+        select(label.c.created_by_user_id).where(label.c.created_by_user_id.in_(ids)),
+        select(label.c.modified_by_user_id).where(label.c.modified_by_user_id.in_(ids))
+    )
+    return {user_id for user_id, in session.execute(statement)}
+
+
+def delete_users(session: Session, user_ids: Iterable[int], current_user_id: int) -> UserChangeSummary:
+    """Delete users, their login events and their daily login counts in one transaction. Commits.
+
+    Users who created or modified labels are kept, the audit columns of their labels still
+    point at them. The superuser and current_user_id are never deleted.
+
+    Args:
+        session (Session): The session to use. Its pending changes are committed too.
+        user_ids (Iterable[int]): Users to delete.
+        current_user_id (int): The logged in user.
+
+    Raises:
+        Exception: Any database error. Nothing is deleted.
+
+    Returns:
+        UserChangeSummary: Rows deleted and users left alone.
+    """
+    summary = UserChangeSummary()
+    user_table = models.User.__table__
+    log_table = models.UserLoginLog.__table__
+    day_table = models.UserLoginDay.__table__
+    try:
+        ids = _split_protected(user_ids, current_user_id, summary)
+        summary.kept_with_labels = sorted(users_with_labels(session, ids))
+        ids -= set(summary.kept_with_labels)
+        if ids:
+            summary.login_events_deleted = session.execute(log_table.delete().where(log_table.c.user_id.in_(ids))).rowcount
+            session.execute(day_table.delete().where(day_table.c.user_id.in_(ids)))
+            summary.users_deleted = session.execute(user_table.delete().where(user_table.c.id.in_(ids))).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger.info(f"[USER] Deleted users {sorted(ids)}. {summary}")
+    refresh_directory()
+    return summary
+
+
+def deactivate_users(session: Session, user_ids: Iterable[int], current_user_id: int) -> UserChangeSummary:
+    """Deactivate users in one UPDATE. Commits. Users already inactive are not counted.
+
+    Raises:
+        Exception: Any database error. Nothing is changed.
+
+    Returns:
+        UserChangeSummary: Users deactivated and users left alone.
+    """
+    summary = UserChangeSummary()
+    user_table = models.User.__table__
+    try:
+        ids = _split_protected(user_ids, current_user_id, summary)
+        if ids:
+            summary.users_deactivated = session.execute(
+                user_table.update().where(user_table.c.id.in_(ids)).where(user_table.c.active == True).values(active=False)
+            ).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    logger.info(f"[USER] Deactivated users {sorted(ids)}. {summary}")
+    refresh_directory()
+    return summary
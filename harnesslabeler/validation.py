@@ -0,0 +1,226 @@
+"""Module to validate database backup data before it is imported.
+    Checks every section in one pass and collects all errors instead of
+    stopping at the first one. Does not use any Qt widgets, so it can run headless."""
+from __future__ import annotations
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from harnesslabeler import config, enums
+
+logger = logging.getLogger("backend")
+
+
+INTEGER = (int,)
+STRING = (str,)
+BOOLEAN = (bool, int)
+OPTIONAL_INTEGER = (int, type(None))
+DATETIME = "datetime"
+OPTIONAL_DATETIME = "optional_datetime"
+LOGIN_EVENT_TYPE = "login_event_type"
+
+# Section name -> (field name, expected type) in export order.
+REQUIRED_SECTIONS = {
+    "labels": (
+        ("id", INTEGER),
+        ("part_number", STRING),
+        ("value", STRING),
+        ("sort_index", INTEGER),
+        ("rolling_label", BOOLEAN),
+        ("date_created", DATETIME),
+        ("date_modified", DATETIME),
+        ("modified_by_user_id", OPTIONAL_INTEGER),
+        ("created_by_user_id", OPTIONAL_INTEGER)
+    ),
+    "users": (
+        ("id", INTEGER),
+        ("active", BOOLEAN),
+        ("last_login_date", OPTIONAL_DATETIME),
+        ("first_name", STRING),
+        ("last_name", STRING),
+        ("username", STRING),
+        ("password_hash", STRING)
+    ),
+    "user_logins": (
+        ("id", INTEGER),
+        ("event_date", DATETIME),
+        ("event_type", LOGIN_EVENT_TYPE),
+        ("user_id", INTEGER)
+    )
+}
+
+# Section name -> fields that must reference a user id in the 'users' section.
+USER_REFERENCES = {
+    "labels": ("created_by_user_id", "modified_by_user_id"),
+    "user_logins": ("user_id",)
+}
+
+NEVER_LOGGED_IN = "Never"
+
+
+@dataclass
+class ValidationError:
+    """A single problem found in the import data."""
+
+    location: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.location}: {self.message}"
+
+
+@dataclass
+class ValidationReport:
+    """Result of validating import data."""
+
+    errors: List[ValidationError] = field(default_factory=list)
+    counts: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def is_valid(self) -> bool:
+        return len(self.errors) == 0
+
+    def add(self, location: str, message: str) -> None:
+        self.errors.append(ValidationError(location, message))
+
+    def summary(self, max_errors: int=10) -> str:
+        """Return a short human readable summary of the report."""
+        counts = ", ".join(f"{name}: {count}" for name, count in self.counts.items())
+        if self.is_valid:
+            return f"Validation passed. {counts}."
+
+        lines = [f"Validation failed with {len(self.errors)} error(s). {counts}."]
+        lines.extend(str(error) for error in self.errors[:max_errors])
+        if len(self.errors) > max_errors:
+            lines.append(f"... and {len(self.errors) - max_errors} more.")
+        return "\n".join(lines)
+
+    def __str__(self) -> str:
+        return "\n".join(str(error) for error in self.errors)
+
+
+class _DateChecker:
+    """Checks date strings against DATETIME_FORMAT, remembering values already seen."""
+
+    def __init__(self, datetime_format: str):
+        self.datetime_format = datetime_format
+        self.valid = set() # type: Set[str]
+
+    def __call__(self, value: str) -> bool:
+        if value in self.valid:
+            return True
+        try:
+            datetime.strptime(value, self.datetime_format)
+        except (TypeError, ValueError):
+            return False
+        self.valid.add(value)
+        return True
+
+
+def _check_value(value, expected, is_date: _DateChecker) -> Optional[str]:
+    """Return an error message if value does not match the expected type."""
+    if expected == DATETIME:
+        if not isinstance(value, str) or not is_date(value):
+            return f"Expected a date in format '{config.DATETIME_FORMAT}', got {value!r}."
+        return None
+
+    if expected == OPTIONAL_DATETIME:
+        if value is None or value == NEVER_LOGGED_IN:
+            return None
+        if not isinstance(value, str) or not is_date(value):
+            return f"Expected a date in format '{config.DATETIME_FORMAT}' or '{NEVER_LOGGED_IN}', got {value!r}."
+        return None
+
+    if expected == LOGIN_EVENT_TYPE:
+        if value not in enums.LoginEventType.all():
+            return f"Expected one of {enums.LoginEventType.all()}, got {value!r}."
+        return None
+
+    # bool is a subclass of int, do not accept True/False where an id is expected.
+    if isinstance(value, bool) and bool not in expected:
+        return f"Expected {' or '.join(t.__name__ for t in expected)}, got {value!r}."
+    if not isinstance(value, expected):
+        return f"Expected {' or '.join(t.__name__ for t in expected)}, got {type(value).__name__} {value!r}."
+    return None
+
+
+def validate_backup(data: dict) -> ValidationReport:
+    """Validate backup data in a single pass over every item.
+
+    Checks that all sections and fields exist, field types, duplicate ids
+    and that every user reference points at a user in the 'users' section.
+
+    Args:
+        data (dict): The loaded backup data.
+
+    Returns:
+        ValidationReport: Every error found along with the item counts.
+    """
+    logger.info("[VALIDATION] Validating backup data.")
+    report = ValidationReport()
+    is_date = _DateChecker(config.DATETIME_FORMAT)
+    user_ids = set() # type: Set[int]
+    references = [] # type: List[Tuple[str, int]]
+
+    if not isinstance(data, dict):
+        report.add("<root>", f"Expected an object with sections {list(REQUIRED_SECTIONS)}, got {type(data).__name__}.")
+        return report
+
+    for section, fields in REQUIRED_SECTIONS.items():
+        items = data.get(section)
+        if items is None:
+            report.add(section, "Missing required section.")
+            continue
+        if not isinstance(items, list):
+            report.add(section, f"Expected a list, got {type(items).__name__}.")
+            continue
+
+        report.counts[section] = len(items)
+        reference_fields = USER_REFERENCES.get(section, ())
+        seen_ids = set() # type: Set[int]
+
+        for index, item in enumerate(items):
+            location = f"{section}[{index}]"
+            if not isinstance(item, dict):
+                report.add(location, f"Expected an object, got {type(item).__name__}.")
+                continue
+
+            for name, expected in fields:
+                if name not in item:
+                    report.add(f"{location}.{name}", "Missing required field.")
+                    continue
+                message = _check_value(item[name], expected, is_date)
+                if message:
+                    report.add(f"{location}.{name}", message)
+
+            id_ = item.get("id")
+            if isinstance(id_, int):
+                if id_ in seen_ids:
+                    report.add(f"{location}.id", f"Duplicate id {id_}.")
+                seen_ids.add(id_)
+
+            for name in reference_fields:
+                value = item.get(name)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    references.append((f"{location}.{name}", value))
+
+        if section == "users":
+            user_ids = seen_ids
+
+    # Users may come after the sections that reference them, so check references last.
+    if "users" in report.counts:
+        for location, user_id in references:
+            if user_id not in user_ids:
+                report.add(location, f"References user id {user_id} which is not in 'users'.")
+
+    if report.is_valid:
+        logger.info(f"[VALIDATION] {report.summary()}")
+    else:
+        logger.error(f"[VALIDATION] {report.summary()}")
+    return report
+
+
+def required_fields(section: str) -> Iterable[str]:
+    """Return the required field names for a section."""
+    return [name for name, _ in REQUIRED_SECTIONS[section]]
@@ -0,0 +1,64 @@
+"""Module to run long data operations on a background thread so the main window stays usable.
+    The task receives a Progress object. Its reports are forwarded to the GUI thread as signals."""
+from __future__ import annotations
+import logging
+from typing import Callable, Optional
+
+from PyQt5 import QtCore
+
+from harnesslabeler import errors
+from harnesslabeler.progress import Progress
+
+logger = logging.getLogger("frontend")
+
+
+class Worker(QtCore.QObject):
+    """Runs task(progress) on its own QThread.
+
+    When the task stops, finished is emitted once. Either result is set, or error
+    is set and cancelled tells if the error is errors.OperationCancelled. Slots connected to the signals run on the GUI thread.
+    """
+
+    progressed = QtCore.pyqtSignal(int, int, str)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, task: Callable[[Progress], object]):
+        super().__init__()
+        self.task = task
+        self.progress = Progress(callback=self._on_progress)
+        self.result = None
+        self.error = None # type: Optional[Exception]
+        self.cancelled = False
+        self.thread = QtCore.QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.run)
+        self.finished.connect(self.thread.quit)
+
+    def _on_progress(self, progress: Progress) -> None:
+        # Called on the worker thread. Send a snapshot, the Progress object keeps changing.
+        self.progressed.emit(progress.done, progress.total, str(progress))
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def cancel(self) -> None:
+        """Ask the task to stop at its next progress report. Safe to call from the GUI thread."""
+        self.progress.cancel()
+
+    def connect_cancel(self, signal) -> None:
+        """Cancel when signal is emitted. Connected directly, a queued call would wait for the
+        worker thread's event loop, which is blocked in run until the task returns."""
+        signal.connect(self.cancel, QtCore.Qt.DirectConnection)
+
+    def run(self) -> None:
+        try:
+            self.result = self.task(self.progress)
+        except errors.OperationCancelled as error:
+            logger.warning(f"[WORKER] {error}")
+            self.error = error
+            self.cancelled = True
+        except Exception as error:
+            logger.exception("[WORKER] Background operation failed.")
+            self.error = error
+        finally:
+            self.finished.emit()
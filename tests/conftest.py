@@ -0,0 +1,49 @@
+"""Test setup. Points the program folders and settings at a temporary home before
+harnesslabeler is imported, and runs the database on an in-memory SQLite file."""
+import os
+import sys
+import tempfile
+
+TEST_HOME = tempfile.mkdtemp(prefix="harnesslabeler-tests-")
+os.environ["HOME"] = TEST_HOME
+os.makedirs(os.path.join(TEST_HOME, "Documents"))
+os.environ["XDG_CONFIG_HOME"] = os.path.join(TEST_HOME, ".config")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QSettings
+
+settings = QSettings("DF-Software", "Harness Labeler")
+settings.setValue("Database/Backend", "sqlite")
+settings.setValue("Database/SQLite/File", ":memory:")
+settings.setValue("Database/Replica/Local Replica", "false")
+settings.setValue("Users/Password Hash Rounds", 4)
+settings.sync()
+
+import pytest
+
+
+@pytest.fixture
+def db():
+    """An empty, migrated database. Every table is emptied again after the test."""
+    from harnesslabeler import migrations, models
+    from harnesslabeler.database import engine
+
+    migrations.upgrade_database(engine)
+    yield engine
+    with engine.begin() as connection:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+
+
+@pytest.fixture
+def make_user(db):
+    """Returns make_user(session, username), which adds a user and flushes it so it has an id."""
+    from harnesslabeler import models
+
+    def make_user(session, username: str) -> models.User:
+        user = models.User(first_name=username, last_name="Test", username=username, password_hash="x")
+        session.add(user)
+        session.flush()
+        return user
+    return make_user
@@ -0,0 +1,102 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from harnesslabeler import backup, enums, models
+from harnesslabeler.database import DBContext
+
+
+def make_label(session, user: models.User, value: str, date_modified: datetime) -> models.BreakoutLabel:
+    label = models.BreakoutLabel(
+        part_number="P1", value=value, sort_index=1, rolling_label=False,
+        date_created=date_modified, date_modified=date_modified,
+        created_by_user_id=user.id, modified_by_user_id=user.id
+    )
+    session.add(label)
+    session.flush()
+    return label
+
+
+def test_merge_drops_deleted_user_logins():
+    base = {
+        "backup": {"type": backup.FULL_BACKUP},
+        "labels": [],
+        "users": [{"id": 1}, {"id": 2}],
+        "user_logins": [{"id": 1, "user_id": 1}, {"id": 2, "user_id": 2}]
+    }
+    increment = {
+        "backup": {"type": backup.INCREMENTAL_BACKUP, "label_ids": [], "user_login_ids": [1, 3]},
+        "labels": [],
+        "users": [{"id": 1}],
+        "user_logins": [{"id": 3, "user_id": 1}]
+    }
+
+    merged = backup.merge_backups(base, [increment])
+
+    assert [item["id"] for item in merged["user_logins"]] == [1, 3]
+    assert "user_login_ids" not in merged["backup"]
+
+
+def test_merge_keeps_logins_of_old_increments():
+    base = {"backup": {"type": backup.FULL_BACKUP}, "labels": [], "users": [], "user_logins": [{"id": 1}]}
+    increment = {"backup": {"type": backup.INCREMENTAL_BACKUP}, "labels": [], "users": [], "user_logins": [{"id": 2}]}
+
+    assert [item["id"] for item in backup.merge_backups(base, [increment])["user_logins"]] == [1, 2]
+
+
+def test_incremental_includes_labels_saved_by_a_slow_clock(db, tmp_path, make_user):
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    now = datetime.now().replace(microsecond=0)
+    with DBContext() as session:
+        user = make_user(session, "first")
+        make_label(session, user, "A", now)
+        session.commit()
+    backup.export_full(str(tmp_path / "full.json"), manifest=manifest)
+
+    with DBContext() as session:
+        user = session.query(models.User).first()
+        make_label(session, user, "B", now - timedelta(minutes=2))
+        session.commit()
+    result = backup.export_incremental(str(tmp_path / "increment.json"), manifest=manifest)
+
+    assert result.labels == 2
+    assert {item["value"] for item in backup.load_backup(str(tmp_path / "increment.json"))["labels"]} == {"A", "B"}
+
+
+def test_restore_after_user_delete_and_new_chain(db, tmp_path, make_user):
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    with DBContext() as session:
+        kept = make_user(session, "kept")
+        gone = make_user(session, "gone")
+        session.add(models.UserLoginLog(user_id=gone.id, event_type=enums.LoginEventType.Login))
+        session.add(models.UserLoginLog(user_id=kept.id, event_type=enums.LoginEventType.Login))
+        session.commit()
+        gone_id = gone.id
+    backup.export_full(str(tmp_path / "full.json"), manifest=manifest)
+
+    with DBContext() as session:
+        session.query(models.UserLoginLog).filter(models.UserLoginLog.user_id == gone_id).delete()
+        session.query(models.User).filter(models.User.id == gone_id).delete()
+        session.commit()
+    backup.export_incremental(str(tmp_path / "increment.json"), manifest=manifest)
+
+    counts = backup.restore_data(backup.load_backup(str(tmp_path / "increment.json")), manifest=manifest)
+
+    assert counts["user_logins"] == 1
+    assert backup.BackupManifest.load(manifest.file_path).latest() is None
+    with open(manifest.file_path) as f:
+        assert json.load(f)["entries"] == []
+    assert os.path.exists(tmp_path / "full.json")
+
+
+def test_safety_backup_reads_from_the_primary(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup.BackupManifest, "load", staticmethod(lambda: backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))))
+    contexts = []
+    def context(*args, **kwargs):
+        contexts.append(kwargs.get("read_only", False))
+        return DBContext(*args, **kwargs)
+    monkeypatch.setattr(backup, "DBContext", context)
+
+    backup.export_auto(folder=str(tmp_path))
+
+    assert contexts == [False]
@@ -0,0 +1,72 @@
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from harnesslabeler import backends, database
+
+
+def test_liveness_check_replaces_stale_idle_connection(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'live.sqlite3'}", poolclass=QueuePool, pool_size=1)
+    check = database.LivenessCheck(engine, idle_seconds=0)
+    check.attach()
+    try:
+        with engine.connect() as connection:
+            first = connection.connection.dbapi_connection
+        pings = database.pool_statistics.liveness_pings
+        stale = database.pool_statistics.stale_connections
+
+        # Fails once, the pool must retry the checkout on a new connection.
+        results = iter([False])
+        monkeypatch.setattr(engine.dialect, "do_ping", lambda dbapi_connection: next(results, True))
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT 1")).scalar() == 1
+            assert connection.connection.dbapi_connection is not first
+
+        assert database.pool_statistics.liveness_pings == pings + 1
+        assert database.pool_statistics.stale_connections == stale + 1
+        assert engine.pool.checkedin() == 1
+    finally:
+        check.detach()
+        engine.dispose()
+
+
+def test_liveness_check_skips_recently_used_connections(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'live.sqlite3'}", poolclass=QueuePool, pool_size=1)
+    check = database.LivenessCheck(engine, idle_seconds=3600)
+    check.attach()
+    try:
+        pings = database.pool_statistics.liveness_pings
+        for _ in range(3):
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+
+        assert database.pool_statistics.liveness_pings == pings
+    finally:
+        check.detach()
+        engine.dispose()
+
+
+
+def test_liveness_check_covers_the_read_replica(tmp_path, monkeypatch):
+    read_engine = create_engine(f"sqlite:///{tmp_path / 'replica.sqlite3'}", poolclass=QueuePool, pool_size=1)
+    monkeypatch.setattr(database, "read_engine", read_engine)
+    monkeypatch.setattr(database.backend, "name", backends.MYSQL)
+    database.start_liveness_check(idle_seconds=0.001)
+    try:
+        assert [check.engine for check in database.liveness_checks] == [database.engine, read_engine]
+        with read_engine.connect() as connection:
+            first = connection.connection.dbapi_connection
+        time.sleep(0.01)
+        stale = database.pool_statistics.stale_connections
+
+        results = iter([False])
+        monkeypatch.setattr(read_engine.dialect, "do_ping", lambda dbapi_connection: next(results, True))
+        with read_engine.connect() as connection:
+            assert connection.execute(text("SELECT 1")).scalar() == 1
+            assert connection.connection.dbapi_connection is not first
+
+        assert database.pool_statistics.stale_connections == stale + 1
+    finally:
+        database.stop_liveness_check()
+        read_engine.dispose()
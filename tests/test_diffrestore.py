@@ -0,0 +1,59 @@
+from harnesslabeler import backup, diffrestore, models
+from harnesslabeler.database import DBContext
+
+
+def usernames() -> dict:
+    with DBContext() as session:
+        return {user.id: user.username for user in session.query(models.User)}
+
+
+def test_apply_handles_recreated_and_swapped_usernames(db, tmp_path, make_user, monkeypatch):
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(backup.BackupManifest, "load", staticmethod(lambda: manifest))
+    with DBContext() as session:
+        for username in ("recreated", "first", "second"):
+            make_user(session, username)
+        session.commit()
+    backup.export_full(str(tmp_path / "full.json"), manifest=manifest)
+    expected = usernames()
+
+    with DBContext() as session:
+        users = {user.username: user for user in session.query(models.User)}
+        session.delete(users["recreated"])
+        session.flush()
+        make_user(session, "recreated")
+        users["first"].username = "swap"
+        session.flush()
+        users["second"].username = "first"
+        session.flush()
+        users["first"].username = "second"
+        session.commit()
+
+    plan = diffrestore.plan_restore(backup.load_backup(str(tmp_path / "full.json")))
+    assert (len(plan.users.inserts), len(plan.users.updates), len(plan.users.deletes)) == (1, 2, 1)
+    diffrestore.apply_plan(plan)
+
+    assert usernames() == expected
+
+
+def test_plan_lists_only_changed_labels(db, tmp_path, monkeypatch):
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(backup.BackupManifest, "load", staticmethod(lambda: manifest))
+    with DBContext() as session:
+        for part_number in ("P1", "P2"):
+            session.add(models.BreakoutLabel(part_number=part_number, value="A", sort_index=1, rolling_label=False))
+        session.commit()
+    backup.export_full(str(tmp_path / "full.json"), manifest=manifest)
+
+    with DBContext() as session:
+        session.query(models.BreakoutLabel).filter(models.BreakoutLabel.part_number == "P1").one().value = "changed"
+        session.add(models.BreakoutLabel(part_number="P3", value="A", sort_index=1, rolling_label=False))
+        session.commit()
+
+    plan = diffrestore.plan_restore(backup.load_backup(str(tmp_path / "full.json")))
+    assert (len(plan.labels.inserts), len(plan.labels.updates), len(plan.labels.deletes)) == (0, 1, 1)
+    assert plan.changed_part_numbers == ["P1", "P3"]
+    diffrestore.apply_plan(plan)
+
+    with DBContext() as session:
+        assert sorted((label.part_number, label.value) for label in session.query(models.BreakoutLabel)) == [("P1", "A"), ("P2", "A")]
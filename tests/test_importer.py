@@ -0,0 +1,38 @@
+import pytest
+
+from harnesslabeler import errors, importer, models
+from harnesslabeler.database import DBContext
+from harnesslabeler.progress import Progress
+
+
+def items(part_numbers: int, per_part: int) -> list:
+    return [
+        {"part_number": f"P{part}", "value": f"V{index}", "sort_index": index, "rolling_label": False}
+        for part in range(part_numbers)
+        for index in range(1, per_part + 1)
+    ]
+
+
+def label_count() -> int:
+    with DBContext() as session:
+        return session.query(models.BreakoutLabel).count()
+
+
+def test_cancelled_import_rolls_back(db):
+    progress = Progress()
+    progress.cancel()
+
+    with pytest.raises(errors.OperationCancelled, match="No data was imported"):
+        importer.import_labels(items(3, 10), user_id=None, progress=progress)
+
+    assert label_count() == 0
+
+
+def test_cancelled_parallel_import_is_not_reported_as_skipped(db):
+    # Cancel as soon as the import starts, before any partition runs.
+    progress = Progress(callback=lambda progress: progress.cancel())
+
+    with pytest.raises(errors.OperationCancelled, match="were not imported"):
+        importer.import_labels_parallel(items(3, 10), user_id=None, workers=2, progress=progress)
+
+    assert label_count() == 0
@@ -0,0 +1,31 @@
+from harnesslabeler import integrity, models, repository
+from harnesslabeler.database import DBContext
+
+
+def add_label(session, value: str, rolling_label: bool, sort_index: int=None) -> None:
+    if sort_index is None:
+        sort_index = repository.next_sort_index(session, "P1")
+    session.add(models.BreakoutLabel(part_number="P1", value=value, sort_index=sort_index, rolling_label=rolling_label))
+    session.flush()
+
+
+def test_labels_numbered_by_the_app_pass(db):
+    with DBContext() as session:
+        add_label(session, "A", False)
+        add_label(session, "R", True)
+        add_label(session, "B", False)
+        session.commit()
+        report = integrity.check_database(session)
+
+    assert report.is_valid, report.summary()
+
+
+def test_duplicate_and_stranded_sort_index_fail(db):
+    with DBContext() as session:
+        add_label(session, "A", False, 1)
+        add_label(session, "B", False, 1)
+        add_label(session, "R", True, -1)
+        session.commit()
+        report = integrity.check_database(session)
+
+    assert len(report.errors) == 2
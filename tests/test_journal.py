@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from harnesslabeler import journal, models
+from harnesslabeler.database import DBContext
+
+
+@pytest.fixture
+def label_journal(tmp_path):
+    return journal.LabelJournal(str(tmp_path / "journal.sqlite3"))
+
+
+@pytest.fixture
+def user(make_user):
+    with DBContext() as session:
+        user_id = make_user(session, "offline").id
+        session.commit()
+    return models.User(id=user_id)
+
+
+def new_label(value: str, part_number: str="P1", **kwargs) -> models.BreakoutLabel:
+    return models.BreakoutLabel(part_number=part_number, value=value, rolling_label=False, **kwargs)
+
+
+def labels() -> list:
+    with DBContext() as session:
+        query = session.query(models.BreakoutLabel).order_by(models.BreakoutLabel.part_number, models.BreakoutLabel.sort_index)
+        return [(label.part_number, label.value, label.sort_index) for label in query]
+
+
+def test_replay_applies_in_recorded_order(label_journal, user):
+    for value in ("A", "B", "C"):
+        label_journal.record_create(new_label(value), user)
+
+    result = label_journal.replay()
+
+    assert (result.applied, result.conflicts) == (3, [])
+    assert labels() == [("P1", "A", 1), ("P1", "B", 2), ("P1", "C", 3)]
+    assert label_journal.pending_count() == 0
+
+
+def test_update_of_a_label_changed_meanwhile_is_a_conflict(label_journal, user):
+    loaded = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    with DBContext() as session:
+        session.add(new_label("A", sort_index=1, date_created=loaded, date_modified=loaded))
+        session.commit()
+        label_id = session.query(models.BreakoutLabel.id).scalar()
+    label_journal.record_update(new_label("offline edit", id=label_id), loaded, user)
+    label_journal.record_create(new_label("B"), user)
+
+    # Another station edits the label before the journal is replayed.
+    with DBContext() as session:
+        label = session.query(models.BreakoutLabel).one()
+        label.value = "server edit"
+        label.date_modified = datetime.now()
+        session.commit()
+
+    result = label_journal.replay()
+
+    assert result.applied == 1
+    assert [conflict.entry for conflict in result.conflicts] == ["Update Breakout label 'offline edit' on part number 'P1'"]
+    assert "changed by another station" in result.conflicts[0].reason
+    assert labels() == [("P1", "server edit", 1), ("P1", "B", 2)]
+    assert [str(conflict) for conflict in label_journal.take_conflicts()] == [str(conflict) for conflict in result.conflicts]
+    assert label_journal.take_conflicts() == []
+
+    assert label_journal.replay().applied == 0
+    assert labels() == [("P1", "server edit", 1), ("P1", "B", 2)]
+
+
+def test_create_is_not_applied_twice_after_an_interrupted_replay(label_journal, user, monkeypatch):
+    label_journal.record_create(new_label("A"), user)
+    finish = label_journal._finish
+    def interrupted(entries, conflicts):
+        raise OSError("Station lost power.")
+    monkeypatch.setattr(label_journal, "_finish", interrupted)
+    with pytest.raises(OSError):
+        label_journal.replay()
+    assert label_journal.pending_count() == 1
+
+    monkeypatch.setattr(label_journal, "_finish", finish)
+    result = label_journal.replay()
+
+    assert (result.applied, result.conflicts) == (1, [])
+    assert labels() == [("P1", "A", 1)]
+    assert label_journal.pending_count() == 0
+
+
+def test_failed_batch_is_narrowed_to_the_failing_entry(label_journal, user, monkeypatch):
+    for value in ("A", "bad", "B", "C"):
+        label_journal.record_create(new_label(value), user)
+    apply = journal.LabelJournal._apply
+    batches = []
+    def failing_apply(session, entry):
+        if entry.value == "bad":
+            raise ValueError("Value can not be stored.")
+        apply(session, entry)
+    monkeypatch.setattr(journal.LabelJournal, "_apply", staticmethod(failing_apply))
+    pending = label_journal.pending
+    def recording_pending(limit=None):
+        batches.append(limit)
+        return pending(limit)
+    monkeypatch.setattr(label_journal, "pending", recording_pending)
+
+    result = label_journal.replay(batch_size=3)
+
+    assert result.applied == 3
+    assert [conflict.entry for conflict in result.conflicts] == ["Create Breakout label 'bad' on part number 'P1'"]
+    assert labels() == [("P1", "A", 1), ("P1", "B", 2), ("P1", "C", 3)]
+    # One batch of three fails, its entries are retried alone, then batches grow again.
+    assert batches == [3, 1, 1, 1, 3, 3]
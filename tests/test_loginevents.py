@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from harnesslabeler import enums, loginevents, models
+from harnesslabeler.database import DBContext
+
+
+@pytest.fixture
+def writer(tmp_path):
+    return loginevents.LoginEventWriter(loginevents.LoginEventSpool(str(tmp_path / "spool.jsonl")), flush_seconds=1, batch_size=2, retry_seconds=1)
+
+
+@pytest.fixture
+def user_id(make_user):
+    with DBContext() as session:
+        user_id = make_user(session, "operator").id
+        session.commit()
+    return user_id
+
+
+def unreachable(events):
+    raise OperationalError("INSERT INTO user_login", {}, Exception("Can't connect to MySQL server"))
+
+
+def login(user_id: int, event_date: datetime) -> loginevents.LoginEvent:
+    return loginevents.LoginEvent(user_id, enums.LoginEventType.Login, event_date)
+
+
+def logged_events() -> list:
+    with DBContext() as session:
+        return [(row.user_id, row.event_date) for row in session.query(models.UserLoginLog).order_by(models.UserLoginLog.id)]
+
+
+def last_login_date(user_id: int) -> datetime:
+    with DBContext() as session:
+        return session.query(models.User.last_login_date).filter(models.User.id == user_id).scalar()
+
+
+def test_events_spooled_while_offline_are_replayed_in_order(writer, user_id, monkeypatch):
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    events = [login(user_id, start + timedelta(minutes=minute)) for minute in range(5)]
+    monkeypatch.setattr(loginevents, "write_events", unreachable)
+    writer._write(events[:3])
+    writer._write(events[3:])
+
+    assert writer.offline
+    assert writer.spool.read() == events
+    assert logged_events() == []
+
+    monkeypatch.undo()
+    assert writer.replay()
+
+    assert not writer.offline
+    assert logged_events() == [(event.user_id, event.event_date) for event in events]
+    assert writer.spool.read() == []
+    assert last_login_date(user_id) == events[-1].event_date
+
+
+def test_replay_stopped_by_the_database_keeps_the_rest_spooled(writer, user_id, monkeypatch):
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+    events = [login(user_id, start + timedelta(minutes=minute)) for minute in range(4)]
+    writer.spool.append(events)
+    write_events = loginevents.write_events
+    calls = []
+    def second_batch_unreachable(batch):
+        calls.append(batch)
+        if len(calls) == 2:
+            unreachable(batch)
+        write_events(batch)
+    monkeypatch.setattr(loginevents, "write_events", second_batch_unreachable)
+
+    assert not writer.replay()
+    assert writer.spool.read() == events[2:]
+
+    assert writer.replay()
+    assert logged_events() == [(event.user_id, event.event_date) for event in events]
+
+
+def test_replayed_events_do_not_move_last_login_date_backwards(writer, user_id):
+    recent = datetime.now().replace(microsecond=0)
+    loginevents.write_events([login(user_id, recent)])
+    writer.spool.append([login(user_id, recent - timedelta(hours=2)), login(user_id, recent - timedelta(hours=1))])
+
+    assert writer.replay()
+
+    assert len(logged_events()) == 3
+    assert last_login_date(user_id) == recent
+
+
+def test_only_the_bad_event_of_a_batch_is_dropped(writer, user_id):
+    now = datetime.now().replace(microsecond=0)
+    events = [login(user_id, now - timedelta(minutes=2)), login(user_id + 1000, now - timedelta(minutes=1)), login(user_id, now)]
+
+    writer._write(events)
+
+    assert not writer.offline
+    assert (writer.written, writer.dropped) == (2, 1)
+    assert logged_events() == [(user_id, events[0].event_date), (user_id, events[2].event_date)]
@@ -0,0 +1,15 @@
+from harnesslabeler import migrations, models
+from harnesslabeler.database import DBContext
+
+
+def test_force_recreate_rebuilds_a_versioned_schema(db):
+    with DBContext() as session:
+        session.add(models.BreakoutLabel(part_number="P1", value="A", sort_index=1, rolling_label=False))
+        session.commit()
+
+    assert migrations.force_recreate(db) == migrations.LATEST_VERSION
+
+    assert migrations.current_version(db) == migrations.LATEST_VERSION
+    with DBContext() as session:
+        assert session.query(models.BreakoutLabel).count() == 0
+        assert [user.username for user in session.query(models.User)] == ["admin"]
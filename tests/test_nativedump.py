@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+from harnesslabeler import backup, config, errors, models, nativedump
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="The stub clients are Python scripts without an .exe name.")
+
+
+@pytest.fixture
+def stub_clients(monkeypatch, tmp_path):
+    log = tmp_path / "mysql.log"
+    monkeypatch.setenv("STUB_MYSQL_LOG", str(log))
+    monkeypatch.delenv("STUB_FAIL_TABLE", raising=False)
+    return log
+
+
+def restored_tables(log) -> list:
+    return [line.rsplit(" ", 1)[1] for line in log.read_text().splitlines()]
+
+
+def test_find_binary_in_folder_or_next_to_mysqldump(tmp_path):
+    mysqldump = os.path.join(STUBS, "mysqldump")
+
+    assert nativedump.find_binary("mysqldump", STUBS) == mysqldump
+    assert nativedump.find_binary("mysql", STUBS) == os.path.join(STUBS, "mysql")
+    assert nativedump.find_binary("mysqldump", mysqldump) == mysqldump
+    assert nativedump.find_binary("mysql", mysqldump) == os.path.join(STUBS, "mysql")
+    assert nativedump.find_binary("mysqldump", str(tmp_path)) is None
+    assert nativedump.find_binary("mysqldump", str(tmp_path / "missing")) is None
+    assert nativedump.find_binary("mysqldump", "") is None
+
+
+def test_dump_writes_every_table_and_manifest(stub_clients, tmp_path):
+    result = nativedump.dump(str(tmp_path / "dump"), location=STUBS)
+
+    assert set(result.tables) == set(nativedump.TABLES)
+    for table in nativedump.TABLES:
+        assert (tmp_path / "dump" / f"{table}.sql").read_text() == f"-- stub dump of {table}\n"
+    with open(result.manifest_path) as f:
+        assert json.load(f)["backup"]["tables"] == list(nativedump.TABLES)
+    assert nativedump.is_native_backup(result.manifest_path)
+
+
+def test_dump_failure_raises_with_exit_code(stub_clients, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_FAIL_TABLE", models.BreakoutLabel.__tablename__)
+
+    with pytest.raises(errors.BackupError, match="exit code 2"):
+        nativedump.dump(str(tmp_path / "dump"), location=STUBS)
+
+
+def test_restore_loads_parents_first_and_checks_references(db, stub_clients, tmp_path):
+    nativedump.dump(str(tmp_path / "dump"), location=STUBS)
+
+    result = nativedump.restore(str(tmp_path / "dump"), location=STUBS)
+
+    assert restored_tables(stub_clients) == list(nativedump.TABLES)
+    assert result.integrity is not None and result.integrity.is_valid
+
+
+def test_restore_stops_at_first_failed_table(db, stub_clients, tmp_path, monkeypatch):
+    nativedump.dump(str(tmp_path / "dump"), location=STUBS)
+    monkeypatch.setenv("STUB_FAIL_TABLE", models.BreakoutLabel.__tablename__)
+
+    with pytest.raises(errors.BackupError, match="already replaced: user\\.") as error:
+        nativedump.restore(str(tmp_path / "dump"), location=STUBS)
+
+    assert "exit code 1" in str(error.value)
+    assert restored_tables(stub_clients) == [models.User.__tablename__]
+
+
+def test_export_preferred_falls_back_to_json(db, stub_clients, tmp_path, monkeypatch):
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(config, "DATABASE_BACKEND", "mysql")
+    monkeypatch.setattr(config, "DATABASE_DUMP_LOCATION", str(tmp_path / "no clients here"))
+
+    result = backup.export_preferred(str(tmp_path / "backup.json"), manifest=manifest)
+
+    assert isinstance(result, backup.BackupResult)
+    assert os.path.isfile(tmp_path / "backup.json")
+
+
+def test_export_preferred_uses_mysqldump_when_configured(stub_clients, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_BACKEND", "mysql")
+    monkeypatch.setattr(config, "DATABASE_DUMP_LOCATION", STUBS)
+
+    result = backup.export_preferred(str(tmp_path / "backup.json"))
+
+    assert isinstance(result, nativedump.NativeDumpResult)
+    assert result.folder == str(tmp_path / "backup")
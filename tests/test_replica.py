@@ -0,0 +1,51 @@
+import threading
+from datetime import datetime, timedelta
+
+from harnesslabeler import backup, models, replica
+from harnesslabeler.database import DBContext
+
+
+def test_sync_copies_restored_labels(db, tmp_path):
+    label_replica = replica.LabelReplica(str(tmp_path / "replica.sqlite3"))
+    manifest = backup.BackupManifest(file_path=str(tmp_path / "manifest.json"))
+    saved = datetime.now().replace(microsecond=0) - timedelta(days=1)
+    with DBContext() as session:
+        session.add(models.BreakoutLabel(part_number="P1", value="before", sort_index=1, rolling_label=False, date_created=saved, date_modified=saved))
+        session.commit()
+    backup.export_full(str(tmp_path / "full.json"), manifest=manifest)
+
+    with DBContext() as session:
+        label = session.query(models.BreakoutLabel).one()
+        label.value = "after"
+        label.date_modified = datetime.now().replace(microsecond=0)
+        session.commit()
+    label_replica.sync()
+    assert [row.value for row in label_replica.search("P1")] == ["after"]
+
+    backup.restore_data(backup.load_backup(str(tmp_path / "full.json")), manifest=manifest)
+    label_replica.sync()
+
+    assert [row.value for row in label_replica.search("P1")] == ["before"]
+
+
+def test_woken_sync_picks_up_a_change_and_notifies(db, tmp_path):
+    label_replica = replica.LabelReplica(str(tmp_path / "replica.sqlite3"))
+    sync = replica.ReplicaSync(label_replica, interval=3600)
+    synced = threading.Event()
+    sync.listeners.append(synced.set)
+    sync.start()
+    try:
+        assert synced.wait(10)
+        synced.clear()
+        with DBContext() as session:
+            now = datetime.now().replace(microsecond=0)
+            session.add(models.BreakoutLabel(part_number="P1", value="new", sort_index=1, rolling_label=False, date_created=now, date_modified=now))
+            session.commit()
+
+        sync.wake()
+
+        assert synced.wait(10)
+        assert [row.value for row in label_replica.search("P1")] == ["new"]
+    finally:
+        sync.stop()
+        sync.join(10)
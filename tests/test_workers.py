@@ -0,0 +1,59 @@
+import time
+
+import pytest
+from PyQt5 import QtCore
+
+from harnesslabeler import errors
+from harnesslabeler.workers import Worker
+
+
+class Sender(QtCore.QObject):
+    cancel_requested = QtCore.pyqtSignal()
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def wait_for(worker: Worker, app, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while worker.thread.isRunning() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    worker.thread.wait(1000)
+
+
+def slow_task(progress):
+    progress.start("Working", 500)
+    for _ in range(500):
+        time.sleep(0.01)
+        progress.advance(1)
+        progress.check_cancelled()
+    return "done"
+
+
+def test_cancel_stops_running_task(app):
+    worker = Worker(slow_task)
+    sender = Sender()
+    worker.connect_cancel(sender.cancel_requested)
+    started = time.monotonic()
+    worker.start()
+    time.sleep(0.2)
+    sender.cancel_requested.emit()
+    wait_for(worker, app, 5)
+
+    assert time.monotonic() - started < 2
+    assert worker.cancelled
+    assert isinstance(worker.error, errors.OperationCancelled)
+    assert worker.result is None
+
+
+def test_task_result_without_cancel(app):
+    worker = Worker(lambda progress: 42)
+    worker.start()
+    wait_for(worker, app, 5)
+
+    assert worker.result == 42
+    assert not worker.cancelled
+    assert worker.error is None